@@ -0,0 +1,92 @@
+import asyncio
+import time
+from config import ANSWER_LOG_FLUSH_INTERVAL, ANSWER_LOG_MAX_BATCH
+
+
+class AnswerLog:
+    """Буферизованная запись журнала ответов.
+
+    Ответы копятся в памяти и пачкой передаются в хранилище
+    (save_answers) фоновой задачей раз в flush_interval секунд или
+    сразу, как только набралось max_batch записей. Обработчик ответа
+    не ждет записи в базу. Время ответа считается от отправки вопроса.
+    """
+
+    # Через сколько секунд забывать вопрос, на который так и не ответили
+    PENDING_TTL = 3600
+
+    def __init__(self, db, flush_interval: float = ANSWER_LOG_FLUSH_INTERVAL,
+                 max_batch: int = ANSWER_LOG_MAX_BATCH):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_batch = max(1, max_batch)
+        self._buffer = []
+        self._asked_at = {}  # user_id -> время отправки текущего вопроса
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self._wakeup = asyncio.Event()
+        self._closing = False
+
+    async def start(self):
+        """Запустить фоновую запись журнала"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Остановить фоновую запись и сохранить накопленные ответы"""
+        if self._flush_task is not None:
+            # Задачу не отменяем, а будим и дожидаемся: отмена посреди
+            # записи потеряла бы уже взятые из буфера ответы
+            self._closing = True
+            self._wakeup.set()
+            await self._flush_task
+            self._flush_task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ Ошибка при записи журнала ответов: {e}")
+            self._forget_stale()
+
+    def _forget_stale(self):
+        deadline = time.monotonic() - self.PENDING_TTL
+        for user_id in [u for u, asked in self._asked_at.items() if asked < deadline]:
+            del self._asked_at[user_id]
+
+    def question_sent(self, user_id: int):
+        """Отметить время отправки вопроса пользователю"""
+        self._asked_at[user_id] = time.monotonic()
+
+    def record(self, user_id: int, history_id: int, question_id: int,
+               chosen_option: int, is_correct: bool):
+        """Добавить ответ в журнал (запишется в базу в фоне)"""
+        asked = self._asked_at.pop(user_id, None)
+        response_ms = round((time.monotonic() - asked) * 1000) if asked is not None else None
+        self._buffer.append((
+            user_id, history_id, question_id, chosen_option, int(is_correct),
+            response_ms, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        ))
+        if len(self._buffer) >= self.max_batch:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Записать накопленные ответы"""
+        async with self._flush_lock:
+            while self._buffer:
+                rows = self._buffer[:self.max_batch]
+                del self._buffer[:self.max_batch]
+                try:
+                    await self.db.save_answers(rows)
+                except BaseException:
+                    # Вернем ответы в начало буфера и попробуем позже
+                    # (в том числе при отмене вызывающей задачи)
+                    self._buffer[:0] = rows
+                    raise
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""Резервные копии базы данных Python Quiz Bot.
+
+Копии снимаются онлайн через backup API SQLite небольшими порциями
+страниц, поэтому бот продолжает работать. Все шарды одной копии
+получают одну метку времени, хранятся последние BACKUP_KEEP копий.
+
+Команды:
+  python backup.py create             - снять копию сейчас
+  python backup.py list               - показать сохраненные копии
+  python backup.py restore STAMP      - восстановить копию (бот должен быть остановлен)
+"""
+import aiosqlite
+import argparse
+import asyncio
+import os
+import re
+import shutil
+import time
+from config import (
+    DB_NAME, DB_SHARDS, BACKUP_DIR, BACKUP_INTERVAL, BACKUP_KEEP, BACKUP_PAGES, BACKUP_PAUSE
+)
+from database import shard_paths
+
+STAMP_PATTERN = re.compile(r'\d{8}-\d{6}')
+
+
+def _backup_path(directory: str, path: str, stamp: str) -> str:
+    root, ext = os.path.splitext(os.path.basename(path))
+    return os.path.join(directory, f"{root}.{stamp}{ext}")
+
+
+def list_backups(paths: list, directory: str = BACKUP_DIR) -> list:
+    """Метки времени полных копий (есть файлы всех шардов), от новых к старым"""
+    if not os.path.isdir(directory):
+        return []
+    files = set(os.listdir(directory))
+    stamps = set()
+    first_root, first_ext = os.path.splitext(os.path.basename(paths[0]))
+    for name in files:
+        if name.startswith(first_root + '.') and name.endswith(first_ext):
+            stamp = name[len(first_root) + 1:len(name) - len(first_ext)]
+            if STAMP_PATTERN.fullmatch(stamp):
+                stamps.add(stamp)
+    complete = [
+        stamp for stamp in stamps
+        if all(os.path.basename(_backup_path(directory, path, stamp)) in files for path in paths)
+    ]
+    return sorted(complete, reverse=True)
+
+
+class BackupJob:
+    """Фоновое создание резервных копий шардов.
+
+    Копия снимается внутри читающей транзакции: в режиме WAL она видит
+    согласованный снимок и не перезапускается из-за записей бота, а сами
+    записи при этом не блокируются. Между порциями по pages страниц
+    делается пауза pause секунд (в потоке соединения, цикл событий
+    при этом не блокируется). Во время копирования измеряется
+    задержка цикла событий - насколько копия замедляет обработчики.
+    """
+
+    # Период замера задержки цикла событий (сек)
+    LAG_PROBE_INTERVAL = 0.05
+
+    def __init__(self, paths: list, directory: str = BACKUP_DIR,
+                 interval: float = BACKUP_INTERVAL, keep: int = BACKUP_KEEP,
+                 pages: int = BACKUP_PAGES, pause: float = BACKUP_PAUSE):
+        self.paths = paths
+        self.directory = directory
+        self.interval = interval
+        self.keep = max(1, keep)
+        self.pages = max(1, pages)
+        self.pause = pause
+        self._task = None
+
+    async def start(self):
+        """Запустить периодическое создание копий"""
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        """Остановить создание копий (незавершенная копия отбрасывается)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.create()
+            except Exception as e:
+                print(f"⚠️ Ошибка при создании резервной копии: {e}")
+
+    async def _copy(self, path: str, target_path: str):
+        partial = target_path + '.partial'
+        if os.path.exists(partial):
+            os.remove(partial)
+        try:
+            async with aiosqlite.connect(path) as source, aiosqlite.connect(partial) as target:
+                # Фиксируем снимок: без открытой транзакции копия
+                # начиналась бы заново после каждой записи бота
+                await source.execute("BEGIN")
+                await source.execute("SELECT 1 FROM sqlite_master LIMIT 1")
+                await source.backup(target, pages=self.pages, progress=self._pace)
+                await source.rollback()
+            os.replace(partial, target_path)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+
+    def _pace(self, status: int, remaining: int, total: int):
+        # Вызывается в потоке соединения aiosqlite после каждой порции;
+        # параметр sleep у backup() действует только при занятой базе
+        if remaining:
+            time.sleep(self.pause)
+
+    async def _probe_lag(self, samples: list):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.LAG_PROBE_INTERVAL)
+            samples.append(time.monotonic() - started - self.LAG_PROBE_INTERVAL)
+
+    async def create(self) -> str:
+        """Снять копию всех шардов, удалить лишние старые копии, вернуть метку"""
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.gmtime())
+        lags = []
+        probe = asyncio.create_task(self._probe_lag(lags))
+        started = time.monotonic()
+        try:
+            for path in self.paths:
+                await self._copy(path, _backup_path(self.directory, path, stamp))
+        finally:
+            probe.cancel()
+        elapsed = time.monotonic() - started
+
+        max_lag = max(lags, default=0) * 1000
+        avg_lag = sum(lags) / len(lags) * 1000 if lags else 0
+        print(f"💾 Резервная копия {stamp} создана за {elapsed:.2f} с, "
+              f"задержка цикла событий: средняя {avg_lag:.1f} мс, максимальная {max_lag:.1f} мс")
+        self._rotate()
+        return stamp
+
+    def _rotate(self):
+        for stamp in list_backups(self.paths, self.directory)[self.keep:]:
+            for path in self.paths:
+                os.remove(_backup_path(self.directory, path, stamp))
+            print(f"🗑 Удалена старая резервная копия {stamp}")
+
+
+def restore(paths: list, stamp: str, directory: str = BACKUP_DIR):
+    """Заменить файлы базы копией stamp; текущие файлы сохраняются как *.bak"""
+    if stamp not in list_backups(paths, directory):
+        print(f"Резервная копия {stamp} не найдена.")
+        return
+    for path in paths:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.replace(path + suffix, path + suffix + '.bak')
+    for path in paths:
+        temp = path + '.restore'
+        shutil.copyfile(_backup_path(directory, path, stamp), temp)
+        os.replace(temp, path)
+    print(f" База данных восстановлена из копии {stamp}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Резервные копии базы данных Python Quiz Bot")
+    parser.add_argument('--db', default=DB_NAME, help="имя базы данных (по умолчанию из config.py)")
+    parser.add_argument('--shards', type=int, default=DB_SHARDS, help="число шардов (по умолчанию из config.py)")
+    parser.add_argument('--dir', default=BACKUP_DIR, help="каталог с копиями (по умолчанию из config.py)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('create', help="снять копию сейчас")
+    commands.add_parser('list', help="показать сохраненные копии")
+    restore_parser = commands.add_parser('restore', help="восстановить копию")
+    restore_parser.add_argument('stamp', help="метка времени копии из list")
+
+    args = parser.parse_args()
+    db_paths = shard_paths(args.db, args.shards)
+
+    if args.command == 'create':
+        asyncio.run(BackupJob(db_paths, args.dir).create())
+    elif args.command == 'list':
+        backups = list_backups(db_paths, args.dir)
+        if not backups:
+            print("Резервных копий нет.")
+        for backup_stamp in backups:
+            print(f" {backup_stamp}")
+    elif args.command == 'restore':
+        restore(db_paths, args.stamp, args.dir)
@@ -1,9 +1,15 @@
 import asyncio
 import logging
+import signal
 from aiogram import Bot, Dispatcher
-from config import API_TOKEN, LOG_LEVEL
-from database import Database
-from handlers import register_handlers
+from config import (
+    API_TOKEN, LOG_LEVEL, STORAGE_BACKEND, BOT_MODE, BOT_WORKERS, WEBHOOK_URL, WEBHOOK_PATH
+)
+from handlers import register_handlers, db, sessions, answers, callbacks, scheduler
+from backup import BackupJob
+from rate_limiter import OutboundLimiter
+from webhook import WebhookServer
+from workers import Supervisor, UpdateConsumer, UpdatePoller, RoutingWebhookServer
 import sys
 
 
@@ -19,6 +25,144 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# Резервные копии снимаются только для SQLite
+backups = BackupJob(db.shard_paths) if STORAGE_BACKEND == 'sqlite' else None
+# Исходящие сообщения ограничиваются под лимиты Telegram
+limiter = OutboundLimiter()
+
+
+async def wait_for_stop():
+    """Ждать SIGINT или SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+
+async def run_webhook(server: WebhookServer, dp: Dispatcher, bot: Bot):
+    """Принимать обновления через webhook до сигнала остановки"""
+    if WEBHOOK_URL and not server.secret:
+        # Без секрета любой, кто узнает адрес, сможет присылать боту обновления
+        logger.error("WEBHOOK_SECRET не задан, webhook не будет зарегистрирован")
+        return
+    
+    await server.start()
+    try:
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=server.secret,
+                allowed_updates=dp.resolve_used_update_types()
+            )
+            logger.info("Webhook зарегистрирован в Telegram")
+        await wait_for_stop()
+    finally:
+        if WEBHOOK_URL:
+            # Иначе после перехода на polling Telegram продолжит слать
+            # обновления на остановленный сервер
+            try:
+                await bot.delete_webhook()
+                logger.info("Webhook удален из Telegram")
+            except Exception as e:
+                logger.warning(f"Не удалось удалить webhook: {e}")
+        await server.close()
+
+
+async def start_services(dp: Dispatcher):
+    """Подключить базу, запустить фоновые задачи и зарегистрировать хендлеры"""
+    await limiter.start()
+    
+    # Инициализация базы данных
+    logger.info("Инициализация базы данных...")
+    await db.create_tables()
+    await sessions.start()
+    await answers.start()
+    await callbacks.start()
+    await scheduler.start()
+    if backups is not None:
+        await backups.start()
+    logger.info("База данных инициализирована")
+    
+    # Регистрация хендлеров
+    logger.info("Регистрация хендлеров...")
+    register_handlers(dp)
+    logger.info("Хендлеры зарегистрированы")
+
+
+async def stop_services(bot: Bot = None):
+    """Сохранить несохраненные сессии, ответы и обработанные нажатия и закрыть соединения с базой данных"""
+    if backups is not None:
+        await backups.close()
+    # Отложенные вопросы отправляются до сохранения сессий
+    await scheduler.close()
+    await limiter.close()
+    if bot is not None:
+        await bot.session.close()
+    await sessions.close()
+    await answers.close()
+    await callbacks.close()
+    await db.close()
+
+
+async def run_supervisor():
+    """Получать обновления и распределять их по процессам-обработчикам"""
+    if STORAGE_BACKEND == 'memory':
+        logger.error("Многопроцессный режим требует общего хранилища (sqlite или redis)")
+        return
+    
+    supervisor = Supervisor(BOT_WORKERS, run_worker)
+    await supervisor.start()
+    bot = Bot(token=API_TOKEN)
+    dp = Dispatcher()
+    register_handlers(dp)
+    try:
+        logger.info(f"Бот запущен, обработчиков: {BOT_WORKERS}")
+        if BOT_MODE == 'webhook':
+            await run_webhook(RoutingWebhookServer(supervisor.route), dp, bot)
+        else:
+            # getUpdates не работает, пока у бота зарегистрирован webhook
+            await bot.delete_webhook()
+            poller = asyncio.create_task(
+                UpdatePoller(bot, supervisor.route, dp.resolve_used_update_types()).run()
+            )
+            try:
+                await wait_for_stop()
+            finally:
+                poller.cancel()
+                await asyncio.gather(poller, return_exceptions=True)
+    finally:
+        await supervisor.close()
+        await bot.session.close()
+
+
+async def _worker_main(index: int, updates):
+    bot = None
+    try:
+        bot = Bot(token=API_TOKEN)
+        bot.session.middleware(limiter)
+        dp = Dispatcher()
+        await start_services(dp)
+        logger.info(f"Обработчик {index} готов к работе")
+        await UpdateConsumer(dp, bot, updates).run()
+    except Exception as e:
+        logger.error(f"Критическая ошибка в обработчике {index}: {e}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        await stop_services(bot)
+        logger.info(f"Обработчик {index} остановлен")
+
+
+def run_worker(index: int, updates):
+    """Точка входа процесса-обработчика"""
+    # Останавливает обработчик диспетчер (через очередь), а не Ctrl+C или
+    # SIGTERM, отправленный всей группе процессов (например, systemd)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_worker_main(index, updates))
+
+
 async def main():
     # Проверка токена
     if not API_TOKEN:
@@ -26,36 +170,42 @@ async def main():
         return
     
     logger.info("Запуск бота...")
+    if BOT_WORKERS > 1:
+        try:
+            await run_supervisor()
+        except Exception as e:
+            logger.error(f"Критическая ошибка: {e}")
+        logger.info("Бот остановлен")
+        return
+    
+    bot = None
     
     try:
         # Инициализация бота и диспетчера
         bot = Bot(token=API_TOKEN)
+        bot.session.middleware(limiter)
         dp = Dispatcher()
-        
-        # Инициализация базы данных
-        logger.info("Инициализация базы данных...")
-        db = Database()
-        await db.create_tables()
-        logger.info("База данных инициализирована")
-        
-        # Регистрация хендлеров
-        logger.info("Регистрация хендлеров...")
-        register_handlers(dp)
-        logger.info("Хендлеры зарегистрированы")
+        await start_services(dp)
         
         # Запуск бота
         logger.info("Бот запущен и готов к работе!")
         logger.info("Логи будут сохраняться в quiz_bot.log")
         
-        await dp.start_polling(bot)
+        if BOT_MODE == 'webhook':
+            await run_webhook(WebhookServer(dp, bot), dp, bot)
+        else:
+            # getUpdates не работает, пока у бота зарегистрирован webhook
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
         
     except Exception as e:
         logger.error(f"Критическая ошибка: {e}")
         import traceback
         traceback.print_exc()
     finally:
+        await stop_services(bot)
         logger.info("Бот остановлен")
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -7,8 +7,119 @@ load_dotenv()
 # Токен бота из переменных окружения
 API_TOKEN = os.getenv('BOT_TOKEN', '8558776620:AAFsVUVWabCbosd5xSe1RYS-o1PLx3brz5o')
 
+# Telegram id администраторов через запятую (для служебных команд)
+ADMIN_IDS = {int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()}
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Webhook: публичный адрес бота (пусто - не регистрировать webhook в Telegram,
+# например при локальной проверке), путь, секрет, адрес и порт встроенного
+# сервера, число обработчиков и размер очереди обновлений
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '16'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+
+# Число процессов-обработчиков обновлений (больше 1 - обновления
+# распределяются по процессам по user_id) и сколько обновлений
+# обработчик выполняет одновременно
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '1'))
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', '64'))
+
+# Хранилище: sqlite, memory или redis
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
 # Настройки базы данных
 DB_NAME = 'quiz_bot.db'
 
+# Количество файлов-шардов базы данных (данные распределяются по user_id)
+DB_SHARDS = int(os.getenv('DB_SHARDS', '1'))
+
+# Держать рейтинг игроков и счетчики вопросов в памяти
+# (иначе они собираются запросами к шардам)
+LEADERBOARD_IN_MEMORY = os.getenv('LEADERBOARD_IN_MEMORY', '1') == '1'
+
+# Как часто удалять устаревшие рейтинги за день и неделю (сек)
+PERIOD_PRUNE_INTERVAL = float(os.getenv('PERIOD_PRUNE_INTERVAL', '3600'))
+
+# Выполнять фоновые задачи базы (перенос данных миграций, очистку рейтингов,
+# обслуживание); в многопроцессном режиме включено только в одном обработчике
+DB_BACKGROUND_JOBS = os.getenv('DB_BACKGROUND_JOBS', '1') == '1'
+
+# Размер пула соединений и интервал проверки простаивающих соединений (сек)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '4'))
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.getenv('DB_POOL_HEALTHCHECK_INTERVAL', '30'))
+
+# Количество полос блокировок для изменений состояния пользователей
+DB_LOCK_STRIPES = int(os.getenv('DB_LOCK_STRIPES', '64'))
+
+# Режим одного писателя: все изменения шарда идут через одно соединение
+# с очередью, а пул соединений используется только для чтения
+DB_SINGLE_WRITER = os.getenv('DB_SINGLE_WRITER', '0') == '1'
+DB_WRITER_MAX_BATCH = int(os.getenv('DB_WRITER_MAX_BATCH', '256'))
+
+# Групповая фиксация обновлений quiz_state: окно ожидания (сек) и размер пачки
+DB_GROUP_COMMIT_WINDOW = float(os.getenv('DB_GROUP_COMMIT_WINDOW', '0.005'))
+DB_GROUP_COMMIT_MAX_BATCH = int(os.getenv('DB_GROUP_COMMIT_MAX_BATCH', '256'))
+
+# Кэш сессий квиза: максимальный размер, время простоя до вытеснения (сек)
+# и интервал отложенной записи изменений в базу (сек)
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '10000'))
+SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', '900'))
+SESSION_FLUSH_INTERVAL = float(os.getenv('SESSION_FLUSH_INTERVAL', '0.2'))
+
+# Резервные копии: каталог, интервал (сек, 0 - не создавать), сколько хранить,
+# размер порции копирования (страниц) и пауза между порциями (сек)
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+BACKUP_INTERVAL = float(os.getenv('BACKUP_INTERVAL', '21600'))
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '7'))
+BACKUP_PAGES = int(os.getenv('BACKUP_PAGES', '256'))
+BACKUP_PAUSE = float(os.getenv('BACKUP_PAUSE', '0.01'))
+
+# Хранение истории квизов: через сколько дней записи сворачиваются в
+# помесячные итоги и через сколько часов удаляются брошенные квизы
+HISTORY_RETENTION_DAYS = float(os.getenv('HISTORY_RETENTION_DAYS', '180'))
+HISTORY_PLACEHOLDER_HOURS = float(os.getenv('HISTORY_PLACEHOLDER_HOURS', '24'))
+
+# Ежедневное обслуживание базы: час запуска (UTC, -1 - не запускать),
+# размер порции, пауза между порциями (сек) и порция VACUUM (страниц)
+MAINTENANCE_HOUR = int(os.getenv('MAINTENANCE_HOUR', '4'))
+MAINTENANCE_BATCH = int(os.getenv('MAINTENANCE_BATCH', '500'))
+MAINTENANCE_PAUSE = float(os.getenv('MAINTENANCE_PAUSE', '0.05'))
+VACUUM_PAGES = int(os.getenv('VACUUM_PAGES', '256'))
+
+# Журнал ответов: интервал фоновой записи (сек) и размер пачки
+ANSWER_LOG_FLUSH_INTERVAL = float(os.getenv('ANSWER_LOG_FLUSH_INTERVAL', '1.0'))
+ANSWER_LOG_MAX_BATCH = int(os.getenv('ANSWER_LOG_MAX_BATCH', '500'))
+
+# Пауза перед отправкой следующего вопроса после ответа (сек)
+NEXT_QUESTION_DELAY = float(os.getenv('NEXT_QUESTION_DELAY', '1.0'))
+
+# Компактный режим ответа: ответ, вердикт и объяснение дописываются в
+# сообщение с вопросом одной правкой вместо отдельных сообщений
+COMPACT_FEEDBACK = os.getenv('COMPACT_FEEDBACK', '0') == '1'
+
+# Ограничение исходящих сообщений: общий лимит бота (в секунду), лимит
+# одного чата (в секунду) и допустимый всплеск, число повторов после 429
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '25'))
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', '1'))
+OUTBOUND_CHAT_BURST = float(os.getenv('OUTBOUND_CHAT_BURST', '5'))
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '3'))
+
+# Защита от повторной обработки нажатий: сколько последних нажатий помнить,
+# файл для сохранения между перезапусками и интервал сохранения (сек)
+DEDUP_CAPACITY = int(os.getenv('DEDUP_CAPACITY', '10000'))
+DEDUP_FILE = os.getenv('DEDUP_FILE', 'callbacks.dedup')
+DEDUP_SAVE_INTERVAL = float(os.getenv('DEDUP_SAVE_INTERVAL', '5'))
+
+# Сколько профилей пользователей помнить, чтобы не перезаписывать
+# неизменившиеся имена при каждом старте квиза
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '100000'))
+
 # Настройки логирования
 LOG_LEVEL = 'INFO'
\ No newline at end of file
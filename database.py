@@ -1,341 +1,916 @@
 import aiosqlite
-import json
 import asyncio
-from config import DB_NAME
+import heapq
+import itertools
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from leaderboard import Leaderboard, player_summary
+from migrations import LATEST_VERSION, get_schema_status, apply_migrations, run_backfills
+from question_codec import pack_questions, unpack_questions
+from question_stats import QuestionStats, count_answers
+from retention import run_maintenance
+from storage import Storage
+from config import (
+    DB_NAME, DB_POOL_SIZE, DB_POOL_HEALTHCHECK_INTERVAL, DB_LOCK_STRIPES,
+    DB_GROUP_COMMIT_WINDOW, DB_GROUP_COMMIT_MAX_BATCH, DB_SHARDS, LEADERBOARD_IN_MEMORY,
+    DB_SINGLE_WRITER, DB_WRITER_MAX_BATCH, PROFILE_CACHE_SIZE, PERIOD_PRUNE_INTERVAL,
+    MAINTENANCE_HOUR, DB_BACKGROUND_JOBS
+)
 
 
-class Database:
-    def __init__(self, db_name: str = DB_NAME):
+class ConnectionPool:
+    """Пул долгоживущих соединений aiosqlite.
+
+    Соединения открываются лениво (не больше size штук), PRAGMA применяются
+    один раз при открытии, а соединения, простаивавшие дольше
+    healthcheck_interval секунд, проверяются перед выдачей.
+    """
+
+    PRAGMAS = (
+        # Действует только для новой базы (до создания первой таблицы)
+        "PRAGMA auto_vacuum = INCREMENTAL",
+        "PRAGMA foreign_keys = ON",
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA busy_timeout = 5000",
+    )
+
+    def __init__(self, db_name: str, size: int = DB_POOL_SIZE,
+                 healthcheck_interval: float = DB_POOL_HEALTHCHECK_INTERVAL,
+                 read_only: bool = False):
         self.db_name = db_name
-        self._lock = asyncio.Lock()
+        self.size = max(1, size)
+        self.pragmas = self.PRAGMAS + (("PRAGMA query_only = ON",) if read_only else ())
+        self.healthcheck_interval = healthcheck_interval
+        self._semaphore = asyncio.Semaphore(self.size)
+        self._idle = []  # [(соединение, время последнего использования)]
+        self._all = set()
+        self._closed = False
+
+    async def _open(self):
+        """Открыть новое соединение и применить PRAGMA"""
+        conn = await aiosqlite.connect(self.db_name)
+        try:
+            for pragma in self.pragmas:
+                await conn.execute(pragma)
+        except Exception:
+            await conn.close()
+            raise
+        self._all.add(conn)
+        return conn
+
+    async def _discard(self, conn):
+        """Закрыть соединение и убрать его из пула"""
+        self._all.discard(conn)
+        try:
+            await conn.close()
+        except Exception as e:
+            print(f"⚠️ Ошибка при закрытии соединения: {e}")
+
+    async def _is_healthy(self, conn) -> bool:
+        try:
+            async with conn.execute("SELECT 1") as cursor:
+                await cursor.fetchone()
+            return True
+        except Exception as e:
+            print(f"⚠️ Соединение с базой данных не прошло проверку: {e}")
+            return False
+
+    async def _checkout(self):
+        """Взять соединение из простаивающих или открыть новое"""
+        while self._idle:
+            conn, last_used = self._idle.pop()
+            if time.monotonic() - last_used < self.healthcheck_interval:
+                return conn
+            if await self._is_healthy(conn):
+                return conn
+            await self._discard(conn)
+        return await self._open()
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Получить соединение из пула на время блока async with"""
+        if self._closed:
+            raise RuntimeError("Пул соединений закрыт")
+        async with self._semaphore:
+            conn = await self._checkout()
+            try:
+                yield conn
+            finally:
+                await self._release(conn)
+
+    async def _release(self, conn):
+        if self._closed:
+            await self._discard(conn)
+            return
+        try:
+            # Не оставляем в пуле соединение с незавершенной транзакцией
+            if conn.in_transaction:
+                await conn.rollback()
+        except Exception as e:
+            print(f"⚠️ Ошибка при возврате соединения в пул: {e}")
+            await self._discard(conn)
+            return
+        self._idle.append((conn, time.monotonic()))
+
+    async def close(self):
+        """Закрыть все соединения пула"""
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            await self._discard(conn)
+
+
+class GroupCommitWriter:
+    """Групповая фиксация коротких записей.
     
-    async def create_tables(self):
-        """Создание таблиц базы данных"""
-        async with self._lock:
-            async with aiosqlite.connect(self.db_name) as db:
-                # Включаем поддержку внешних ключей
-                await db.execute("PRAGMA foreign_keys = ON")
-                await db.execute("PRAGMA journal_mode=WAL")
-                await db.execute("PRAGMA synchronous=NORMAL")
-                
-                # Таблица состояния квиза
-                await db.execute('''
-                    CREATE TABLE IF NOT EXISTS quiz_state (
-                        user_id INTEGER PRIMARY KEY,
-                        question_index INTEGER DEFAULT 0,
-                        score INTEGER DEFAULT 0,
-                        completed INTEGER DEFAULT 0,
-                        used_questions TEXT DEFAULT '[]',
-                        current_questions TEXT DEFAULT '[]'
-                    )
-                ''')
-                
-                # Таблица статистики пользователей
-                await db.execute('''
-                    CREATE TABLE IF NOT EXISTS user_stats (
-                        user_id INTEGER PRIMARY KEY,
-                        username TEXT,
-                        first_name TEXT,
-                        last_name TEXT,
-                        total_quizzes INTEGER DEFAULT 0,
-                        total_correct INTEGER DEFAULT 0,
-                        total_questions INTEGER DEFAULT 0,
-                        best_score INTEGER DEFAULT 0,
-                        last_quiz_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                # Таблица истории квизов
-                await db.execute('''
-                    CREATE TABLE IF NOT EXISTS quiz_history (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        score INTEGER,
-                        total_questions INTEGER,
-                        quiz_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES user_stats (user_id)
-                    )
-                ''')
-                
+    Записи от разных пользователей копятся не дольше window секунд
+    (или до max_batch штук) и выполняются одной транзакцией через
+    executemany. Вызывающий submit ждет, пока его запись не будет
+    зафиксирована. Порядок записей сохраняется.
+    """
+
+    def __init__(self, pool: ConnectionPool, window: float = DB_GROUP_COMMIT_WINDOW,
+                 max_batch: int = DB_GROUP_COMMIT_MAX_BATCH):
+        self.pool = pool
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self._pending = []  # [(sql, список параметров, future)]
+        self._pending_rows = 0
+        self._batch_full = asyncio.Event()
+        self._task = None
+
+    async def submit(self, sql: str, rows: list):
+        """Поставить запись в очередь и дождаться ее фиксации"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((sql, rows, future))
+        self._pending_rows += len(rows)
+        if self._pending_rows >= self.max_batch:
+            self._batch_full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        await future
+
+    async def _run(self):
+        while self._pending:
+            if self._pending_rows < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+            self._batch_full.clear()
+            batch, self._pending, self._pending_rows = self._pending, [], 0
+            await self._commit(batch)
+
+    async def _commit(self, batch):
+        try:
+            async with self.pool.acquire() as db:
+                # Подряд идущие записи с одинаковым SQL объединяем в один executemany
+                start = 0
+                while start < len(batch):
+                    sql = batch[start][0]
+                    end = start
+                    rows = []
+                    while end < len(batch) and batch[end][0] == sql:
+                        rows.extend(batch[end][1])
+                        end += 1
+                    await db.executemany(sql, rows)
+                    start = end
                 await db.commit()
-                print("✅ Таблицы базы данных созданы успешно")
-                
-                # Проверяем и добавляем отсутствующие колонки
-                await self._migrate_database(db)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    async def close(self):
+        """Дождаться фиксации всех поставленных записей"""
+        if self._task is not None:
+            self._batch_full.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+class SingleWriter:
+    """Единственный писатель шарда с очередью запросов.
     
-    async def _migrate_database(self, db):
-        """Миграция базы данных - добавление отсутствующих колонок"""
+    Все изменения выполняются одной фоновой задачей на одном долгоживущем
+    соединении. Подряд стоящие в очереди операции объединяются в одну
+    транзакцию (каждая в своем SAVEPOINT, так что ошибка одной операции
+    не отменяет остальные); вызывающий получает результат после фиксации.
+    """
+
+    def __init__(self, db_name: str, max_batch: int = DB_WRITER_MAX_BATCH):
+        self.db_name = db_name
+        self.max_batch = max(1, max_batch)
+        self._queue = asyncio.Queue()
+        self._db = None
+        self._lock = asyncio.Lock()
+        self._start_lock = asyncio.Lock()
+        self._task = None
+
+    async def start(self):
+        """Открыть соединение писателя и запустить обработку очереди"""
+        async with self._start_lock:
+            if self._task is not None:
+                return
+            self._db = await aiosqlite.connect(self.db_name)
+            for pragma in ConnectionPool.PRAGMAS:
+                await self._db.execute(pragma)
+            self._task = asyncio.create_task(self._run())
+
+    async def run(self, op):
+        """Выполнить op(db) в очереди писателя и дождаться фиксации"""
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((op, future))
+        return await future
+
+    async def submit(self, sql: str, rows: list):
+        """Выполнить executemany в очереди писателя"""
+        async def op(db):
+            await db.executemany(sql, rows)
+        await self.run(op)
+
+    @asynccontextmanager
+    async def exclusive(self):
+        """Монопольный доступ к соединению писателя (для миграций)"""
+        await self.start()
+        async with self._lock:
+            try:
+                yield self._db
+            finally:
+                if self._db.in_transaction:
+                    await self._db.rollback()
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            async with self._lock:
+                await self._execute(batch)
+            if stop:
+                return
+
+    async def _execute(self, batch):
+        db = self._db
+        outcomes = []
         try:
-            # Проверяем существование колонок в user_stats
-            async with db.execute("PRAGMA table_info(user_stats)") as cursor:
-                columns = await cursor.fetchall()
-                column_names = [col[1] for col in columns]
-                
-                # Добавляем отсутствующие колонки
-                if 'username' not in column_names:
-                    await db.execute("ALTER TABLE user_stats ADD COLUMN username TEXT")
-                    print("✅ Добавлена колонка username в user_stats")
-                
-                if 'first_name' not in column_names:
-                    await db.execute("ALTER TABLE user_stats ADD COLUMN first_name TEXT")
-                    print("✅ Добавлена колонка first_name в user_stats")
-                
-                if 'last_name' not in column_names:
-                    await db.execute("ALTER TABLE user_stats ADD COLUMN last_name TEXT")
-                    print("✅ Добавлена колонка last_name в user_stats")
-                
-                if 'last_quiz_date' not in column_names:
-                    await db.execute("ALTER TABLE user_stats ADD COLUMN last_quiz_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-                    print("✅ Добавлена колонка last_quiz_date в user_stats")
-                
+            await db.execute("BEGIN IMMEDIATE")
+            for op, future in batch:
+                await db.execute("SAVEPOINT writer_op")
+                try:
+                    result = await op(db)
+                except Exception as e:
+                    await db.execute("ROLLBACK TO writer_op")
+                    outcomes.append((future, None, e))
+                else:
+                    outcomes.append((future, result, None))
+                await db.execute("RELEASE writer_op")
+            await db.commit()
+        except Exception as e:
+            if db.in_transaction:
+                await db.rollback()
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result, error in outcomes:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def close(self):
+        """Выполнить оставшиеся в очереди операции и закрыть соединение"""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await asyncio.gather(self._task, return_exceptions=True)
+        await self._db.close()
+        self._task = None
+
+
+# Корзины рейтингов за период: текущий день и понедельник текущей недели (UTC)
+PERIOD_BUCKETS = {
+    'day': "date('now')",
+    'week': "date('now', 'weekday 0', '-6 days')",
+}
+# Самая старая корзина, которую еще храним (текущая и предыдущая)
+PERIOD_KEEP_SINCE = {
+    'day': "date('now', '-1 day')",
+    'week': "date('now', 'weekday 0', '-13 days')",
+}
+
+
+def shard_paths(db_name: str, shards: int) -> list:
+    """Пути к файлам шардов: quiz_bot.db при одном шарде,
+    quiz_bot.shard0.db, quiz_bot.shard1.db, ... при нескольких"""
+    if shards <= 1:
+        return [db_name]
+    root, ext = os.path.splitext(db_name)
+    return [f"{root}.shard{i}{ext}" for i in range(shards)]
+
+
+def shard_index(user_id: int, shards: int) -> int:
+    """Номер шарда, в котором хранятся данные пользователя"""
+    return user_id % shards
+
+
+class Database(Storage):
+    """Хранилище на SQLite.
+    
+    Данные могут быть разбиты на DB_SHARDS файлов по user_id: все записи
+    пользователя лежат в одном шарде, у каждого шарда свой пул соединений
+    и своя групповая фиксация, поэтому запись масштабируется числом шардов.
+    """
+    
+    def __init__(self, db_name: str = DB_NAME, pool_size: int = DB_POOL_SIZE,
+                 lock_stripes: int = DB_LOCK_STRIPES, shards: int = DB_SHARDS,
+                 leaderboard_in_memory: bool = LEADERBOARD_IN_MEMORY,
+                 single_writer: bool = DB_SINGLE_WRITER,
+                 profile_cache_size: int = PROFILE_CACHE_SIZE,
+                 period_prune_interval: float = PERIOD_PRUNE_INTERVAL,
+                 maintenance_hour: int = MAINTENANCE_HOUR,
+                 background_jobs: bool = DB_BACKGROUND_JOBS):
+        self.db_name = db_name
+        self.shard_paths = shard_paths(db_name, shards)
+        if single_writer:
+            # Все записи идут через одного писателя на шард,
+            # пул используется только для чтения
+            self.pools = [ConnectionPool(path, pool_size, read_only=True) for path in self.shard_paths]
+            self._writers = [SingleWriter(path) for path in self.shard_paths]
+            self._state_writers = self._writers
+        else:
+            self.pools = [ConnectionPool(path, pool_size) for path in self.shard_paths]
+            self._writers = None
+            self._state_writers = [GroupCommitWriter(pool) for pool in self.pools]
+        self._schema_lock = asyncio.Lock()
+        self._background_tasks = []
+        # Без рейтинга в памяти топ собирается запросами ко всем шардам
+        self.leaderboard = Leaderboard() if leaderboard_in_memory else None
+        self.question_stats = QuestionStats() if leaderboard_in_memory else None
+        # Полосатые блокировки: изменения состояния одного пользователя
+        # сериализуются, разные пользователи работают параллельно.
+        # Чтения идут без блокировок (WAL допускает параллельных читателей).
+        self._user_locks = [asyncio.Lock() for _ in range(max(1, lock_stripes))]
+        # Последний записанный профиль пользователя: user_id -> (username, first_name, last_name)
+        self._profiles = OrderedDict()
+        self._profiles_size = max(0, profile_cache_size)
+        self.period_prune_interval = period_prune_interval
+        self.maintenance_hour = maintenance_hour
+        # Перенос данных, очистку рейтингов и обслуживание выполняет
+        # только один процесс из работающих с базой
+        self.background_jobs = background_jobs
+    
+    def _user_lock(self, user_id: int) -> asyncio.Lock:
+        """Блокировка полосы, к которой относится пользователь"""
+        return self._user_locks[hash(user_id) % len(self._user_locks)]
+    
+    def _shard(self, user_id: int) -> int:
+        return shard_index(user_id, len(self.pools))
+    
+    def _pool(self, user_id: int) -> ConnectionPool:
+        """Пул соединений шарда пользователя"""
+        return self.pools[self._shard(user_id)]
+    
+    def _maintenance_connection(self, shard: int):
+        """Соединение для миграций шарда: из пула или монопольно у писателя"""
+        if self._writers is not None:
+            return self._writers[shard].exclusive()
+        return self.pools[shard].acquire()
+    
+    async def _write(self, user_id: int, op):
+        """Выполнить op(db) одной транзакцией в шарде пользователя.
+        
+        В режиме одного писателя операция ставится в его очередь,
+        иначе выполняется на соединении из пула под блокировкой полосы.
+        """
+        if self._writers is not None:
+            return await self._writers[self._shard(user_id)].run(op)
+        async with self._user_lock(user_id):
+            async with self._pool(user_id).acquire() as db:
+                await db.execute("BEGIN IMMEDIATE")
+                result = await op(db)
                 await db.commit()
+                return result
+    
+    async def close(self):
+        """Закрыть соединения с базой данных"""
+        for task in self._background_tasks:
+            task.cancel()
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        for writer in self._state_writers:
+            await writer.close()
+        for pool in self.pools:
+            await pool.close()
+    
+    async def create_tables(self):
+        """Подготовка базы данных: применение миграций во всех шардах.
+        
+        При запуске выполняется одна проверка версии схемы на шард;
+        перенос данных из новых миграций идет в фоне порциями.
+        """
+        async with self._schema_lock:
+            for shard in range(len(self.pools)):
+                async with self._maintenance_connection(shard) as db:
+                    version, pending_backfills = await get_schema_status(db)
+                    if version < LATEST_VERSION:
+                        await apply_migrations(db)
+                if self.background_jobs and (version < LATEST_VERSION or pending_backfills):
+                    self._background_tasks.append(asyncio.create_task(self._run_backfills(shard)))
+            print("✅ Таблицы базы данных созданы успешно")
+            if self.background_jobs:
+                self._background_tasks.append(asyncio.create_task(self._prune_periods_loop()))
+            if self.background_jobs and self.maintenance_hour >= 0:
+                self._background_tasks.append(asyncio.create_task(self._maintenance_loop()))
+            
+            if self.leaderboard is not None:
+                await self.load_leaderboard()
+            if self.question_stats is not None:
+                self.question_stats.load(await self._query_question_counters())
+    
+    async def _prune_periods_loop(self):
+        while True:
+            try:
+                await self.prune_period_stats()
+            except Exception as e:
+                print(f"⚠️ Ошибка при очистке рейтингов за период: {e}")
+            await asyncio.sleep(self.period_prune_interval)
+    
+    async def prune_period_stats(self):
+        """Удалить корзины рейтингов за день и неделю, которые больше не нужны"""
+        await asyncio.gather(*(
+            writer.submit(
+                f"DELETE FROM period_stats WHERE period = ? AND bucket < {since}",
+                [(period,)]
+            )
+            for writer in self._state_writers
+            for period, since in PERIOD_KEEP_SINCE.items()
+        ))
+    
+    async def _maintenance_loop(self):
+        """Раз в сутки в час maintenance_hour (UTC) сжимать историю квизов"""
+        while True:
+            now = time.time()
+            next_run = (now // 86400) * 86400 + self.maintenance_hour * 3600
+            if next_run <= now:
+                next_run += 86400
+            await asyncio.sleep(next_run - now)
+            try:
+                await self.run_maintenance()
+            except Exception as e:
+                print(f"⚠️ Ошибка при обслуживании базы: {e}")
+    
+    async def run_maintenance(self):
+        """Свернуть старую историю, удалить брошенные квизы и выполнить VACUUM во всех шардах"""
+        for shard, path in enumerate(self.shard_paths):
+            await run_maintenance(lambda: self._maintenance_connection(shard), path)
+    
+    async def _run_backfills(self, shard: int):
+        """Фоновый перенос данных миграций в одном шарде"""
+        try:
+            await run_backfills(lambda: self._maintenance_connection(shard))
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            print(f"⚠️ Ошибка при миграции базы данных: {e}")
+            print(f"⚠️ Ошибка при переносе данных миграции: {e}")
     
     async def get_quiz_state(self, user_id: int):
         """Получить состояние квиза для пользователя"""
-        async with self._lock:
-            async with aiosqlite.connect(self.db_name) as db:
-                async with db.execute(
-                    'SELECT question_index, score, completed, used_questions, current_questions FROM quiz_state WHERE user_id = ?',
-                    (user_id,)
-                ) as cursor:
-                    result = await cursor.fetchone()
-                    if result:
-                        try:
-                            used_questions = json.loads(result[3]) if result[3] else []
-                        except:
-                            used_questions = []
-                        
-                        try:
-                            current_questions = json.loads(result[4]) if result[4] else []
-                        except:
-                            current_questions = []
-                        
-                        return {
-                            'question_index': result[0],
-                            'score': result[1],
-                            'completed': result[2],
-                            'used_questions': used_questions,
-                            'current_questions': current_questions
-                        }
-                    return None
+        async with self._pool(user_id).acquire() as db:
+            async with db.execute(
+                '''SELECT question_index, score, completed, used_questions, current_questions, history_id, version
+                   FROM quiz_state WHERE user_id = ?''',
+                (user_id,)
+            ) as cursor:
+                result = await cursor.fetchone()
+                if result:
+                    return {
+                        'question_index': result[0],
+                        'score': result[1],
+                        'completed': result[2],
+                        'used_questions': unpack_questions(result[3]),
+                        'current_questions': unpack_questions(result[4]),
+                        'history_id': result[5],
+                        'version': result[6]
+                    }
+                return None
     
     async def init_user_quiz(self, user_id: int, question_sequence: list, 
                             username: str = "", first_name: str = "", last_name: str = ""):
-        """Инициализировать новый квиз для пользователя"""
-        async with self._lock:
-            async with aiosqlite.connect(self.db_name) as db:
-                # Сначала проверяем, существует ли пользователь
-                async with db.execute(
-                    'SELECT user_id FROM user_stats WHERE user_id = ?',
-                    (user_id,)
-                ) as cursor:
-                    user_exists = await cursor.fetchone()
-                
-                if not user_exists:
-                    # Создаем новую запись пользователя
-                    await db.execute('''
-                        INSERT INTO user_stats 
-                        (user_id, username, first_name, last_name, total_quizzes, total_correct, total_questions, best_score) 
-                        VALUES (?, ?, ?, ?, 0, 0, 0, 0)
-                    ''', (user_id, username or "", first_name or "", last_name or ""))
-                    print(f"👤 Создан новый пользователь: user_id={user_id}")
-                else:
-                    # Обновляем только имя пользователя, если оно изменилось
-                    await db.execute('''
-                        UPDATE user_stats 
-                        SET username = COALESCE(?, username),
-                            first_name = COALESCE(?, first_name),
-                            last_name = COALESCE(?, last_name)
-                        WHERE user_id = ?
-                    ''', (username or "", first_name or "", last_name or "", user_id))
-                
-                # Инициализируем состояние квиза
-                await db.execute(
-                    '''INSERT OR REPLACE INTO quiz_state 
-                       (user_id, question_index, score, completed, used_questions, current_questions) 
-                       VALUES (?, 0, 0, 0, '[]', ?)''',
-                    (user_id, json.dumps(question_sequence))
-                )
-                
-                # Создаем запись в истории
-                await db.execute(
-                    '''INSERT INTO quiz_history (user_id, score, total_questions, quiz_date)
-                       VALUES (?, 0, ?, CURRENT_TIMESTAMP)''',
-                    (user_id, len(question_sequence))
-                )
-                
-                await db.commit()
+        """Инициализировать новый квиз для пользователя, вернуть id записи истории"""
+        profile = (username or "", first_name or "", last_name or "")
+        profile_known = self._profiles.get(user_id) == profile
+        if profile_known:
+            self._profiles.move_to_end(user_id)
+        
+        async def op(db):
+            # Профиль пишем, только если имя могло измениться с прошлого квиза:
+            # новая запись создается, а существующая обновляется лишь при отличиях
+            if not profile_known:
+                await db.execute('''
+                    INSERT INTO user_stats 
+                    (user_id, username, first_name, last_name, total_quizzes, total_correct, total_questions, best_score) 
+                    VALUES (?, ?, ?, ?, 0, 0, 0, 0)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        username = excluded.username,
+                        first_name = excluded.first_name,
+                        last_name = excluded.last_name
+                    WHERE username IS NOT excluded.username
+                       OR first_name IS NOT excluded.first_name
+                       OR last_name IS NOT excluded.last_name
+                ''', (user_id, *profile))
+            
+            # Создаем запись в истории
+            cursor = await db.execute(
+                '''INSERT INTO quiz_history (user_id, score, total_questions, quiz_date, completed)
+                   VALUES (?, 0, ?, CURRENT_TIMESTAMP, 0)''',
+                (user_id, len(question_sequence))
+            )
+            history_id = cursor.lastrowid
+            
+            # Инициализируем состояние квиза со ссылкой на запись истории
+            await db.execute(
+                '''INSERT OR REPLACE INTO quiz_state 
+                   (user_id, question_index, score, completed, used_questions, current_questions, history_id, version) 
+                   VALUES (?, 0, 0, 0, X'', ?, ?, 0)''',
+                (user_id, pack_questions(question_sequence), history_id)
+            )
+            return history_id
+        
+        history_id = await self._write(user_id, op)
+        if not profile_known:
+            self._remember_profile(user_id, profile)
+            if self.leaderboard is not None:
+                self.leaderboard.update_profile(user_id, *profile)
+        return history_id
     
-    async def update_quiz_state(self, user_id: int, question_index: int, score: int = None):
-        """Обновить состояние квиза"""
-        async with self._lock:
-            async with aiosqlite.connect(self.db_name) as db:
-                if score is not None:
-                    await db.execute(
-                        'UPDATE quiz_state SET question_index = ?, score = ? WHERE user_id = ?',
-                        (question_index, score, user_id)
-                    )
-                else:
-                    await db.execute(
-                        'UPDATE quiz_state SET question_index = ? WHERE user_id = ?',
-                        (question_index, user_id)
-                    )
-                await db.commit()
+    def _remember_profile(self, user_id: int, profile: tuple):
+        """Запомнить записанный в базу профиль (LRU на PROFILE_CACHE_SIZE пользователей)"""
+        self._profiles[user_id] = profile
+        self._profiles.move_to_end(user_id)
+        if len(self._profiles) > self._profiles_size:
+            self._profiles.popitem(last=False)
+    
+    async def update_quiz_state(self, user_id: int, question_index: int, score: int = None,
+                                expected_version: int = None) -> bool:
+        """Обновить состояние квиза.
+        
+        Без expected_version запись фиксируется вместе с записями других
+        пользователей. С expected_version выполняется сравнение с обменом:
+        строка меняется, только если ее версия не изменилась с момента
+        чтения, иначе возвращается False (например, при двойном нажатии).
+        """
+        if expected_version is not None:
+            return await self._compare_and_set_state(user_id, question_index, score, expected_version)
+        
+        writer = self._state_writers[self._shard(user_id)]
+        sql = '''UPDATE quiz_state SET question_index = ?, score = COALESCE(?, score), version = version + 1
+                 WHERE user_id = ?'''
+        if self._writers is not None:
+            await writer.submit(sql, [(question_index, score, user_id)])
+            return True
+        async with self._user_lock(user_id):
+            await writer.submit(sql, [(question_index, score, user_id)])
+        return True
+    
+    async def _compare_and_set_state(self, user_id: int, question_index: int, score, expected_version: int) -> bool:
+        async def op(db):
+            cursor = await db.execute(
+                '''UPDATE quiz_state SET question_index = ?, score = COALESCE(?, score), version = version + 1
+                   WHERE user_id = ? AND version = ?''',
+                (question_index, score, user_id, expected_version)
+            )
+            return cursor.rowcount == 1
+        
+        if self._writers is not None:
+            return await self._writers[self._shard(user_id)].run(op)
+        # Версия сама защищает от гонок, блокировка полосы не нужна
+        async with self._pool(user_id).acquire() as db:
+            applied = await op(db)
+            await db.commit()
+            return applied
+    
+    async def save_quiz_states(self, states: list):
+        """Сохранить пачку состояний квиза одной транзакцией.
+        
+        states - список кортежей (user_id, history_id, question_index, score, version).
+        Строка обновляется, только если history_id совпадает, а версия в базе
+        меньше сохраняемой, поэтому запоздавшая запись не затрет ни новый
+        квиз пользователя, ни более свежее состояние текущего.
+        """
+        rows_by_shard = {}
+        for user_id, history_id, question_index, score, version in states:
+            rows_by_shard.setdefault(self._shard(user_id), []).append(
+                (question_index, score, version, user_id, history_id, version)
+            )
+        await asyncio.gather(*(
+            self._state_writers[shard].submit(
+                '''UPDATE quiz_state SET question_index = ?, score = ?, version = ?
+                   WHERE user_id = ? AND history_id IS ? AND version < ?''',
+                rows
+            )
+            for shard, rows in rows_by_shard.items()
+        ))
+    
+    async def save_answers(self, answers: list):
+        """Добавить пачку ответов в журнал и прибавить счетчики вопросов.
+        
+        Ответы и приращения счетчиков шарда ставятся в очередь его
+        писателя одновременно и фиксируются одной групповой записью.
+        """
+        rows_by_shard = {}
+        for row in answers:
+            rows_by_shard.setdefault(self._shard(row[0]), []).append(row)
+        submits = []
+        for shard, rows in rows_by_shard.items():
+            writer = self._state_writers[shard]
+            submits.append(writer.submit(
+                '''INSERT INTO answers
+                   (user_id, history_id, question_id, chosen_option, is_correct, response_ms, answered_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                rows
+            ))
+            submits.append(writer.submit(
+                '''INSERT INTO question_stats (question_id, option_index, picks, correct_picks)
+                   VALUES (?, ?, ?, ?)
+                   ON CONFLICT(question_id, option_index) DO UPDATE SET
+                       picks = picks + excluded.picks,
+                       correct_picks = correct_picks + excluded.correct_picks''',
+                count_answers(rows)
+            ))
+        await asyncio.gather(*submits)
+        if self.question_stats is not None:
+            self.question_stats.add(count_answers(answers))
     
     async def complete_quiz(self, user_id: int, score: int, total_questions: int):
-        """Завершить квиз и обновить статистику"""
-        async with self._lock:
-            async with aiosqlite.connect(self.db_name) as db:
-                try:
-                    # Получаем текущую статистику пользователя
-                    async with db.execute(
-                        'SELECT total_quizzes, total_correct, total_questions, best_score FROM user_stats WHERE user_id = ?',
-                        (user_id,)
-                    ) as cursor:
-                        stats = await cursor.fetchone()
-                    
-                    if stats:
-                        # Вычисляем новые значения статистики
-                        current_total_quizzes = stats[0]
-                        current_total_correct = stats[1]
-                        current_total_questions = stats[2]
-                        current_best_score = stats[3]
-                        
-                        new_total_quizzes = current_total_quizzes + 1
-                        new_total_correct = current_total_correct + score
-                        new_total_questions = current_total_questions + total_questions
-                        new_best_score = max(current_best_score, score)
-                        
-                        print(f"📊 Обновление статистики: user_id={user_id}, "
-                              f"было квизов={current_total_quizzes}, теперь={new_total_quizzes}, "
-                              f"было правильных={current_total_correct}, добавилось={score}")
-                        
-                        # Обновляем статистику пользователя
-                        await db.execute('''
-                            UPDATE user_stats 
-                            SET total_quizzes = ?, 
-                                total_correct = ?, 
-                                total_questions = ?, 
-                                best_score = ?,
-                                last_quiz_date = CURRENT_TIMESTAMP
-                            WHERE user_id = ?
-                        ''', (new_total_quizzes, new_total_correct, new_total_questions, new_best_score, user_id))
-                    else:
-                        # Создаем новую запись статистики
-                        await db.execute('''
-                            INSERT INTO user_stats 
-                            (user_id, total_quizzes, total_correct, total_questions, best_score, last_quiz_date)
-                            VALUES (?, 1, ?, ?, ?, CURRENT_TIMESTAMP)
-                        ''', (user_id, score, total_questions, score))
-                        print(f"📊 Создана новая запись статистики для user_id={user_id}")
-                    
-                    # Обновляем результат последнего квиза в истории
-                    await db.execute('''
-                        UPDATE quiz_history 
-                        SET score = ?, quiz_date = CURRENT_TIMESTAMP
-                        WHERE id = (
-                            SELECT id FROM quiz_history 
-                            WHERE user_id = ? 
-                            ORDER BY quiz_date DESC 
-                            LIMIT 1
-                        )
-                    ''', (score, user_id))
-                    
-                    # Отмечаем квиз как завершенный
-                    await db.execute(
-                        'UPDATE quiz_state SET completed = 1 WHERE user_id = ?',
-                        (user_id,)
-                    )
-                    
-                    await db.commit()
-                    print(f"✅ Статистика успешно обновлена для user_id={user_id}")
-                    
-                except Exception as e:
-                    print(f"❌ Ошибка при обновлении статистики: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    raise e
+        """Завершить квиз и обновить статистику.
+        
+        Все изменения выполняются одной транзакцией, счетчики увеличиваются
+        в SQL, а обновленная статистика возвращается через RETURNING.
+        Возвращает словарь как у get_user_stats или None, если активного
+        квиза нет (например, он уже был завершен).
+        """
+        async def op(db):
+            # Отмечаем квиз как завершенный; повторное завершение
+            # того же квиза не изменит статистику второй раз
+            async with db.execute(
+                'UPDATE quiz_state SET completed = 1 WHERE user_id = ? AND completed = 0 RETURNING history_id',
+                (user_id,)
+            ) as cursor:
+                active = await cursor.fetchone()
+            if active is None:
+                return None
+            
+            # Обновляем статистику пользователя
+            async with db.execute('''
+                INSERT INTO user_stats 
+                (user_id, total_quizzes, total_correct, total_questions, best_score, last_quiz_date)
+                VALUES (?, 1, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    total_quizzes = total_quizzes + 1,
+                    total_correct = total_correct + excluded.total_correct,
+                    total_questions = total_questions + excluded.total_questions,
+                    best_score = max(best_score, excluded.best_score),
+                    last_quiz_date = CURRENT_TIMESTAMP
+                RETURNING username, first_name, last_name, total_quizzes,
+                          total_correct, total_questions, best_score,
+                          datetime(last_quiz_date)
+            ''', (user_id, score, total_questions, score)) as cursor:
+                stats = await cursor.fetchone()
+            
+            # Прибавляем результат к рейтингам за текущий день и неделю
+            await db.execute(f'''
+                INSERT INTO period_stats (period, bucket, user_id, quizzes, correct, questions, best_score)
+                VALUES ('day', {PERIOD_BUCKETS['day']}, ?, 1, ?, ?, ?),
+                       ('week', {PERIOD_BUCKETS['week']}, ?, 1, ?, ?, ?)
+                ON CONFLICT(period, bucket, user_id) DO UPDATE SET
+                    quizzes = quizzes + 1,
+                    correct = correct + excluded.correct,
+                    questions = questions + excluded.questions,
+                    best_score = max(best_score, excluded.best_score)
+            ''', (user_id, score, total_questions, score) * 2)
+            
+            # Обновляем результат квиза в истории по id записи
+            await db.execute(
+                'UPDATE quiz_history SET score = ?, quiz_date = CURRENT_TIMESTAMP, completed = 1 WHERE id = ?',
+                (score, active[0])
+            )
+            return stats
+        
+        try:
+            stats = await self._write(user_id, op)
+        except Exception as e:
+            print(f"❌ Ошибка при обновлении статистики: {e}")
+            import traceback
+            traceback.print_exc()
+            raise e
+        
+        if stats is None:
+            print(f"⚠️ Нет активного квиза для завершения: user_id={user_id}")
+            return None
+        print(f"✅ Статистика успешно обновлена для user_id={user_id}: "
+              f"квизов={stats[3]}, правильных={stats[4]}")
+        
+        user_stats = self._stats_from_row(stats)
+        if self.leaderboard is not None:
+            self.leaderboard.update({'user_id': user_id, **user_stats})
+        return user_stats
+    
+    @staticmethod
+    def _stats_from_row(row):
+        """Преобразовать строку user_stats в словарь статистики"""
+        return {
+            'username': row[0],
+            'first_name': row[1],
+            'last_name': row[2],
+            'total_quizzes': row[3],
+            'total_correct': row[4],
+            'total_questions': row[5],
+            'best_score': row[6],
+            'last_quiz': row[7]
+        }
     
     async def get_user_stats(self, user_id: int):
         """Получить статистику пользователя"""
-        async with self._lock:
-            async with aiosqlite.connect(self.db_name) as db:
-                async with db.execute(
-                    '''SELECT username, first_name, last_name, total_quizzes, 
-                       total_correct, total_questions, best_score,
-                       datetime(last_quiz_date) as last_quiz
-                       FROM user_stats WHERE user_id = ?''',
-                    (user_id,)
-                ) as cursor:
-                    result = await cursor.fetchone()
-                    if result:
-                        return {
-                            'username': result[0],
-                            'first_name': result[1],
-                            'last_name': result[2],
-                            'total_quizzes': result[3],
-                            'total_correct': result[4],
-                            'total_questions': result[5],
-                            'best_score': result[6],
-                            'last_quiz': result[7]
-                        }
-                    return None
+        async with self._pool(user_id).acquire() as db:
+            async with db.execute(
+                '''SELECT username, first_name, last_name, total_quizzes, 
+                   total_correct, total_questions, best_score,
+                   datetime(last_quiz_date) as last_quiz
+                   FROM user_stats WHERE user_id = ?''',
+                (user_id,)
+            ) as cursor:
+                result = await cursor.fetchone()
+                if result:
+                    return self._stats_from_row(result)
+                return None
     
     async def get_last_quiz_result(self, user_id: int):
-        """Получить результат последнего квиза"""
-        async with self._lock:
-            async with aiosqlite.connect(self.db_name) as db:
-                async with db.execute('''
-                    SELECT score, total_questions, datetime(quiz_date) as quiz_date
-                    FROM quiz_history 
-                    WHERE user_id = ? 
-                    ORDER BY quiz_date DESC 
-                    LIMIT 1
-                ''', (user_id,)) as cursor:
-                    result = await cursor.fetchone()
-                    if result:
-                        return {
-                            'score': result[0],
-                            'total_questions': result[1],
-                            'quiz_date': result[2]
-                        }
-                    return None
-    
-    async def get_top_players(self, limit: int = 10):
-        """Получить топ игроков"""
-        async with self._lock:
-            async with aiosqlite.connect(self.db_name) as db:
+        """Получить результат последнего квиза.
+        
+        Записи истории добавляются по порядку, поэтому последний квиз -
+        запись с наибольшим id; он находится по индексу истории без сортировки.
+        """
+        async with self._pool(user_id).acquire() as db:
+            async with db.execute('''
+                SELECT score, total_questions, datetime(quiz_date) as quiz_date
+                FROM quiz_history 
+                WHERE id = (SELECT MAX(id) FROM quiz_history WHERE user_id = ?)
+            ''', (user_id,)) as cursor:
+                result = await cursor.fetchone()
+                if result:
+                    return {
+                        'score': result[0],
+                        'total_questions': result[1],
+                        'quiz_date': result[2]
+                    }
+                return None
+    
+    @staticmethod
+    def _player_from_row(row) -> dict:
+        return {
+            'user_id': row[0],
+            'username': row[1],
+            'first_name': row[2],
+            'last_name': row[3],
+            'total_quizzes': row[4],
+            'best_score': row[5],
+            'total_correct': row[6],
+            'total_questions': row[7]
+        }
+    
+    async def _query_ranked_players(self, pool: ConnectionPool, limit: int = -1, period: str = None):
+        """Игроки одного шарда в порядке рейтинга (limit=-1 - все).
+        
+        period ('day' или 'week') - рейтинг за текущий период: читается
+        из корзины period_stats по индексу idx_period_stats_rank.
+        """
+        if period is None:
+            sql = '''
+                SELECT user_id, username, first_name, last_name, 
+                       total_quizzes, best_score, total_correct, total_questions
+                FROM user_stats 
+                WHERE total_quizzes > 0
+                ORDER BY best_score DESC, total_correct DESC, total_quizzes DESC, user_id
+                LIMIT ?
+            '''
+            params = (limit,)
+        else:
+            sql = f'''
+                SELECT p.user_id, u.username, u.first_name, u.last_name,
+                       p.quizzes, p.best_score, p.correct, p.questions
+                FROM period_stats p
+                JOIN user_stats u ON u.user_id = p.user_id
+                WHERE p.period = ? AND p.bucket = {PERIOD_BUCKETS[period]}
+                ORDER BY p.best_score DESC, p.correct DESC, p.quizzes DESC, p.user_id
+                LIMIT ?
+            '''
+            params = (period, limit)
+        async with pool.acquire() as db:
+            async with db.execute(sql, params) as cursor:
+                return [self._player_from_row(row) for row in await cursor.fetchall()]
+    
+    async def _merge_ranked_players(self, limit: int = -1, period: str = None):
+        """Опросить все шарды и слить их упорядоченные списки (k-way merge)"""
+        per_shard = await asyncio.gather(*(
+            self._query_ranked_players(pool, limit, period) for pool in self.pools
+        ))
+        merged = heapq.merge(*per_shard, key=Leaderboard.sort_key)
+        if limit >= 0:
+            merged = itertools.islice(merged, limit)
+        return list(merged)
+    
+    async def load_leaderboard(self):
+        """Загрузить рейтинг игроков в память (выполняется при запуске)"""
+        self.leaderboard.load(await self._merge_ranked_players())
+        print(f"🏆 Рейтинг загружен: {len(self.leaderboard)} игроков")
+    
+    async def get_top_players(self, limit: int = 10, period: str = None):
+        """Получить топ игроков за все время или за текущий день/неделю"""
+        if period is not None:
+            if period not in PERIOD_BUCKETS:
+                raise ValueError(f"Неизвестный период рейтинга: {period}")
+            return [player_summary(player) for player in await self._merge_ranked_players(limit, period)]
+        if self.leaderboard is not None:
+            return self.leaderboard.top(limit)
+        return [player_summary(player) for player in await self._merge_ranked_players(limit)]
+    
+    async def get_user_rank(self, user_id: int):
+        """Получить место игрока в рейтинге: (место, всего игроков) или None"""
+        if self.leaderboard is not None:
+            rank = self.leaderboard.rank(user_id)
+            if rank is None:
+                return None
+            return rank, len(self.leaderboard)
+        
+        async with self._pool(user_id).acquire() as db:
+            async with db.execute(
+                'SELECT best_score, total_correct, total_quizzes FROM user_stats WHERE user_id = ? AND total_quizzes > 0',
+                (user_id,)
+            ) as cursor:
+                player = await cursor.fetchone()
+        if player is None:
+            return None
+        
+        # Считаем во всех шардах игроков выше данного и общее число игроков
+        async def count_shard(pool):
+            async with pool.acquire() as db:
                 async with db.execute('''
-                    SELECT user_id, username, first_name, last_name, 
-                           total_quizzes, best_score, total_correct, total_questions
-                    FROM user_stats 
+                    SELECT COUNT(*) FILTER (
+                               WHERE (best_score, total_correct, total_quizzes, -user_id) > (?, ?, ?, ?)
+                           ),
+                           COUNT(*)
+                    FROM user_stats
                     WHERE total_quizzes > 0
-                    ORDER BY best_score DESC, total_correct DESC, total_quizzes DESC
-                    LIMIT ?
-                ''', (limit,)) as cursor:
-                    results = await cursor.fetchall()
-                    players = []
-                    for row in results:
-                        accuracy = (row[6] / row[7] * 100) if row[7] > 0 else 0
-                        players.append({
-                            'user_id': row[0],
-                            'username': row[1],
-                            'first_name': row[2],
-                            'last_name': row[3],
-                            'total_quizzes': row[4],
-                            'best_score': row[5],
-                            'accuracy': round(accuracy, 1)
-                        })
-                    return players
+                ''', (*player, -user_id)) as cursor:
+                    return await cursor.fetchone()
+        
+        counts = await asyncio.gather(*(count_shard(pool) for pool in self.pools))
+        return sum(above for above, _ in counts) + 1, sum(total for _, total in counts)
+    
+    async def _query_question_counters(self):
+        """Счетчики вопросов из всех шардов"""
+        async def query_shard(pool):
+            async with pool.acquire() as db:
+                async with db.execute(
+                    'SELECT question_id, option_index, picks, correct_picks FROM question_stats'
+                ) as cursor:
+                    return await cursor.fetchall()
+        
+        per_shard = await asyncio.gather(*(query_shard(pool) for pool in self.pools))
+        return list(itertools.chain.from_iterable(per_shard))
+    
+    async def get_question_stats(self, limit: int = 5, hardest: bool = True):
+        """Самые сложные (или самые простые) вопросы по счетчикам ответов"""
+        stats = self.question_stats
+        if stats is None:
+            stats = QuestionStats()
+            stats.load(await self._query_question_counters())
+        return stats.hardest(limit) if hardest else stats.easiest(limit)
     
     async def clear_quiz_state(self, user_id: int):
         """Очистить состояние квиза"""
-        async with self._lock:
-            async with aiosqlite.connect(self.db_name) as db:
-                await db.execute(
-                    'DELETE FROM quiz_state WHERE user_id = ?',
-                    (user_id,)
-                )
-                await db.commit()
\ No newline at end of file
+        async def op(db):
+            await db.execute(
+                'DELETE FROM quiz_state WHERE user_id = ?',
+                (user_id,)
+            )
+        
+        await self._write(user_id, op)
\ No newline at end of file
@@ -0,0 +1,98 @@
+import asyncio
+import os
+from collections import OrderedDict
+from config import DEDUP_FILE, DEDUP_CAPACITY, DEDUP_SAVE_INTERVAL
+
+
+class CallbackDedup:
+    """Ограниченное хранилище недавно обработанных нажатий.
+
+    Ключи (id callback-запроса, пользователь + сообщение + вопрос)
+    держатся в памяти в порядке поступления, самые старые вытесняются
+    при превышении capacity. Проверка и отметка - O(1) и без обращения
+    к базе, поэтому повторно доставленное обновление или двойное
+    нажатие отбрасывается до любой работы. Раз в save_interval секунд
+    и при остановке ключи сохраняются в файл, чтобы после перезапуска
+    не обработать заново обновления, которые Telegram доставит повторно.
+    """
+
+    def __init__(self, path: str = DEDUP_FILE, capacity: int = DEDUP_CAPACITY,
+                 save_interval: float = DEDUP_SAVE_INTERVAL):
+        self.path = path
+        self.capacity = max(1, capacity)
+        self.save_interval = save_interval
+        self._seen = OrderedDict()
+        self._changed = False
+        self._save_task = None
+
+    async def start(self):
+        """Загрузить сохраненные ключи и запустить их периодическое сохранение"""
+        if self._save_task is not None:
+            return
+        if self.path and os.path.exists(self.path):
+            try:
+                keys = await asyncio.to_thread(self._read)
+            except OSError as e:
+                print(f"⚠️ Не удалось прочитать обработанные нажатия: {e}")
+            else:
+                for key in keys[-self.capacity:]:
+                    self._seen[key] = None
+        if self.path and self.save_interval > 0:
+            self._save_task = asyncio.create_task(self._save_loop())
+
+    async def close(self):
+        """Остановить периодическое сохранение и сохранить ключи"""
+        if self._save_task is not None:
+            self._save_task.cancel()
+            try:
+                await self._save_task
+            except asyncio.CancelledError:
+                pass
+            self._save_task = None
+        await self.save()
+
+    async def _save_loop(self):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            try:
+                await self.save()
+            except OSError as e:
+                print(f"⚠️ Ошибка при сохранении обработанных нажатий: {e}")
+
+    def _read(self) -> list:
+        with open(self.path, encoding='utf-8') as file:
+            return [line.rstrip('\n') for line in file if line.strip()]
+
+    def _write(self, keys: list):
+        temp = self.path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as file:
+            file.writelines(f"{key}\n" for key in keys)
+        os.replace(temp, self.path)
+
+    async def save(self):
+        """Записать ключи в файл, если они менялись"""
+        if not self.path or not self._changed:
+            return
+        self._changed = False
+        try:
+            await asyncio.to_thread(self._write, list(self._seen))
+        except OSError:
+            self._changed = True
+            raise
+
+    def seen(self, *keys: str) -> bool:
+        """Проверить, обработано ли уже нажатие; если нет - отметить все его ключи"""
+        if any(key in self._seen for key in keys):
+            return True
+        for key in keys:
+            self._seen[key] = None
+        while len(self._seen) > self.capacity:
+            self._seen.popitem(last=False)
+        self._changed = True
+        return False
+
+    def forget(self, *keys: str):
+        """Снять отметку (обработка не удалась, нажатие можно повторить)"""
+        for key in keys:
+            self._seen.pop(key, None)
+        self._changed = True
@@ -1,13 +1,26 @@
 from aiogram import types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.types import Message, CallbackQuery
 from quiz_content import quiz_data, get_total_questions, get_question_by_index, get_correct_answer, get_explanation
 from keyboards import generate_options_keyboard, get_start_keyboard, get_stats_keyboard
-from database import Database
-import asyncio
+from storage import create_storage
+from session_cache import SessionCache
+from answer_log import AnswerLog
+from dedup import CallbackDedup
+from scheduler import DelayedScheduler
+from config import ADMIN_IDS, NEXT_QUESTION_DELAY, COMPACT_FEEDBACK
 import random
 
-db = Database()
+# Хранилище выбирается в config.STORAGE_BACKEND
+db = create_storage()
+# Состояния квиза читаются и пишутся через кэш сессий
+sessions = SessionCache(db)
+# Журнал ответов пишется в хранилище пачками в фоне
+answers = AnswerLog(db)
+# Недавно обработанные нажатия для отбрасывания повторов
+callbacks = CallbackDedup()
+# Отложенная отправка следующих вопросов
+scheduler = DelayedScheduler()
 
 
 # Команда /start
@@ -43,7 +56,7 @@ async def cmd_quiz(message: Message):
         print(f"🎮 Начало квиза для user_id={user_id}, вопросов: {len(question_sequence)}")
         
         # Инициализируем квиз для пользователя
-        await db.init_user_quiz(
+        await sessions.init_user_quiz(
             user_id=user_id,
             question_sequence=question_sequence,
             username=message.from_user.username or "",
@@ -64,7 +77,7 @@ async def cmd_quiz(message: Message):
 async def send_question(message: types.Message, user_id: int):
     """Отправляет вопрос пользователю"""
     try:
-        quiz_state = await db.get_quiz_state(user_id)
+        quiz_state = await sessions.get_quiz_state(user_id)
         
         if not quiz_state:
             await message.answer("Произошла ошибка. Начните квиз заново: /quiz")
@@ -94,11 +107,19 @@ async def send_question(message: types.Message, user_id: int):
             f"{question['question']}",
             reply_markup=generate_options_keyboard(question_id)
         )
+        answers.question_sent(user_id)
     except Exception as e:
         print(f"Ошибка при отправке вопроса: {e}")
         await message.answer("Произошла ошибка.")
 
 
+async def send_next_question(message: types.Message, user_id: int, history_id: int):
+    """Отправить следующий вопрос, если за время паузы не начат новый квиз"""
+    quiz_state = await sessions.get_quiz_state(user_id)
+    if quiz_state and quiz_state['history_id'] == history_id:
+        await send_question(message, user_id)
+
+
 async def finish_quiz(message: types.Message, user_id: int, quiz_state):
     """Завершает квиз и показывает результаты"""
     try:
@@ -108,16 +129,9 @@ async def finish_quiz(message: types.Message, user_id: int, quiz_state):
         
         print(f"🏁 Завершение квиза для user_id={user_id}, счет: {score}/{total_questions}")
         
-        # Получаем текущую статистику перед обновлением
-        old_stats = await db.get_user_stats(user_id)
-        if old_stats:
-            print(f"📊 Старая статистика: квизов={old_stats['total_quizzes']}, правильных={old_stats['total_correct']}")
-        
-        # Обновляем статистику
-        await db.complete_quiz(user_id, score, total_questions)
-        
-        # Получаем обновленную статистику
-        user_stats = await db.get_user_stats(user_id)
+        # Обновляем статистику и получаем ее новое значение одним запросом
+        # (состояние квиза при этом помечается завершенным)
+        user_stats = await sessions.complete_quiz(user_id, score, total_questions)
         
         # Формируем сообщение с результатами
         result_text = f"🏁 Квиз завершен!\n\n"
@@ -147,9 +161,6 @@ async def finish_quiz(message: types.Message, user_id: int, quiz_state):
         
         result_text += f"\n🎮 Чтобы пройти еще раз, нажмите '🎮 Начать игру'"
         
-        # Очищаем состояние квиза
-        await db.clear_quiz_state(user_id)
-        
         await message.answer(result_text, reply_markup=get_start_keyboard())
         
     except Exception as e:
@@ -168,10 +179,44 @@ async def finish_quiz(message: types.Message, user_id: int, quiz_state):
         )
 
 
+async def show_feedback(callback: CallbackQuery, user_id: int, answer_text: str, explanation_text: str = None):
+    """Убрать кнопки и отправить ответ и объяснение отдельными сообщениями"""
+    # Удаляем клавиатуру с кнопками
+    try:
+        await callback.bot.edit_message_reply_markup(
+            chat_id=user_id,
+            message_id=callback.message.message_id,
+            reply_markup=None
+        )
+    except Exception as e:
+        print(f"Ошибка при удалении клавиатуры: {e}")
+    
+    await callback.message.answer(answer_text)
+    if explanation_text:
+        await callback.message.answer(explanation_text)
+
+
+async def show_feedback_in_place(callback: CallbackQuery, answer_text: str, explanation_text: str = None):
+    """Дописать ответ и объяснение в сообщение с вопросом и убрать кнопки одной правкой"""
+    feedback = answer_text + (f"\n\n{explanation_text}" if explanation_text else "")
+    try:
+        await callback.message.edit_text(
+            f"{callback.message.text or ''}\n\n{feedback}",
+            reply_markup=None
+        )
+    except Exception as e:
+        # Сообщение нельзя изменить (например, слишком старое) - отвечаем отдельно
+        print(f"Ошибка при изменении сообщения с вопросом: {e}")
+        await callback.message.answer(feedback)
+
+
 # Обработка ответов
 async def process_answer(callback: CallbackQuery):
     user_id = callback.from_user.id
     data = callback.data
+    dedup_keys = ()
+    acknowledged = False
+    advanced = False
     
     try:
         if data.startswith("answer_"):
@@ -187,11 +232,27 @@ async def process_answer(callback: CallbackQuery):
                 await callback.answer("Ошибка в данных!")
                 return
             
-            quiz_state = await db.get_quiz_state(user_id)
-            if not quiz_state:
+            # Повторная доставка обновления или двойное нажатие
+            dedup_keys = (
+                callback.id,
+                f"{user_id}:{callback.message.message_id}:{question_index}"
+            )
+            if callbacks.seen(*dedup_keys):
+                await callback.answer("Ответ уже принят!")
+                return
+            
+            quiz_state = await sessions.get_quiz_state(user_id)
+            if not quiz_state or quiz_state['completed']:
                 await callback.answer("Квиз не начат!")
                 return
             
+            # Ответ на уже пройденный вопрос (старое сообщение с кнопками)
+            position = quiz_state['question_index']
+            current_questions = quiz_state['current_questions']
+            if position >= len(current_questions) or current_questions[position] != question_index:
+                await callback.answer("Этот вопрос уже неактуален")
+                return
+            
             question = get_question_by_index(question_index)
             if not question:
                 await callback.answer("Вопрос не найден!")
@@ -203,47 +264,56 @@ async def process_answer(callback: CallbackQuery):
             correct_text = question['options'][correct_index]
             is_correct = answer_index == correct_index
             
-            # Удаляем клавиатуру с кнопками
-            try:
-                await callback.bot.edit_message_reply_markup(
-                    chat_id=user_id,
-                    message_id=callback.message.message_id,
-                    reply_markup=None
-                )
-            except Exception as e:
-                print(f"Ошибка при удалении клавиатуры: {e}")
-            
-            # Отправляем сообщение с выбранным ответом
-            await callback.message.answer(
-                f"📝 Ваш ответ: \"{selected_text}\"\n"
-                f"{'✅ Верно!' if is_correct else 'Неправильно'}"
+            # Обновляем счет и состояние, только если его не изменил
+            # параллельный ответ (например, двойное нажатие кнопки)
+            new_score = quiz_state.get('score', 0) + (1 if is_correct else 0)
+            applied = await sessions.update_quiz_state(
+                user_id, position + 1, new_score, expected_version=quiz_state['version']
             )
+            if not applied:
+                await callback.answer("Ответ уже принят!")
+                return
+            advanced = True
+            answers.record(user_id, quiz_state['history_id'], question_index, answer_index, is_correct)
             
-            # Если ответ неправильный, показываем правильный ответ с объяснением
-            if not is_correct:
-                explanation = get_explanation(question_index)
-                explanation_text = f"📚 Правильный ответ: \"{correct_text}\""
-                if explanation:
-                    explanation_text += f"\n{explanation}"
-                await callback.message.answer(explanation_text)
-            
-            # Обновляем счет
-            current_score = quiz_state.get('score', 0)
-            new_score = current_score + (1 if is_correct else 0)
-            
-            # Обновляем состояние
-            next_question_index = quiz_state['question_index'] + 1
-            await db.update_quiz_state(user_id, next_question_index, new_score)
-            
-            # Небольшая задержка перед следующим вопросом
-            await asyncio.sleep(1)
-            
-            # Отправляем следующий вопрос или завершаем квиз
-            await send_question(callback.message, user_id)
-            await callback.answer()
+            try:
+                # Сразу убираем индикатор загрузки на кнопке
+                await callback.answer()
+                acknowledged = True
+                
+                answer_text = (
+                    f"📝 Ваш ответ: \"{selected_text}\"\n"
+                    f"{'✅ Верно!' if is_correct else 'Неправильно'}"
+                )
+                
+                # Если ответ неправильный, показываем правильный ответ с объяснением
+                explanation_text = None
+                if not is_correct:
+                    explanation = get_explanation(question_index)
+                    explanation_text = f"📚 Правильный ответ: \"{correct_text}\""
+                    if explanation:
+                        explanation_text += f"\n{explanation}"
+                
+                if COMPACT_FEEDBACK:
+                    await show_feedback_in_place(callback, answer_text, explanation_text)
+                else:
+                    await show_feedback(callback, user_id, answer_text, explanation_text)
+            finally:
+                # Следующий вопрос (или итоги квиза) отправляется после небольшой
+                # паузы без ожидания в обработчике. Состояние уже продвинуто,
+                # и повторное нажатие будет отклонено, поэтому вопрос ставится
+                # в очередь, даже если показать результат ответа не удалось.
+                scheduler.schedule(
+                    NEXT_QUESTION_DELAY, send_next_question, callback.message, user_id, quiz_state['history_id']
+                )
     except Exception as e:
         print(f"Ошибка при обработке ответа: {e}")
-        await callback.answer("Произошла ошибка. Попробуйте еще раз.")
+        if advanced:
+            # Ответ принят, повторять нажатие бесполезно
+            return
+        callbacks.forget(*dedup_keys)
+        if not acknowledged:
+            await callback.answer("Произошла ошибка. Попробуйте еще раз.")
 
 
 # Статистика пользователя
@@ -269,6 +339,12 @@ async def cmd_stats(message: Message):
                 f"• Последний квиз: {stats.get('last_quiz', 'неизвестно')}\n"
             )
             
+            # Место в рейтинге
+            user_rank = await db.get_user_rank(user_id)
+            if user_rank:
+                rank, total_players = user_rank
+                response_text += f"• Место в рейтинге: {rank} из {total_players}\n"
+            
             # Получаем результат последнего квиза
             last_quiz = await db.get_last_quiz_result(user_id)
             if last_quiz:
@@ -290,16 +366,30 @@ async def cmd_stats(message: Message):
         await message.answer("Ошибка при получении статистики.")
 
 
-# Топ игроков
-async def cmd_top(message: Message):
+# Периоды рейтинга для /top и их подписи
+TOP_PERIODS = {
+    'day': " за сегодня",
+    'week': " за неделю",
+}
+
+
+# Топ игроков: /top, /top day, /top week
+async def cmd_top(message: Message, command: CommandObject = None):
+    argument = (command.args or "").strip().lower() if command else ""
+    if argument and argument not in TOP_PERIODS:
+        await message.answer("Используйте /top, /top day или /top week.")
+        return
+    period = argument or None
+    period_title = TOP_PERIODS.get(argument, "")
+    
     try:
-        top_players = await db.get_top_players(10)
+        top_players = await db.get_top_players(10, period=period)
         
         if not top_players:
-            await message.answer("📊 Пока нет статистики игроков.")
+            await message.answer(f"📊 Пока нет статистики игроков{period_title}.")
             return
         
-        top_text = "🏆 Топ 10 игроков:\n\n"
+        top_text = f"🏆 Топ 10 игроков{period_title}:\n\n"
         
         for i, player in enumerate(top_players, 1):
             # Формируем имя игрока
@@ -336,6 +426,45 @@ async def cmd_top(message: Message):
         await message.answer("Ошибка при получении топа игроков.")
 
 
+# Самые сложные и самые простые вопросы (для администраторов)
+async def cmd_question_stats(message: Message, hardest: bool):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("Команда доступна только администраторам.")
+        return
+    
+    try:
+        questions = await db.get_question_stats(5, hardest=hardest)
+        
+        if not questions:
+            await message.answer("📊 Пока нет ответов на вопросы.")
+            return
+        
+        stats_text = "🧠 Самые сложные вопросы:\n\n" if hardest else "🎯 Самые простые вопросы:\n\n"
+        
+        for i, stats in enumerate(questions, 1):
+            question = get_question_by_index(stats['question_id'])
+            text = question['question'] if question else f"Вопрос {stats['question_id']} (удален)"
+            picks = " | ".join(f"{option + 1}: {count}" for option, count in stats['picks'].items())
+            stats_text += (
+                f"{i}. {text}\n"
+                f"   Верно: {stats['correct']} из {stats['answered']} ответов ({stats['accuracy']}%)\n"
+                f"   Выбор вариантов: {picks}\n"
+            )
+        
+        await message.answer(stats_text)
+    except Exception as e:
+        print(f"Ошибка при получении статистики вопросов: {e}")
+        await message.answer("Ошибка при получении статистики вопросов.")
+
+
+async def cmd_hardest(message: Message):
+    await cmd_question_stats(message, hardest=True)
+
+
+async def cmd_easiest(message: Message):
+    await cmd_question_stats(message, hardest=False)
+
+
 # Правила
 async def cmd_rules(message: Message):
     await message.answer(
@@ -365,11 +494,11 @@ async def cmd_cancel(message: Message):
     
     try:
         # Проверяем, есть ли активный квиз
-        quiz_state = await db.get_quiz_state(user_id)
+        quiz_state = await sessions.get_quiz_state(user_id)
         
         if quiz_state and quiz_state['completed'] == 0:
             # Очищаем состояние квиза
-            await db.clear_quiz_state(user_id)
+            await sessions.clear_quiz_state(user_id)
             await message.answer(
                 "Квиз отменен.\n"
                 "Вы можете начать новый квиз, нажав '🎮 Начать игру'",
@@ -395,6 +524,8 @@ def register_handlers(dp):
     dp.message.register(cmd_stats, Command("stats"))
     dp.message.register(cmd_top, F.text == "🏆 Топ игроков")
     dp.message.register(cmd_top, Command("top"))
+    dp.message.register(cmd_hardest, Command("hardest"))
+    dp.message.register(cmd_easiest, Command("easiest"))
     dp.message.register(cmd_rules, F.text == "📋 Правила")
     dp.message.register(cmd_rules, Command("rules"))
     dp.message.register(cmd_menu, F.text == "🏠 Главное меню")
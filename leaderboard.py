@@ -0,0 +1,92 @@
+import bisect
+from datetime import datetime, timedelta
+
+
+def period_buckets(now: datetime = None) -> dict:
+    """Корзины рейтингов за период: текущий день и понедельник текущей недели (UTC)"""
+    today = (now or datetime.utcnow()).date()
+    return {
+        'day': today.isoformat(),
+        'week': (today - timedelta(days=today.weekday())).isoformat(),
+    }
+
+
+def player_summary(player: dict) -> dict:
+    """Данные игрока для вывода в топе"""
+    accuracy = (player['total_correct'] / player['total_questions'] * 100) if player['total_questions'] > 0 else 0
+    return {
+        'user_id': player['user_id'],
+        'username': player['username'],
+        'first_name': player['first_name'],
+        'last_name': player['last_name'],
+        'total_quizzes': player['total_quizzes'],
+        'best_score': player['best_score'],
+        'accuracy': round(accuracy, 1)
+    }
+
+
+class Leaderboard:
+    """Рейтинг игроков, поддерживаемый в памяти.
+
+    Ключи игроков хранятся в отсортированном списке, поэтому топ-k
+    отдается за O(k), а место игрока находится бинарным поиском.
+    Порядок совпадает с сортировкой в SQL:
+    best_score DESC, total_correct DESC, total_quizzes DESC.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._players = {}
+
+    @staticmethod
+    def sort_key(player: dict):
+        """Ключ сортировки: чем меньше, тем выше место"""
+        return (-player['best_score'], -player['total_correct'],
+                -player['total_quizzes'], player['user_id'])
+
+    def __len__(self):
+        return len(self._keys)
+
+    def load(self, players):
+        """Заполнить рейтинг заново из списка игроков"""
+        self._players = {
+            player['user_id']: dict(player)
+            for player in players
+            if player['total_quizzes'] > 0
+        }
+        self._keys = sorted(self.sort_key(player) for player in self._players.values())
+
+    def update(self, player: dict):
+        """Добавить игрока или обновить его результаты"""
+        if player['total_quizzes'] <= 0:
+            return
+        user_id = player['user_id']
+        old = self._players.get(user_id)
+        if old is not None:
+            del self._keys[bisect.bisect_left(self._keys, self.sort_key(old))]
+        self._players[user_id] = dict(player)
+        bisect.insort(self._keys, self.sort_key(player))
+
+    def get(self, user_id: int):
+        """Данные игрока или None, если его нет в рейтинге"""
+        player = self._players.get(user_id)
+        return dict(player) if player is not None else None
+
+    def update_profile(self, user_id: int, username: str, first_name: str, last_name: str):
+        """Обновить имя игрока, не меняя его места в рейтинге"""
+        player = self._players.get(user_id)
+        if player is not None:
+            player['username'] = username
+            player['first_name'] = first_name
+            player['last_name'] = last_name
+
+    def top(self, limit: int = 10):
+        """Первые limit игроков рейтинга"""
+        return [player_summary(self._players[key[-1]]) for key in self._keys[:limit]]
+
+    def rank(self, user_id: int):
+        """Место игрока (начиная с 1) или None, если его нет в рейтинге"""
+        player = self._players.get(user_id)
+        if player is None:
+            return None
+        return bisect.bisect_left(self._keys, self.sort_key(player)) + 1
@@ -0,0 +1,196 @@
+from datetime import datetime
+from leaderboard import Leaderboard, period_buckets
+from question_stats import QuestionStats, count_answers
+from storage import Storage
+
+
+def _now() -> str:
+    """Текущее время в формате datetime() SQLite"""
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class MemoryStorage(Storage):
+    """Хранилище в памяти процесса (для тестов и бенчмарков).
+
+    Данные теряются при остановке бота. Все операции синхронны внутри
+    цикла событий, поэтому блокировки не нужны.
+    """
+
+    def __init__(self):
+        self._quiz_states = {}
+        self._user_stats = {}
+        self._history = {}  # id записи -> запись
+        self._last_history = {}  # user_id -> id последней записи
+        self._next_history_id = 1
+        self._answers = []
+        self.leaderboard = Leaderboard()
+        self._period_boards = {}  # (период, корзина) -> Leaderboard
+        self.question_stats = QuestionStats()
+
+    async def create_tables(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def get_quiz_state(self, user_id: int):
+        state = self._quiz_states.get(user_id)
+        if state is None:
+            return None
+        return {
+            **state,
+            'used_questions': list(state['used_questions']),
+            'current_questions': list(state['current_questions'])
+        }
+
+    async def init_user_quiz(self, user_id: int, question_sequence: list,
+                             username: str = "", first_name: str = "", last_name: str = ""):
+        stats = self._user_stats.get(user_id)
+        if stats is None:
+            self._user_stats[user_id] = {
+                'username': username or "",
+                'first_name': first_name or "",
+                'last_name': last_name or "",
+                'total_quizzes': 0,
+                'total_correct': 0,
+                'total_questions': 0,
+                'best_score': 0,
+                'last_quiz': _now()
+            }
+        else:
+            stats['username'] = username or ""
+            stats['first_name'] = first_name or ""
+            stats['last_name'] = last_name or ""
+            for board in (self.leaderboard, *self._period_boards.values()):
+                board.update_profile(user_id, stats['username'], stats['first_name'], stats['last_name'])
+
+        history_id = self._next_history_id
+        self._next_history_id += 1
+        self._history[history_id] = {
+            'user_id': user_id,
+            'score': 0,
+            'total_questions': len(question_sequence),
+            'quiz_date': _now()
+        }
+        self._last_history[user_id] = history_id
+
+        self._quiz_states[user_id] = {
+            'question_index': 0,
+            'score': 0,
+            'completed': 0,
+            'used_questions': [],
+            'current_questions': list(question_sequence),
+            'history_id': history_id,
+            'version': 0
+        }
+        return history_id
+
+    async def update_quiz_state(self, user_id: int, question_index: int, score: int = None,
+                                expected_version: int = None) -> bool:
+        state = self._quiz_states.get(user_id)
+        if state is None:
+            return expected_version is None
+        if expected_version is not None and state['version'] != expected_version:
+            return False
+        state['question_index'] = question_index
+        if score is not None:
+            state['score'] = score
+        state['version'] += 1
+        return True
+
+    async def save_quiz_states(self, states: list):
+        for user_id, history_id, question_index, score, version in states:
+            state = self._quiz_states.get(user_id)
+            if state is not None and state['history_id'] == history_id and state['version'] < version:
+                state['question_index'] = question_index
+                state['score'] = score
+                state['version'] = version
+
+    async def save_answers(self, answers: list):
+        self._answers.extend(answers)
+        self.question_stats.add(count_answers(answers))
+
+    async def complete_quiz(self, user_id: int, score: int, total_questions: int):
+        state = self._quiz_states.get(user_id)
+        if state is None or state['completed']:
+            print(f"⚠️ Нет активного квиза для завершения: user_id={user_id}")
+            return None
+        state['completed'] = 1
+
+        stats = self._user_stats.setdefault(user_id, {
+            'username': None,
+            'first_name': None,
+            'last_name': None,
+            'total_quizzes': 0,
+            'total_correct': 0,
+            'total_questions': 0,
+            'best_score': 0,
+            'last_quiz': None
+        })
+        stats['total_quizzes'] += 1
+        stats['total_correct'] += score
+        stats['total_questions'] += total_questions
+        stats['best_score'] = max(stats['best_score'], score)
+        stats['last_quiz'] = _now()
+
+        history = self._history.get(state['history_id'])
+        if history is not None:
+            history['score'] = score
+            history['quiz_date'] = stats['last_quiz']
+
+        self.leaderboard.update({'user_id': user_id, **stats})
+        self._update_periods(user_id, stats, score, total_questions)
+        return dict(stats)
+
+    def _update_periods(self, user_id: int, stats: dict, score: int, total_questions: int):
+        for period, bucket in period_buckets().items():
+            board = self._period_boards.get((period, bucket))
+            if board is None:
+                # Началась новая корзина - прошлые корзины периода больше не нужны
+                for key in [key for key in self._period_boards if key[0] == period]:
+                    del self._period_boards[key]
+                board = self._period_boards[(period, bucket)] = Leaderboard()
+            player = board.get(user_id) or {
+                'user_id': user_id, 'total_quizzes': 0, 'total_correct': 0,
+                'total_questions': 0, 'best_score': 0
+            }
+            player.update(
+                username=stats['username'], first_name=stats['first_name'], last_name=stats['last_name'],
+                total_quizzes=player['total_quizzes'] + 1,
+                total_correct=player['total_correct'] + score,
+                total_questions=player['total_questions'] + total_questions,
+                best_score=max(player['best_score'], score)
+            )
+            board.update(player)
+
+    async def clear_quiz_state(self, user_id: int):
+        self._quiz_states.pop(user_id, None)
+
+    async def get_user_stats(self, user_id: int):
+        stats = self._user_stats.get(user_id)
+        return dict(stats) if stats is not None else None
+
+    async def get_last_quiz_result(self, user_id: int):
+        history = self._history.get(self._last_history.get(user_id))
+        if history is None:
+            return None
+        return {
+            'score': history['score'],
+            'total_questions': history['total_questions'],
+            'quiz_date': history['quiz_date']
+        }
+
+    async def get_question_stats(self, limit: int = 5, hardest: bool = True):
+        return self.question_stats.hardest(limit) if hardest else self.question_stats.easiest(limit)
+
+    async def get_top_players(self, limit: int = 10, period: str = None):
+        if period is None:
+            return self.leaderboard.top(limit)
+        board = self._period_boards.get((period, period_buckets()[period]))
+        return board.top(limit) if board is not None else []
+
+    async def get_user_rank(self, user_id: int):
+        rank = self.leaderboard.rank(user_id)
+        if rank is None:
+            return None
+        return rank, len(self.leaderboard)
@@ -1,108 +1,234 @@
 #!/usr/bin/env python3
-import sqlite3
+"""Миграции базы данных Python Quiz Bot.
+
+Команды:
+  python migrate.py status                  - версия схемы и незавершенные миграции
+  python migrate.py upgrade [--dry-run]     - применить недостающие миграции схемы
+  python migrate.py backfill [--dry-run]    - перенести данные порциями (можно при работающем боте)
+  python migrate.py check                   - показать структуру таблиц
+  python migrate.py rebuild-stats [--dry-run] - пересчитать user_stats по журналу ответов
+"""
+import argparse
+import asyncio
 import os
-from config import DB_NAME
-
-def migrate_database():
-    """Миграция существующей базы данных"""
-    
-    if not os.path.exists(DB_NAME):
-        print(f"База данных {DB_NAME} не найдена.")
-        return
-    
-    print(f" Начинаем миграцию базы данных {DB_NAME}...")
-    
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    try:
-        # Проверяем и добавляем недостающие колонки в user_stats
-        cursor.execute("PRAGMA table_info(user_stats)")
-        columns = cursor.fetchall()
-        column_names = [col[1] for col in columns]
-        
-        print(f"Найдены колонки в user_stats: {column_names}")
-        
-        # Добавляем отсутствующие колонки
-        if 'username' not in column_names:
-            cursor.execute("ALTER TABLE user_stats ADD COLUMN username TEXT")
-            print(" Добавлена колонка username")
-        
-        if 'first_name' not in column_names:
-            cursor.execute("ALTER TABLE user_stats ADD COLUMN first_name TEXT")
-            print(" Добавлена колонка first_name")
-        
-        if 'last_name' not in column_names:
-            cursor.execute("ALTER TABLE user_stats ADD COLUMN last_name TEXT")
-            print(" Добавлена колонка last_name")
-        
-        if 'last_quiz_date' not in column_names:
-            cursor.execute("ALTER TABLE user_stats ADD COLUMN last_quiz_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-            print(" Добавлена колонка last_quiz_date")
-        
-        conn.commit()
-        print(" Миграция завершена успешно!")
-        
-    except Exception as e:
-        print(f" Ошибка при миграции: {e}")
-        conn.rollback()
-    
-    finally:
-        conn.close()
-
-def check_database_structure():
+from contextlib import asynccontextmanager
+import sqlite3
+from config import DB_NAME, DB_SHARDS
+from database import ConnectionPool, shard_paths
+from migrations import LATEST_VERSION, get_schema_status, apply_migrations, pending_backfills, run_backfills
+
+
+@asynccontextmanager
+async def _single_connection(db):
+    yield db
+
+
+async def _for_each_shard(db_name: str, shards: int, action):
+    for path in shard_paths(db_name, shards):
+        if not os.path.exists(path):
+            print(f"База данных {path} не найдена.")
+            continue
+        pool = ConnectionPool(path, 1)
+        try:
+            async with pool.acquire() as db:
+                await action(path, db)
+        finally:
+            await pool.close()
+
+
+async def show_status(db_name: str, shards: int):
+    async def action(path, db):
+        version, _ = await get_schema_status(db)
+        backfills = await pending_backfills(db)
+        print(f" {path}: версия схемы {version} из {LATEST_VERSION}")
+        for migration in backfills:
+            print(f"   не завершен перенос данных миграции {migration.version}: {migration.description}")
+    await _for_each_shard(db_name, shards, action)
+
+
+async def upgrade(db_name: str, shards: int, dry_run: bool):
+    async def action(path, db):
+        pending = await apply_migrations(db, dry_run=dry_run)
+        if not pending:
+            print(f" {path}: схема актуальна")
+        elif dry_run:
+            for migration in pending:
+                print(f" {path}: будет применена миграция {migration.version}: {migration.description}")
+    await _for_each_shard(db_name, shards, action)
+
+
+async def backfill(db_name: str, shards: int, batch_size: int, pause: float, dry_run: bool):
+    async def action(path, db):
+        backfills = await pending_backfills(db)
+        if not backfills:
+            print(f" {path}: перенос данных не требуется")
+        elif dry_run:
+            for migration in backfills:
+                print(f" {path}: будет выполнен перенос данных миграции {migration.version}: {migration.description}")
+        else:
+            await run_backfills(lambda: _single_connection(db), batch_size=batch_size, pause=pause)
+    await _for_each_shard(db_name, shards, action)
+
+
+# Завершенные квизы из журнала ответов: квиз считается завершенным, если
+# отвечены все его вопросы (повторные ответы на вопрос не учитываются).
+# Длина квиза берется из его записи в истории. Записи брошенных квизов
+# обслуживание удаляет, поэтому ответы без записи в истории не считаются,
+# а квизы, свернутые в помесячные итоги, берутся из этих итогов.
+COMPLETED_QUIZZES_QUERY = '''
+    SELECT user_id, quizzes, questions, correct, best_score, last_answer FROM (
+        SELECT a.user_id AS user_id,
+               1 AS quizzes,
+               COUNT(DISTINCT a.question_id) AS questions,
+               COUNT(DISTINCT a.question_id) FILTER (WHERE a.is_correct) AS correct,
+               COUNT(DISTINCT a.question_id) FILTER (WHERE a.is_correct) AS best_score,
+               MAX(a.answered_at) AS last_answer
+        FROM answers a
+        JOIN quiz_history h ON h.id = a.history_id
+        GROUP BY a.user_id, a.history_id
+        HAVING COUNT(DISTINCT a.question_id) >= MAX(h.total_questions)
+        UNION ALL
+        SELECT user_id, quizzes, questions, correct, best_score, NULL
+        FROM quiz_history_monthly
+        WHERE user_id IN (SELECT user_id FROM answers)
+    )
+    ORDER BY user_id
+'''
+
+
+async def rebuild_stats(db_name: str, shards: int, dry_run: bool):
+    """Пересчитать статистику пользователей по журналу ответов.
+
+    Журнал читается одним проходом, отсортированным по user_id, и итоги
+    пользователя записываются, как только его строки закончились.
+    Учитываются только пользователи, у которых есть записи в журнале;
+    квизы, пройденные до появления журнала, в пересчет не попадают,
+    если они еще не свернуты в помесячные итоги.
+    Бот на время пересчета должен быть остановлен.
+    """
+    async def action(path, db):
+        async with db.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ('answers', 'quiz_history_monthly')"
+        ) as cursor:
+            if (await cursor.fetchone())[0] < 2:
+                print(f" {path}: журнала ответов нет, выполните upgrade")
+                return
+
+        updates = []
+        users = 0
+
+        async def write(batch):
+            if not dry_run:
+                await db.executemany('''
+                    UPDATE user_stats
+                    SET total_quizzes = ?, total_correct = ?, total_questions = ?,
+                        best_score = ?, last_quiz_date = ?
+                    WHERE user_id = ?
+                ''', batch)
+
+        if not dry_run:
+            await db.execute("BEGIN IMMEDIATE")
+        current = None
+        async with db.execute(COMPLETED_QUIZZES_QUERY) as cursor:
+            while True:
+                rows = await cursor.fetchmany(1000)
+                if not rows:
+                    break
+                for user_id, quizzes, answered, correct, best_score, answered_at in rows:
+                    if current is None or current[-1] != user_id:
+                        if current is not None:
+                            updates.append(tuple(current))
+                        users += 1
+                        # total_quizzes, total_correct, total_questions, best_score, last_quiz_date, user_id
+                        current = [0, 0, 0, 0, None, user_id]
+                    current[0] += quizzes
+                    current[1] += correct
+                    current[2] += answered
+                    current[3] = max(current[3], best_score)
+                    if answered_at is not None:
+                        current[4] = max(current[4] or answered_at, answered_at)
+                if len(updates) >= 1000:
+                    await write(updates)
+                    updates = []
+        if current is not None:
+            updates.append(tuple(current))
+        await write(updates)
+        if dry_run:
+            print(f" {path}: будет пересчитана статистика пользователей: {users}")
+        else:
+            await db.commit()
+            print(f" {path}: пересчитана статистика пользователей: {users}")
+    await _for_each_shard(db_name, shards, action)
+
+
+def check_database_structure(db_name: str, shards: int):
     """Проверка структуры базы данных"""
-    
-    if not os.path.exists(DB_NAME):
-        print(f"База данных {DB_NAME} не найдена.")
-        return
-    
-    print(f" Проверка структуры базы данных {DB_NAME}...")
-    
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    try:
-        # Получаем список всех таблиц
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = cursor.fetchall()
-        
-        print(f"Найдены таблицы: {[t[0] for t in tables]}")
-        
-        # Проверяем каждую таблицу
-        for table in tables:
-            table_name = table[0]
-            print(f"\n Таблица: {table_name}")
-            
-            cursor.execute(f"PRAGMA table_info({table_name})")
-            columns = cursor.fetchall()
-            
-            for col in columns:
-                col_id, col_name, col_type, not_null, default_val, pk = col
-                print(f"  Колонка {col_id}: {col_name} ({col_type}) {'PRIMARY KEY' if pk else ''}")
-    
-    except Exception as e:
-        print(f" Ошибка при проверке: {e}")
-    
-    finally:
-        conn.close()
+    for path in shard_paths(db_name, shards):
+        if not os.path.exists(path):
+            print(f"База данных {path} не найдена.")
+            continue
+
+        print(f" Проверка структуры базы данных {path}...")
+
+        conn = sqlite3.connect(path)
+        cursor = conn.cursor()
+
+        try:
+            # Получаем список всех таблиц
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+            tables = cursor.fetchall()
+
+            print(f"Найдены таблицы: {[t[0] for t in tables]}")
+
+            # Проверяем каждую таблицу
+            for table in tables:
+                table_name = table[0]
+                print(f"\n Таблица: {table_name}")
+
+                cursor.execute(f"PRAGMA table_info({table_name})")
+                columns = cursor.fetchall()
+
+                for col in columns:
+                    col_id, col_name, col_type, not_null, default_val, pk = col
+                    print(f"  Колонка {col_id}: {col_name} ({col_type}) {'PRIMARY KEY' if pk else ''}")
+
+        except Exception as e:
+            print(f" Ошибка при проверке: {e}")
+
+        finally:
+            conn.close()
+
 
 if __name__ == "__main__":
-    print("=" * 50)
-    print("Мигратор базы данных Python Quiz Bot")
-    print("=" * 50)
-    
-    print("\n1. Проверить структуру базы данных")
-    print("2. Выполнить миграцию")
-    print("3. Выйти")
-    
-    choice = input("\nВыберите действие (1-3): ")
-    
-    if choice == "1":
-        check_database_structure()
-    elif choice == "2":
-        migrate_database()
-    elif choice == "3":
-        print("Выход...")
-    else:
-        print("Неверный выбор")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Мигратор базы данных Python Quiz Bot")
+    parser.add_argument('--db', default=DB_NAME, help="имя базы данных (по умолчанию из config.py)")
+    parser.add_argument('--shards', type=int, default=DB_SHARDS, help="число шардов (по умолчанию из config.py)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('status', help="версия схемы и незавершенные миграции")
+
+    upgrade_parser = commands.add_parser('upgrade', help="применить недостающие миграции схемы")
+    upgrade_parser.add_argument('--dry-run', action='store_true', help="только показать, что будет сделано")
+
+    backfill_parser = commands.add_parser('backfill', help="перенести данные порциями")
+    backfill_parser.add_argument('--batch-size', type=int, default=500, help="строк в одной транзакции")
+    backfill_parser.add_argument('--pause', type=float, default=0.05, help="пауза между порциями, сек")
+    backfill_parser.add_argument('--dry-run', action='store_true', help="только показать, что будет сделано")
+
+    commands.add_parser('check', help="показать структуру таблиц")
+
+    rebuild_parser = commands.add_parser('rebuild-stats', help="пересчитать user_stats по журналу ответов")
+    rebuild_parser.add_argument('--dry-run', action='store_true', help="только показать, что будет сделано")
+
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        asyncio.run(show_status(args.db, args.shards))
+    elif args.command == 'upgrade':
+        asyncio.run(upgrade(args.db, args.shards, args.dry_run))
+    elif args.command == 'backfill':
+        asyncio.run(backfill(args.db, args.shards, args.batch_size, args.pause, args.dry_run))
+    elif args.command == 'check':
+        check_database_structure(args.db, args.shards)
+    elif args.command == 'rebuild-stats':
+        asyncio.run(rebuild_stats(args.db, args.shards, args.dry_run))
@@ -0,0 +1,331 @@
+"""Версионные миграции схемы базы данных.
+
+Каждая миграция состоит из быстрой части upgrade (DDL, выполняется
+одной транзакцией при запуске бота или из migrate.py) и необязательной
+части backfill - переноса данных порциями. Backfill выполняется уже
+после запуска бота: каждая порция фиксируется отдельно, поэтому
+блокировка записи не удерживается надолго.
+
+Примененные миграции записываются в таблицу schema_version.
+"""
+import asyncio
+import sqlite3
+from question_codec import pack_questions, unpack_questions
+
+
+class Migration:
+    def __init__(self, version: int, description: str, upgrade, backfill=None):
+        self.version = version
+        self.description = description
+        self.upgrade = upgrade
+        # backfill(db, last_key, batch_size) -> новый last_key или None, если данные закончились
+        self.backfill = backfill
+
+
+async def _column_names(db, table: str) -> list:
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        return [col[1] for col in await cursor.fetchall()]
+
+
+async def _add_column(db, table: str, column: str, declaration: str):
+    """Добавить колонку, если ее еще нет (для баз, созданных до миграций)"""
+    if column not in await _column_names(db, table):
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+        print(f"✅ Добавлена колонка {column} в {table}")
+
+
+# 1. Исходная схема
+
+async def _upgrade_base_schema(db):
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS quiz_state (
+            user_id INTEGER PRIMARY KEY,
+            question_index INTEGER DEFAULT 0,
+            score INTEGER DEFAULT 0,
+            completed INTEGER DEFAULT 0,
+            used_questions TEXT DEFAULT '[]',
+            current_questions TEXT DEFAULT '[]'
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            total_quizzes INTEGER DEFAULT 0,
+            total_correct INTEGER DEFAULT 0,
+            total_questions INTEGER DEFAULT 0,
+            best_score INTEGER DEFAULT 0,
+            last_quiz_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS quiz_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            score INTEGER,
+            total_questions INTEGER,
+            quiz_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES user_stats (user_id)
+        )
+    ''')
+    # Колонки, которых не было в самых ранних версиях бота
+    await _add_column(db, 'user_stats', 'username', 'TEXT')
+    await _add_column(db, 'user_stats', 'first_name', 'TEXT')
+    await _add_column(db, 'user_stats', 'last_name', 'TEXT')
+    await _add_column(db, 'user_stats', 'last_quiz_date', 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
+
+
+# 2. Ссылка quiz_state -> quiz_history и индекс истории
+
+async def _upgrade_history_id(db):
+    await _add_column(db, 'quiz_state', 'history_id', 'INTEGER')
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_quiz_history_user_date
+        ON quiz_history (user_id, quiz_date, score, total_questions)
+    ''')
+
+
+async def _backfill_history_id(db, last_key, batch_size: int):
+    async with db.execute(
+        'SELECT user_id FROM quiz_state WHERE user_id > ? AND history_id IS NULL ORDER BY user_id LIMIT ?',
+        (last_key if last_key is not None else -2 ** 63, batch_size)
+    ) as cursor:
+        user_ids = [row[0] for row in await cursor.fetchall()]
+    if not user_ids:
+        return None
+    await db.executemany('''
+        UPDATE quiz_state
+        SET history_id = (
+            SELECT id FROM quiz_history
+            WHERE quiz_history.user_id = quiz_state.user_id
+            ORDER BY quiz_date DESC, id DESC
+            LIMIT 1
+        )
+        WHERE user_id = ?
+    ''', [(user_id,) for user_id in user_ids])
+    return user_ids[-1]
+
+
+# 3. Индекс для выборки топа игроков
+
+async def _upgrade_rank_index(db):
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_stats_rank
+        ON user_stats (best_score DESC, total_correct DESC, total_quizzes DESC)
+    ''')
+
+
+# 4. Последовательности вопросов в бинарном формате
+
+async def _upgrade_nothing(db):
+    pass
+
+
+async def _backfill_packed_questions(db, last_key, batch_size: int):
+    async with db.execute('''
+        SELECT user_id, used_questions, current_questions FROM quiz_state
+        WHERE user_id > ?
+          AND (typeof(used_questions) = 'text' OR typeof(current_questions) = 'text')
+        ORDER BY user_id
+        LIMIT ?
+    ''', (last_key if last_key is not None else -2 ** 63, batch_size)) as cursor:
+        rows = await cursor.fetchall()
+    if not rows:
+        return None
+    await db.executemany(
+        'UPDATE quiz_state SET used_questions = ?, current_questions = ? WHERE user_id = ?',
+        [(pack_questions(unpack_questions(used)), pack_questions(unpack_questions(current)), user_id)
+         for user_id, used, current in rows]
+    )
+    return rows[-1][0]
+
+
+# 5. Журнал ответов
+
+async def _upgrade_answers(db):
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS answers (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            history_id INTEGER,
+            question_id INTEGER NOT NULL,
+            chosen_option INTEGER NOT NULL,
+            is_correct INTEGER NOT NULL,
+            response_ms INTEGER,
+            answered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+# 6. Счетчики ответов по вопросам
+
+async def _upgrade_question_stats(db):
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS question_stats (
+            question_id INTEGER NOT NULL,
+            option_index INTEGER NOT NULL,
+            picks INTEGER NOT NULL DEFAULT 0,
+            correct_picks INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (question_id, option_index)
+        ) WITHOUT ROWID
+    ''')
+    # Журнал ответов еще небольшой, поэтому счетчики заполняются сразу
+    await db.execute('''
+        INSERT OR IGNORE INTO question_stats (question_id, option_index, picks, correct_picks)
+        SELECT question_id, chosen_option, COUNT(*), SUM(is_correct)
+        FROM answers
+        GROUP BY question_id, chosen_option
+    ''')
+
+
+# 7. Рейтинги за день и за неделю
+
+async def _upgrade_period_stats(db):
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS period_stats (
+            period TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            quizzes INTEGER NOT NULL DEFAULT 0,
+            correct INTEGER NOT NULL DEFAULT 0,
+            questions INTEGER NOT NULL DEFAULT 0,
+            best_score INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, bucket, user_id)
+        ) WITHOUT ROWID
+    ''')
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_period_stats_rank
+        ON period_stats (period, bucket, best_score DESC, correct DESC, quizzes DESC)
+    ''')
+
+
+# 8. Помесячные итоги для свернутой истории
+
+async def _upgrade_history_retention(db):
+    # Без значения по умолчанию: у старых записей признак остается NULL
+    await _add_column(db, 'quiz_history', 'completed', 'INTEGER')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS quiz_history_monthly (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            quizzes INTEGER NOT NULL DEFAULT 0,
+            correct INTEGER NOT NULL DEFAULT 0,
+            questions INTEGER NOT NULL DEFAULT 0,
+            best_score INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, month)
+        ) WITHOUT ROWID
+    ''')
+
+
+# 9. Версия состояния квиза для оптимистичных обновлений
+
+async def _upgrade_state_version(db):
+    await _add_column(db, 'quiz_state', 'version', 'INTEGER NOT NULL DEFAULT 0')
+
+
+MIGRATIONS = [
+    Migration(1, "Исходная схема", _upgrade_base_schema),
+    Migration(2, "Ссылка на запись истории в quiz_state и индекс истории",
+              _upgrade_history_id, _backfill_history_id),
+    Migration(3, "Индекс рейтинга игроков", _upgrade_rank_index),
+    Migration(4, "Бинарный формат последовательностей вопросов",
+              _upgrade_nothing, _backfill_packed_questions),
+    Migration(5, "Журнал ответов", _upgrade_answers),
+    Migration(6, "Счетчики ответов по вопросам", _upgrade_question_stats),
+    Migration(7, "Рейтинги за день и за неделю", _upgrade_period_stats),
+    Migration(8, "Помесячные итоги истории квизов", _upgrade_history_retention),
+    Migration(9, "Версия состояния квиза", _upgrade_state_version),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+async def _ensure_version_table(db):
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            backfilled INTEGER DEFAULT 1,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+async def get_schema_status(db):
+    """Текущая версия схемы и число миграций с незавершенным переносом данных"""
+    try:
+        async with db.execute(
+            'SELECT COALESCE(MAX(version), 0), COUNT(*) FILTER (WHERE backfilled = 0) FROM schema_version'
+        ) as cursor:
+            version, pending = await cursor.fetchone()
+        return version, pending
+    except sqlite3.OperationalError:
+        # Таблицы schema_version еще нет
+        return 0, 0
+
+
+async def apply_migrations(db, dry_run: bool = False) -> list:
+    """Применить DDL-части недостающих миграций, вернуть их список"""
+    version, _ = await get_schema_status(db)
+    pending = [m for m in MIGRATIONS if m.version > version]
+    if dry_run or not pending:
+        return pending
+
+    await _ensure_version_table(db)
+    for migration in pending:
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            # Миграцию мог уже применить другой процесс
+            async with db.execute('SELECT 1 FROM schema_version WHERE version = ?', (migration.version,)) as cursor:
+                if await cursor.fetchone():
+                    await db.rollback()
+                    continue
+            await migration.upgrade(db)
+            await db.execute(
+                'INSERT INTO schema_version (version, description, backfilled) VALUES (?, ?, ?)',
+                (migration.version, migration.description, 0 if migration.backfill else 1)
+            )
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        print(f"✅ Применена миграция {migration.version}: {migration.description}")
+    return pending
+
+
+async def pending_backfills(db) -> list:
+    """Миграции, перенос данных которых еще не завершен"""
+    try:
+        async with db.execute('SELECT version FROM schema_version WHERE backfilled = 0') as cursor:
+            versions = {row[0] for row in await cursor.fetchall()}
+    except sqlite3.OperationalError:
+        return []
+    return [m for m in MIGRATIONS if m.version in versions]
+
+
+async def run_backfills(connect, batch_size: int = 500, pause: float = 0.05):
+    """Выполнить незавершенные переносы данных порциями по batch_size строк.
+
+    connect() возвращает асинхронный контекстный менеджер с соединением;
+    соединение берется заново для каждой порции, а каждая порция -
+    отдельная транзакция. Между порциями делается пауза, чтобы
+    обработчики бота успевали выполнять свои запросы.
+    """
+    async with connect() as db:
+        migrations = await pending_backfills(db)
+    for migration in migrations:
+        last_key = None
+        processed = 0
+        while True:
+            async with connect() as db:
+                last_key = await migration.backfill(db, last_key, batch_size)
+                await db.commit()
+            if last_key is None:
+                break
+            processed += 1
+            await asyncio.sleep(pause)
+        async with connect() as db:
+            await db.execute('UPDATE schema_version SET backfilled = 1 WHERE version = ?', (migration.version,))
+            await db.commit()
+        print(f"✅ Перенос данных миграции {migration.version} завершен (порций: {processed})")
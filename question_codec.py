@@ -0,0 +1,32 @@
+import json
+import sys
+from array import array
+
+
+def pack_questions(questions) -> bytes:
+    """Упаковать последовательность номеров вопросов в BLOB.
+    
+    Первый байт - код типа array ('H' - uint16, 'I' - uint32),
+    далее элементы в порядке little-endian.
+    """
+    typecode = 'H' if max(questions, default=0) <= 0xFFFF else 'I'
+    data = array(typecode, questions)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return typecode.encode() + data.tobytes()
+
+
+def unpack_questions(value) -> list:
+    """Распаковать последовательность вопросов (BLOB или старый JSON)"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return []
+    data = array(chr(value[0]))
+    data.frombytes(value[1:])
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data.tolist()
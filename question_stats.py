@@ -0,0 +1,80 @@
+import bisect
+
+
+def count_answers(answers) -> list:
+    """Свернуть ответы журнала в приращения счетчиков.
+
+    Возвращает список (question_id, option_index, picks, correct_picks),
+    по одной строке на выбранный вариант ответа.
+    """
+    counts = {}
+    for _, _, question_id, chosen_option, is_correct, _, _ in answers:
+        key = (question_id, chosen_option)
+        picks, correct = counts.get(key, (0, 0))
+        counts[key] = (picks + 1, correct + (1 if is_correct else 0))
+    return [(question_id, option, picks, correct)
+            for (question_id, option), (picks, correct) in counts.items()]
+
+
+class QuestionStats:
+    """Счетчики ответов по вопросам, поддерживаемые в памяти.
+
+    Для каждого вопроса хранится, сколько раз на него ответили, сколько
+    раз верно и сколько раз выбран каждый вариант. Вопросы держатся
+    в списке, отсортированном по доле верных ответов, поэтому самые
+    сложные и самые простые вопросы отдаются за O(k).
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._questions = {}
+
+    @staticmethod
+    def sort_key(question: dict):
+        """Ключ сортировки: чем меньше, тем сложнее вопрос"""
+        return (question['correct'] / question['answered'], -question['answered'], question['question_id'])
+
+    def __len__(self):
+        return len(self._keys)
+
+    def load(self, rows):
+        """Заполнить счетчики заново из строк (question_id, option_index, picks, correct_picks)"""
+        self._questions = {}
+        self._keys = []
+        self.add(rows)
+
+    def add(self, rows):
+        """Прибавить приращения (question_id, option_index, picks, correct_picks)"""
+        changed = {}
+        for question_id, option_index, picks, correct in rows:
+            question = self._questions.get(question_id)
+            if question is None:
+                question = {'question_id': question_id, 'answered': 0, 'correct': 0, 'picks': {}}
+                self._questions[question_id] = question
+            if question_id not in changed:
+                changed[question_id] = self.sort_key(question) if question['answered'] else None
+            question['answered'] += picks
+            question['correct'] += correct
+            question['picks'][option_index] = question['picks'].get(option_index, 0) + picks
+        for question_id, old_key in changed.items():
+            if old_key is not None:
+                del self._keys[bisect.bisect_left(self._keys, old_key)]
+            bisect.insort(self._keys, self.sort_key(self._questions[question_id]))
+
+    def _summary(self, key) -> dict:
+        question = self._questions[key[-1]]
+        return {
+            'question_id': question['question_id'],
+            'answered': question['answered'],
+            'correct': question['correct'],
+            'accuracy': round(question['correct'] / question['answered'] * 100, 1),
+            'picks': dict(sorted(question['picks'].items()))
+        }
+
+    def hardest(self, limit: int = 5):
+        """limit вопросов с наименьшей долей верных ответов"""
+        return [self._summary(key) for key in self._keys[:limit]]
+
+    def easiest(self, limit: int = 5):
+        """limit вопросов с наибольшей долей верных ответов"""
+        return [self._summary(key) for key in reversed(self._keys[-limit:])] if limit > 0 else []
@@ -0,0 +1,173 @@
+import asyncio
+import heapq
+import itertools
+import time
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+from aiogram.types import InlineKeyboardMarkup
+from config import OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_MAX_RETRIES
+
+
+class TokenBucket:
+    """Ведро токенов с резервированием.
+
+    reserve() сразу забирает токен (счет может уйти в минус) и
+    возвращает, сколько ждать до его появления, поэтому запросы
+    обслуживаются по порядку без отдельной очереди.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Забрать токен и вернуть время ожидания (сек)"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.paused_until - now)
+
+    def refund(self):
+        """Вернуть неиспользованный токен"""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def pause(self, seconds: float):
+        """Не выдавать токены seconds секунд (ответ Telegram 429)"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+        self.paused_until = max(self.paused_until, now + seconds)
+
+    def is_idle(self, now: float) -> bool:
+        """Ведро полное - его можно забыть без потери информации"""
+        self._refill(now)
+        return self.tokens >= self.burst and now >= self.paused_until
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    """Ограничение частоты исходящих запросов к Telegram.
+
+    Подключается к сессии бота (bot.session.middleware) и пропускает
+    все запросы, адресованные чату, через два ограничителя: ведро
+    чата (chat_rate в секунду, запас chat_burst) и общее ведро бота
+    (global_rate в секунду). Общее ведро раздает токены одна фоновая
+    задача в порядке приоритета: вопросы квиза идут раньше
+    информационных сообщений. Если Telegram все же ответил 429
+    (TelegramRetryAfter), чат ставится на паузу на указанное время, а
+    запрос повторяется до max_retries раз. Запросы без чата (получение
+    обновлений, ответы на нажатия) не ограничиваются.
+    """
+
+    QUESTION = 0
+    INFO = 1
+
+    # Сколько ведер чатов держать, прежде чем забывать полные
+    MAX_CHATS = 10000
+
+    def __init__(self, global_rate: float = OUTBOUND_GLOBAL_RATE,
+                 chat_rate: float = OUTBOUND_CHAT_RATE, chat_burst: float = OUTBOUND_CHAT_BURST,
+                 max_retries: int = OUTBOUND_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chats = {}
+        self._prune_at = self.MAX_CHATS
+        self._waiters = []  # (приоритет, номер, future)
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def start(self):
+        """Запустить раздачу общих токенов"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def close(self):
+        """Остановить раздачу; ожидающие запросы пропускаются без ограничения"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+
+    async def _dispatch(self):
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            wait = self.global_bucket.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            # Токен достается самому приоритетному запросу на момент выдачи
+            while self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    future.set_result(None)
+                    break
+            else:
+                self.global_bucket.refund()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self._prune_at:
+                now = time.monotonic()
+                for idle in [c for c, b in self._chats.items() if b.is_idle(now)]:
+                    del self._chats[idle]
+                self._prune_at = max(self.MAX_CHATS, 2 * len(self._chats))
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    @classmethod
+    def priority(cls, method) -> int:
+        """Вопрос квиза - сообщение с кнопками вариантов ответа"""
+        if isinstance(method, SendMessage) and isinstance(method.reply_markup, InlineKeyboardMarkup):
+            return cls.QUESTION
+        return cls.INFO
+
+    async def _acquire(self, chat_id, priority: int):
+        wait = self._chat_bucket(chat_id).reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        if self._task is None:
+            # Раздача не запущена - общее ведро без приоритетов
+            wait = self.global_bucket.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._wakeup.set()
+        await future
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        priority = self.priority(method)
+        for attempt in itertools.count():
+            await self._acquire(chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                print(f"⏳ Ограничение Telegram в чате {chat_id}: повтор через {e.retry_after} с")
+                self._chat_bucket(chat_id).pause(e.retry_after)
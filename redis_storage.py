@@ -0,0 +1,437 @@
+import asyncio
+from contextlib import AsyncExitStack
+from datetime import datetime
+from urllib.parse import urlparse
+from config import REDIS_URL, DB_LOCK_STRIPES
+from question_codec import pack_questions, unpack_questions
+from question_stats import count_answers
+from leaderboard import period_buckets
+from storage import Storage
+
+
+class RedisError(Exception):
+    """Ошибка, возвращенная сервером Redis"""
+
+
+class RedisConnection:
+    """Минимальный асинхронный клиент протокола Redis (RESP2).
+
+    Поддерживает одиночные команды и конвейеры (pipeline); запросы
+    на одном соединении выполняются по очереди.
+    """
+
+    def __init__(self, url: str = REDIS_URL):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self.execute('AUTH', self.password)
+        if self.db:
+            await self.execute('SELECT', self.db)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if isinstance(arg, bytes):
+                data = arg
+            elif isinstance(arg, str):
+                data = arg.encode('utf-8')
+            else:
+                data = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        return b''.join(parts)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Соединение с Redis закрыто")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode('utf-8')
+        if kind == b'-':
+            return RedisError(payload.decode('utf-8'))
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RedisError(f"Неизвестный ответ Redis: {line!r}")
+
+    async def execute(self, *args):
+        """Выполнить одну команду"""
+        (reply,) = await self.pipeline([args])
+        return reply
+
+    async def pipeline(self, commands):
+        """Отправить несколько команд разом и прочитать все ответы"""
+        async with self._lock:
+            if self._writer is None:
+                await self.connect()
+            try:
+                self._writer.write(b''.join(self._encode(args) for args in commands))
+                await self._writer.drain()
+                replies = [await self._read_reply() for _ in commands]
+            except BaseException:
+                # При обрыве или отмене посреди запроса непрочитанные ответы
+                # остались бы в сокете и достались следующей команде, поэтому
+                # закрываем соединение и переподключимся при следующем запросе
+                self._writer.close()
+                self._writer = None
+                raise
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+
+def _now() -> str:
+    """Текущее время в формате datetime() SQLite"""
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _text(value):
+    return value.decode('utf-8') if value is not None else None
+
+
+class RedisStorage(Storage):
+    """Хранилище в Redis.
+
+    Ключи:
+      quiz:{user_id}     - hash с состоянием квиза
+      stats:{user_id}    - hash со статистикой пользователя
+      history:{id}       - hash с записью истории, history:last:{user_id} - id последней
+      leaderboard        - sorted set с составным счетом
+                           best_score * 10^12 + total_correct * 10^5 + total_quizzes
+      answers            - stream с журналом ответов
+      question:{id}      - hash со счетчиками вопроса: answered, correct, pick:{вариант}
+      question_accuracy  - sorted set вопросов по доле верных ответов
+      top:{period}:{bucket}           - sorted set рейтинга за день/неделю (счет как у leaderboard)
+      top:{period}:{bucket}:{user_id} - hash с результатами игрока за период
+                           ключи периодов удаляются самим Redis по истечении PERIOD_TTL
+    Изменения одного пользователя сериализуются полосатыми блокировками,
+    а сами записи отправляются в MULTI/EXEC.
+    """
+
+    PERIOD_FIELDS = ('total_quizzes', 'total_correct', 'total_questions', 'best_score')
+    # Корзина хранится, пока она текущая или предыдущая
+    PERIOD_TTL = {'day': 2 * 24 * 3600, 'week': 14 * 24 * 3600}
+
+    STATS_FIELDS = ('username', 'first_name', 'last_name', 'total_quizzes',
+                    'total_correct', 'total_questions', 'best_score', 'last_quiz')
+
+    def __init__(self, url: str = REDIS_URL, lock_stripes: int = DB_LOCK_STRIPES):
+        self.redis = RedisConnection(url)
+        self._user_locks = [asyncio.Lock() for _ in range(max(1, lock_stripes))]
+
+    def _user_lock(self, user_id: int) -> asyncio.Lock:
+        return self._user_locks[hash(user_id) % len(self._user_locks)]
+
+    @staticmethod
+    def _leaderboard_score(stats: dict) -> int:
+        return (stats['best_score'] * 10 ** 12
+                + min(stats['total_correct'], 10 ** 7 - 1) * 10 ** 5
+                + min(stats['total_quizzes'], 10 ** 5 - 1))
+
+    async def create_tables(self):
+        await self.redis.connect()
+        print("✅ Подключение к Redis установлено")
+
+    async def close(self):
+        await self.redis.close()
+
+    async def get_quiz_state(self, user_id: int):
+        fields = await self.redis.execute(
+            'HMGET', f'quiz:{user_id}', 'question_index', 'score', 'completed',
+            'used_questions', 'current_questions', 'history_id', 'version'
+        )
+        if fields[0] is None:
+            return None
+        return {
+            'question_index': int(fields[0]),
+            'score': int(fields[1]),
+            'completed': int(fields[2]),
+            'used_questions': unpack_questions(fields[3]),
+            'current_questions': unpack_questions(fields[4]),
+            'history_id': int(fields[5]),
+            'version': int(fields[6] or 0)
+        }
+
+    async def init_user_quiz(self, user_id: int, question_sequence: list,
+                             username: str = "", first_name: str = "", last_name: str = ""):
+        async with self._user_lock(user_id):
+            history_id = await self.redis.execute('INCR', 'history:next_id')
+            now = _now()
+            await self.redis.pipeline([
+                ('MULTI',),
+                ('HSET', f'stats:{user_id}', 'username', username or "",
+                 'first_name', first_name or "", 'last_name', last_name or ""),
+                ('HSETNX', f'stats:{user_id}', 'total_quizzes', 0),
+                ('HSETNX', f'stats:{user_id}', 'total_correct', 0),
+                ('HSETNX', f'stats:{user_id}', 'total_questions', 0),
+                ('HSETNX', f'stats:{user_id}', 'best_score', 0),
+                ('HSETNX', f'stats:{user_id}', 'last_quiz', now),
+                ('HSET', f'history:{history_id}', 'user_id', user_id, 'score', 0,
+                 'total_questions', len(question_sequence), 'quiz_date', now),
+                ('SET', f'history:last:{user_id}', history_id),
+                ('DEL', f'quiz:{user_id}'),
+                ('HSET', f'quiz:{user_id}', 'question_index', 0, 'score', 0, 'completed', 0,
+                 'used_questions', b'', 'current_questions', pack_questions(question_sequence),
+                 'history_id', history_id, 'version', 0),
+                ('EXEC',),
+            ])
+            return history_id
+
+    async def update_quiz_state(self, user_id: int, question_index: int, score: int = None,
+                                expected_version: int = None) -> bool:
+        async with self._user_lock(user_id):
+            version = await self.redis.execute('HGET', f'quiz:{user_id}', 'version')
+            if version is None:
+                # Состояние, созданное до появления версии, считаем версией 0
+                if not await self.redis.execute('EXISTS', f'quiz:{user_id}'):
+                    return expected_version is None
+                version = 0
+            if expected_version is not None and int(version) != expected_version:
+                return False
+            args = ['HSET', f'quiz:{user_id}', 'question_index', question_index, 'version', int(version) + 1]
+            if score is not None:
+                args += ['score', score]
+            await self.redis.execute(*args)
+            return True
+
+    async def save_quiz_states(self, states: list):
+        if not states:
+            return
+        # Между чтением и записью состояние не должны пересоздать или
+        # удалить; полосы блокируются по порядку, чтобы не было взаимоблокировок
+        locks = {id(lock): lock for lock in (self._user_lock(user_id) for user_id, *_ in states)}
+        async with AsyncExitStack() as stack:
+            for lock in sorted(locks.values(), key=self._user_locks.index):
+                await stack.enter_async_context(lock)
+            current = await self.redis.pipeline([
+                ('HMGET', f'quiz:{user_id}', 'history_id', 'version') for user_id, _, _, _, _ in states
+            ])
+            commands = [
+                ('HSET', f'quiz:{user_id}', 'question_index', question_index, 'score', score, 'version', version)
+                for (user_id, history_id, question_index, score, version), (stored, stored_version)
+                in zip(states, current)
+                if stored is not None and int(stored) == history_id and int(stored_version or 0) < version
+            ]
+            if commands:
+                await self.redis.pipeline(commands)
+
+    async def save_answers(self, answers: list):
+        if not answers:
+            return
+        commands = [
+            ('XADD', 'answers', '*',
+             'user_id', user_id, 'history_id', history_id, 'question_id', question_id,
+             'chosen_option', chosen_option, 'is_correct', is_correct,
+             'response_ms', response_ms if response_ms is not None else '',
+             'answered_at', answered_at)
+            for user_id, history_id, question_id, chosen_option, is_correct, response_ms, answered_at in answers
+        ]
+        increments = count_answers(answers)
+        for question_id, option_index, picks, correct in increments:
+            commands += [
+                ('HINCRBY', f'question:{question_id}', 'answered', picks),
+                ('HINCRBY', f'question:{question_id}', 'correct', correct),
+                ('HINCRBY', f'question:{question_id}', f'pick:{option_index}', picks),
+            ]
+        replies = await self.redis.pipeline(commands)
+
+        # HINCRBY возвращает новые значения - по ним пересчитываем долю верных
+        counters = {}
+        position = len(answers)
+        for question_id, _, _, _ in increments:
+            counters[question_id] = (replies[position], replies[position + 1])
+            position += 3
+        await self.redis.execute('ZADD', 'question_accuracy', *[
+            value
+            for question_id, (answered, correct) in counters.items()
+            for value in (correct / answered, question_id)
+        ])
+
+    async def get_question_stats(self, limit: int = 5, hardest: bool = True):
+        if limit <= 0:
+            return []
+        question_ids = await self.redis.execute(
+            'ZRANGE' if hardest else 'ZREVRANGE', 'question_accuracy', 0, limit - 1
+        )
+        if not question_ids:
+            return []
+        rows = await self.redis.pipeline([
+            ('HGETALL', f'question:{int(question_id)}') for question_id in question_ids
+        ])
+        questions = []
+        for question_id, fields in zip(question_ids, rows):
+            counters = {_text(fields[i]): int(fields[i + 1]) for i in range(0, len(fields), 2)}
+            answered = counters.get('answered', 0)
+            if not answered:
+                continue
+            questions.append({
+                'question_id': int(question_id),
+                'answered': answered,
+                'correct': counters.get('correct', 0),
+                'accuracy': round(counters.get('correct', 0) / answered * 100, 1),
+                'picks': dict(sorted(
+                    (int(name[5:]), value) for name, value in counters.items() if name.startswith('pick:')
+                ))
+            })
+        return questions
+
+    async def complete_quiz(self, user_id: int, score: int, total_questions: int):
+        async with self._user_lock(user_id):
+            completed, history_id = await self.redis.execute(
+                'HMGET', f'quiz:{user_id}', 'completed', 'history_id'
+            )
+            if completed is None or int(completed):
+                print(f"⚠️ Нет активного квиза для завершения: user_id={user_id}")
+                return None
+
+            stats = await self.get_user_stats(user_id) or {
+                'username': None, 'first_name': None, 'last_name': None,
+                'total_quizzes': 0, 'total_correct': 0, 'total_questions': 0,
+                'best_score': 0, 'last_quiz': None
+            }
+            stats['total_quizzes'] += 1
+            stats['total_correct'] += score
+            stats['total_questions'] += total_questions
+            stats['best_score'] = max(stats['best_score'], score)
+            stats['last_quiz'] = _now()
+
+            buckets = period_buckets()
+            period_rows = await self.redis.pipeline([
+                ('HMGET', f'top:{period}:{bucket}:{user_id}', *self.PERIOD_FIELDS)
+                for period, bucket in buckets.items()
+            ])
+            period_commands = []
+            for (period, bucket), fields in zip(buckets.items(), period_rows):
+                current = dict(zip(self.PERIOD_FIELDS, (int(value or 0) for value in fields)))
+                current['total_quizzes'] += 1
+                current['total_correct'] += score
+                current['total_questions'] += total_questions
+                current['best_score'] = max(current['best_score'], score)
+                ttl = self.PERIOD_TTL[period]
+                period_commands += [
+                    ('HSET', f'top:{period}:{bucket}:{user_id}',
+                     *(value for field in self.PERIOD_FIELDS for value in (field, current[field]))),
+                    ('EXPIRE', f'top:{period}:{bucket}:{user_id}', ttl),
+                    ('ZADD', f'top:{period}:{bucket}', self._leaderboard_score(current), user_id),
+                    ('EXPIRE', f'top:{period}:{bucket}', ttl),
+                ]
+
+            await self.redis.pipeline([
+                ('MULTI',),
+                ('HSET', f'quiz:{user_id}', 'completed', 1),
+                ('HSET', f'stats:{user_id}',
+                 'total_quizzes', stats['total_quizzes'],
+                 'total_correct', stats['total_correct'],
+                 'total_questions', stats['total_questions'],
+                 'best_score', stats['best_score'],
+                 'last_quiz', stats['last_quiz']),
+                ('HSET', f'history:{int(history_id)}', 'score', score, 'quiz_date', stats['last_quiz']),
+                ('ZADD', 'leaderboard', self._leaderboard_score(stats), user_id),
+                *period_commands,
+                ('EXEC',),
+            ])
+            return stats
+
+    async def clear_quiz_state(self, user_id: int):
+        async with self._user_lock(user_id):
+            await self.redis.execute('DEL', f'quiz:{user_id}')
+
+    def _stats_from_fields(self, fields):
+        if fields[3] is None:
+            return None
+        return {
+            'username': _text(fields[0]),
+            'first_name': _text(fields[1]),
+            'last_name': _text(fields[2]),
+            'total_quizzes': int(fields[3]),
+            'total_correct': int(fields[4]),
+            'total_questions': int(fields[5]),
+            'best_score': int(fields[6]),
+            'last_quiz': _text(fields[7])
+        }
+
+    async def get_user_stats(self, user_id: int):
+        fields = await self.redis.execute('HMGET', f'stats:{user_id}', *self.STATS_FIELDS)
+        return self._stats_from_fields(fields)
+
+    async def get_last_quiz_result(self, user_id: int):
+        history_id = await self.redis.execute('GET', f'history:last:{user_id}')
+        if history_id is None:
+            return None
+        fields = await self.redis.execute(
+            'HMGET', f'history:{int(history_id)}', 'score', 'total_questions', 'quiz_date'
+        )
+        if fields[0] is None:
+            return None
+        return {
+            'score': int(fields[0]),
+            'total_questions': int(fields[1]),
+            'quiz_date': _text(fields[2])
+        }
+
+    async def get_top_players(self, limit: int = 10, period: str = None):
+        key = 'leaderboard' if period is None else f'top:{period}:{period_buckets()[period]}'
+        user_ids = await self.redis.execute('ZREVRANGE', key, 0, limit - 1)
+        if not user_ids:
+            return []
+        rows = await self.redis.pipeline([
+            ('HMGET', f'stats:{int(user_id)}', *self.STATS_FIELDS) for user_id in user_ids
+        ])
+        if period is not None:
+            period_rows = await self.redis.pipeline([
+                ('HMGET', f'{key}:{int(user_id)}', *self.PERIOD_FIELDS) for user_id in user_ids
+            ])
+        players = []
+        for i, (user_id, fields) in enumerate(zip(user_ids, rows)):
+            stats = self._stats_from_fields(fields)
+            if stats is None:
+                continue
+            if period is not None:
+                stats.update(zip(self.PERIOD_FIELDS, (int(value or 0) for value in period_rows[i])))
+            accuracy = (stats['total_correct'] / stats['total_questions'] * 100) if stats['total_questions'] > 0 else 0
+            players.append({
+                'user_id': int(user_id),
+                'username': stats['username'],
+                'first_name': stats['first_name'],
+                'last_name': stats['last_name'],
+                'total_quizzes': stats['total_quizzes'],
+                'best_score': stats['best_score'],
+                'accuracy': round(accuracy, 1)
+            })
+        return players
+
+    async def get_user_rank(self, user_id: int):
+        rank, total = await self.redis.pipeline([
+            ('ZREVRANK', 'leaderboard', user_id),
+            ('ZCARD', 'leaderboard'),
+        ])
+        if rank is None:
+            return None
+        return rank + 1, total
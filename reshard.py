@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Перераспределение базы данных по другому числу шардов.
+
+Пример: python reshard.py --from 1 --to 4
+
+Бот на время перераспределения должен быть остановлен. Новые файлы
+сначала пишутся рядом с суффиксом .reshard, старые после успешного
+копирования переименовываются в *.bak.
+"""
+import argparse
+import os
+import sqlite3
+from config import DB_NAME
+from database import shard_paths, shard_index
+
+# Таблицы с данными пользователей в порядке копирования
+USER_TABLES = ('user_stats', 'quiz_history', 'quiz_state', 'answers', 'period_stats',
+               'quiz_history_monthly')
+# Колонки, ссылающиеся на quiz_history.id (id меняются при переносе)
+HISTORY_REFERENCES = {'quiz_state': 'history_id', 'answers': 'history_id'}
+# Служебные таблицы, одинаковые во всех шардах (копируются из первого)
+SHARED_TABLES = ('schema_version',)
+# Таблицы счетчиков без user_id: ключ -> значения из всех шардов складываются в первый
+COUNTER_TABLES = {'question_stats': ('question_id', 'option_index')}
+BATCH_SIZE = 1000
+
+
+def copy_schema(source: sqlite3.Connection, target: sqlite3.Connection):
+    """Создать в целевом шарде те же таблицы и индексы, что в исходном"""
+    rows = source.execute(
+        "SELECT sql FROM sqlite_master "
+        "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+        "ORDER BY type = 'index'"
+    ).fetchall()
+    for (sql,) in rows:
+        target.execute(sql)
+
+
+def copy_table(table: str, source: sqlite3.Connection, targets: list, history_map: dict):
+    """Скопировать таблицу, раскладывая строки по шардам по user_id"""
+    columns = [col[1] for col in source.execute(f"PRAGMA table_info({table})")]
+    user_pos = columns.index('user_id')
+    # Суррогатные id уникальны только внутри исходного шарда - назначаем заново
+    keep_id = 'id' not in columns
+    insert_columns = columns if keep_id else [c for c in columns if c != 'id']
+    insert_sql = (f"INSERT INTO {table} ({', '.join(insert_columns)}) "
+                  f"VALUES ({', '.join('?' for _ in insert_columns)})")
+    ref_pos = columns.index(HISTORY_REFERENCES[table]) if table in HISTORY_REFERENCES else None
+
+    copied = 0
+    cursor = source.execute(f"SELECT {', '.join(columns)} FROM {table}")
+    while True:
+        rows = cursor.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            target_index = shard_index(row[user_pos], len(targets))
+            values = list(row)
+            if ref_pos is not None and values[ref_pos] is not None:
+                values[ref_pos] = history_map.get(values[ref_pos])
+            if keep_id:
+                targets[target_index].execute(insert_sql, values)
+            else:
+                old_id = values.pop(columns.index('id'))
+                new_cursor = targets[target_index].execute(insert_sql, values)
+                if table == 'quiz_history':
+                    history_map[old_id] = new_cursor.lastrowid
+            copied += 1
+    return copied
+
+
+def merge_counters(table: str, source: sqlite3.Connection, target: sqlite3.Connection):
+    """Прибавить счетчики исходного шарда к счетчикам целевого"""
+    keys = COUNTER_TABLES[table]
+    columns = [col[1] for col in source.execute(f"PRAGMA table_info({table})")]
+    values = [c for c in columns if c not in keys]
+    insert_sql = (f"INSERT INTO {table} ({', '.join(columns)}) "
+                  f"VALUES ({', '.join('?' for _ in columns)}) "
+                  f"ON CONFLICT({', '.join(keys)}) DO UPDATE SET "
+                  + ', '.join(f"{c} = {c} + excluded.{c}" for c in values))
+    rows = source.execute(f"SELECT {', '.join(columns)} FROM {table}").fetchall()
+    target.executemany(insert_sql, rows)
+    return len(rows)
+
+
+def reshard(db_name: str, source_count: int, target_count: int):
+    sources = shard_paths(db_name, source_count)
+    targets = shard_paths(db_name, target_count)
+
+    missing = [path for path in sources if not os.path.exists(path)]
+    if missing:
+        print(f"Не найдены файлы шардов: {missing}")
+        return
+
+    temp_targets = [path + '.reshard' for path in targets]
+    for path in temp_targets:
+        if os.path.exists(path):
+            os.remove(path)
+
+    print(f" Перераспределение {db_name}: {source_count} -> {target_count} шардов...")
+
+    target_conns = [sqlite3.connect(path) for path in temp_targets]
+    try:
+        with sqlite3.connect(sources[0]) as first:
+            for conn in target_conns:
+                # Режим VACUUM задается до создания первой таблицы,
+                # иначе обслуживание не сможет возвращать место
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                copy_schema(first, conn)
+            existing = {row[0] for row in first.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for table in SHARED_TABLES:
+                if table not in existing:
+                    continue
+                rows = first.execute(f"SELECT * FROM {table}").fetchall()
+                if not rows:
+                    continue
+                insert_sql = f"INSERT INTO {table} VALUES ({', '.join('?' for _ in rows[0])})"
+                for conn in target_conns:
+                    conn.executemany(insert_sql, rows)
+
+        for path in sources:
+            source = sqlite3.connect(path)
+            try:
+                # id записей истории уникальны только внутри исходного шарда
+                history_map = {}
+                for table in USER_TABLES:
+                    if table not in existing:
+                        continue
+                    copied = copy_table(table, source, target_conns, history_map)
+                    print(f" {path}: {table} - перенесено строк: {copied}")
+                for table in COUNTER_TABLES:
+                    if table not in existing:
+                        continue
+                    merged = merge_counters(table, source, target_conns[0])
+                    print(f" {path}: {table} - перенесено строк: {merged}")
+            finally:
+                source.close()
+
+        for conn in target_conns:
+            conn.commit()
+    except Exception as e:
+        print(f" Ошибка при перераспределении: {e}")
+        for conn in target_conns:
+            conn.close()
+        for path in temp_targets:
+            os.remove(path)
+        return
+    for conn in target_conns:
+        conn.close()
+
+    # Старые файлы сохраняем как резервные копии
+    for path in sources:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.replace(path + suffix, path + suffix + '.bak')
+    for temp, path in zip(temp_targets, targets):
+        os.replace(temp, path)
+
+    print(" Перераспределение завершено успешно!")
+    print(f" Установите DB_SHARDS={target_count} перед запуском бота.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Перераспределение базы данных по шардам")
+    parser.add_argument('--db', default=DB_NAME, help="имя базы данных (по умолчанию из config.py)")
+    parser.add_argument('--from', dest='source', type=int, required=True, help="текущее число шардов")
+    parser.add_argument('--to', dest='target', type=int, required=True, help="новое число шардов")
+    args = parser.parse_args()
+    reshard(args.db, args.source, args.target)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""Хранение и сжатие истории квизов.
+
+Старые записи quiz_history (старше HISTORY_RETENTION_DAYS) сворачиваются
+в помесячные итоги пользователя в quiz_history_monthly, брошенные квизы
+(записи-заглушки без результата) удаляются через HISTORY_PLACEHOLDER_HOURS.
+После этого освободившиеся страницы возвращаются системе инкрементальным
+VACUUM. Бот выполняет обслуживание раз в сутки в час MAINTENANCE_HOUR (UTC).
+
+Команды:
+  python retention.py run                 - выполнить обслуживание сейчас
+  python retention.py enable-vacuum       - включить инкрементальный VACUUM для
+                                            существующей базы (бот должен быть остановлен)
+"""
+import argparse
+import asyncio
+import os
+from config import (
+    DB_NAME, DB_SHARDS, HISTORY_RETENTION_DAYS, HISTORY_PLACEHOLDER_HOURS,
+    MAINTENANCE_BATCH, MAINTENANCE_PAUSE, VACUUM_PAGES
+)
+
+# Квиз начат, но не завершен. У записей, созданных до появления колонки
+# completed, признаком заглушки служит нулевой счет. Условие никогда не
+# дает NULL, иначе NOT ABANDONED пропустил бы такие записи при свертке.
+ABANDONED = "(CASE WHEN completed IS NULL THEN score = 0 ELSE completed = 0 END)"
+# Записи, на которые ссылается текущее состояние квиза, не трогаем
+NOT_ACTIVE = "id NOT IN (SELECT history_id FROM quiz_state WHERE history_id IS NOT NULL)"
+
+
+async def _select_ids(db, condition: str, params: tuple, last_id: int, batch_size: int) -> list:
+    async with db.execute(
+        f"SELECT id FROM quiz_history WHERE id > ? AND {condition} AND {NOT_ACTIVE} ORDER BY id LIMIT ?",
+        (last_id, *params, batch_size)
+    ) as cursor:
+        return [row[0] for row in await cursor.fetchall()]
+
+
+async def _delete_placeholders(db, last_id: int, batch_size: int, hours: float):
+    ids = await _select_ids(
+        db, f"quiz_date < datetime('now', ?) AND {ABANDONED}", (f'-{hours} hours',), last_id, batch_size
+    )
+    if ids:
+        marks = ', '.join('?' for _ in ids)
+        await db.execute(f"DELETE FROM quiz_history WHERE id IN ({marks})", ids)
+    return ids
+
+
+async def _rollup_history(db, last_id: int, batch_size: int, days: float):
+    ids = await _select_ids(db, "quiz_date < datetime('now', ?)", (f'-{days} days',), last_id, batch_size)
+    if ids:
+        marks = ', '.join('?' for _ in ids)
+        await db.execute(f'''
+            INSERT INTO quiz_history_monthly (user_id, month, quizzes, correct, questions, best_score)
+            SELECT user_id, strftime('%Y-%m', quiz_date), COUNT(*), SUM(score), SUM(total_questions), MAX(score)
+            FROM quiz_history
+            WHERE id IN ({marks}) AND NOT {ABANDONED}
+            GROUP BY user_id, strftime('%Y-%m', quiz_date)
+            ON CONFLICT(user_id, month) DO UPDATE SET
+                quizzes = quizzes + excluded.quizzes,
+                correct = correct + excluded.correct,
+                questions = questions + excluded.questions,
+                best_score = max(best_score, excluded.best_score)
+        ''', ids)
+        await db.execute(f"DELETE FROM quiz_history WHERE id IN ({marks})", ids)
+    return ids
+
+
+async def compact_history(connect, retention_days: float = HISTORY_RETENTION_DAYS,
+                          placeholder_hours: float = HISTORY_PLACEHOLDER_HOURS,
+                          batch_size: int = MAINTENANCE_BATCH, pause: float = MAINTENANCE_PAUSE):
+    """Удалить брошенные квизы и свернуть старую историю в помесячные итоги.
+
+    connect() возвращает асинхронный контекстный менеджер с соединением.
+    Работа идет порциями по batch_size записей, каждая порция - отдельная
+    транзакция, между порциями пауза. Возвращает (удалено заглушек, свернуто записей).
+    """
+    totals = []
+    for step, limit in ((_delete_placeholders, placeholder_hours), (_rollup_history, retention_days)):
+        last_id = 0
+        total = 0
+        while True:
+            async with connect() as db:
+                await db.execute("BEGIN IMMEDIATE")
+                ids = await step(db, last_id, batch_size, limit)
+                await db.commit()
+            if not ids:
+                break
+            last_id = ids[-1]
+            total += len(ids)
+            await asyncio.sleep(pause)
+        totals.append(total)
+    return tuple(totals)
+
+
+async def incremental_vacuum(connect, pages: int = VACUUM_PAGES, pause: float = MAINTENANCE_PAUSE) -> int:
+    """Вернуть системе свободные страницы порциями по pages, вернуть их число"""
+    async with connect() as db:
+        async with db.execute("PRAGMA auto_vacuum") as cursor:
+            (mode,) = await cursor.fetchone()
+    if mode != 2:
+        # Для базы, созданной без auto_vacuum, нужен однократный полный VACUUM
+        return 0
+
+    released = 0
+    while True:
+        async with connect() as db:
+            async with db.execute("PRAGMA freelist_count") as cursor:
+                (free,) = await cursor.fetchone()
+            if not free:
+                break
+            # Прагма освобождает по странице на шаг, шаги выполняются
+            # только при чтении результата
+            async with db.execute(f"PRAGMA incremental_vacuum({min(free, pages)})") as cursor:
+                await cursor.fetchall()
+            await db.commit()
+            async with db.execute("PRAGMA freelist_count") as cursor:
+                (left,) = await cursor.fetchone()
+        if left >= free:
+            break
+        released += free - left
+        await asyncio.sleep(pause)
+    return released
+
+
+async def run_maintenance(connect, name: str):
+    """Полный цикл обслуживания одного шарда"""
+    placeholders, rolled_up = await compact_history(connect)
+    released = await incremental_vacuum(connect)
+    print(f"🧹 {name}: удалено брошенных квизов {placeholders}, "
+          f"свернуто в помесячные итоги {rolled_up}, освобождено страниц {released}")
+
+
+async def _run(db_name: str, shards: int):
+    from database import ConnectionPool, shard_paths
+    for path in shard_paths(db_name, shards):
+        if not os.path.exists(path):
+            print(f"База данных {path} не найдена.")
+            continue
+        pool = ConnectionPool(path, 1)
+        try:
+            await run_maintenance(pool.acquire, path)
+        finally:
+            await pool.close()
+
+
+def _enable_vacuum(db_name: str, shards: int):
+    import sqlite3
+    from database import shard_paths
+    for path in shard_paths(db_name, shards):
+        if not os.path.exists(path):
+            print(f"База данных {path} не найдена.")
+            continue
+        conn = sqlite3.connect(path, isolation_level=None)
+        try:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            print(f" {path}: инкрементальный VACUUM включен")
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Обслуживание истории квизов Python Quiz Bot")
+    parser.add_argument('--db', default=DB_NAME, help="имя базы данных (по умолчанию из config.py)")
+    parser.add_argument('--shards', type=int, default=DB_SHARDS, help="число шардов (по умолчанию из config.py)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('run', help="выполнить обслуживание сейчас")
+    commands.add_parser('enable-vacuum', help="включить инкрементальный VACUUM (полный VACUUM базы)")
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        asyncio.run(_run(args.db, args.shards))
+    elif args.command == 'enable-vacuum':
+        _enable_vacuum(args.db, args.shards)
@@ -0,0 +1,78 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class DelayedScheduler:
+    """Отложенный запуск корутин.
+
+    Задания хранятся в куче по времени запуска, и одна фоновая задача
+    спит до ближайшего из них. Обработчику не нужно ждать задержку
+    самому: он ставит задание в очередь и сразу завершается. Каждое
+    задание выполняется в отдельной задаче, поэтому медленная отправка
+    не задерживает остальные. При остановке оставшиеся задания
+    выполняются сразу, чтобы пользователи не остались без вопроса.
+    """
+
+    def __init__(self):
+        self._heap = []  # (время запуска, номер, функция, аргументы)
+        self._counter = itertools.count()
+        self._running = set()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    async def start(self):
+        """Запустить фоновую задачу планировщика"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        """Остановить планировщик, выполнив оставшиеся задания"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._heap:
+            _, _, func, args = heapq.heappop(self._heap)
+            self._run(func, args)
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    def schedule(self, delay: float, func, *args):
+        """Вызвать await func(*args) через delay секунд"""
+        job = (time.monotonic() + delay, next(self._counter), func, args)
+        heapq.heappush(self._heap, job)
+        if self._heap[0] is job:
+            self._wakeup.set()
+
+    async def _loop(self):
+        while True:
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, func, args = heapq.heappop(self._heap)
+                self._run(func, args)
+            timeout = self._heap[0][0] - now if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _run(self, func, args):
+        task = asyncio.create_task(self._call(func, args))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    @staticmethod
+    async def _call(func, args):
+        try:
+            await func(*args)
+        except Exception as e:
+            print(f"⚠️ Ошибка в отложенном задании {getattr(func, '__name__', func)}: {e}")
@@ -0,0 +1,191 @@
+import asyncio
+import time
+from collections import OrderedDict
+from config import SESSION_CACHE_SIZE, SESSION_CACHE_TTL, SESSION_FLUSH_INTERVAL
+
+
+class SessionCache:
+    """Кэш состояний квиза перед Database с отложенной записью.
+
+    Состояние читается из базы один раз и дальше отдается из памяти.
+    Изменения update_quiz_state помечают сессию "грязной" и пачкой
+    сохраняются фоновой задачей раз в flush_interval секунд. Перед
+    завершением квиза и при остановке бота изменения сбрасываются сразу.
+    Вытесняются (LRU и по времени простоя) только уже сохраненные сессии.
+    """
+
+    def __init__(self, db, max_size: int = SESSION_CACHE_SIZE,
+                 idle_ttl: float = SESSION_CACHE_TTL,
+                 flush_interval: float = SESSION_FLUSH_INTERVAL):
+        self.db = db
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.flush_interval = flush_interval
+        self._sessions = OrderedDict()  # user_id -> состояние, от давних к свежим
+        self._last_access = {}
+        self._dirty = set()
+        self._saving = {}  # user_id -> число незавершенных записей в базу
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self._stopping = asyncio.Event()
+
+    async def start(self):
+        """Запустить фоновую запись изменений"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Остановить фоновую запись и сохранить все изменения"""
+        if self._flush_task is not None:
+            # Задачу не отменяем, а дожидаемся: отмена посреди записи
+            # потеряла бы уже снятые с очереди изменения
+            self._stopping.set()
+            await self._flush_task
+            self._flush_task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ Ошибка при сохранении сессий квиза: {e}")
+            self._evict()
+
+    def _touch(self, user_id: int, state: dict):
+        self._sessions[user_id] = state
+        self._sessions.move_to_end(user_id)
+        self._last_access[user_id] = time.monotonic()
+
+    def _forget(self, user_id: int):
+        self._sessions.pop(user_id, None)
+        self._last_access.pop(user_id, None)
+        self._dirty.discard(user_id)
+
+    def _evict(self):
+        """Вытеснить простаивающие и лишние сохраненные сессии"""
+        now = time.monotonic()
+        overflow = len(self._sessions) - self.max_size
+        victims = []
+        for user_id in self._sessions:
+            expired = now - self._last_access[user_id] > self.idle_ttl
+            if not expired and overflow <= 0:
+                break
+            if user_id in self._dirty or user_id in self._saving:
+                continue
+            victims.append(user_id)
+            overflow -= 1
+        for user_id in victims:
+            self._forget(user_id)
+
+    async def get_quiz_state(self, user_id: int):
+        """Получить состояние квиза (из кэша или из базы)"""
+        state = self._sessions.get(user_id)
+        if state is None:
+            state = await self.db.get_quiz_state(user_id)
+            if state is None:
+                return None
+            # Пока шел запрос, сессию могли создать заново
+            state = self._sessions.get(user_id, state)
+            self._touch(user_id, state)
+            self._evict()
+        else:
+            self._touch(user_id, state)
+        return dict(state)
+
+    async def init_user_quiz(self, user_id: int, question_sequence: list,
+                             username: str = "", first_name: str = "", last_name: str = ""):
+        """Начать новый квиз; состояние сразу записывается в базу"""
+        self._forget(user_id)
+        history_id = await self.db.init_user_quiz(
+            user_id, question_sequence, username, first_name, last_name
+        )
+        self._forget(user_id)
+        self._touch(user_id, {
+            'question_index': 0,
+            'score': 0,
+            'completed': 0,
+            'used_questions': [],
+            'current_questions': list(question_sequence),
+            'history_id': history_id,
+            'version': 0
+        })
+        self._evict()
+
+    async def update_quiz_state(self, user_id: int, question_index: int, score: int = None,
+                                expected_version: int = None) -> bool:
+        """Обновить состояние квиза в кэше; в базу оно попадет при сбросе.
+        
+        Сравнение версии и обновление идут без переключений цикла событий,
+        поэтому из двух одновременных ответов применится только один.
+        """
+        state = self._sessions.get(user_id)
+        if state is None:
+            return await self.db.update_quiz_state(user_id, question_index, score, expected_version)
+        if expected_version is not None and state['version'] != expected_version:
+            return False
+        state['question_index'] = question_index
+        if score is not None:
+            state['score'] = score
+        state['version'] += 1
+        self._dirty.add(user_id)
+        self._touch(user_id, state)
+        return True
+
+    async def complete_quiz(self, user_id: int, score: int, total_questions: int):
+        """Сохранить состояние и завершить квиз"""
+        await self.flush_user(user_id)
+        result = await self.db.complete_quiz(user_id, score, total_questions)
+        state = self._sessions.get(user_id)
+        if state is not None:
+            state['completed'] = 1
+        return result
+
+    async def clear_quiz_state(self, user_id: int):
+        """Удалить состояние квиза из кэша и базы"""
+        self._forget(user_id)
+        await self.db.clear_quiz_state(user_id)
+
+    def _pop_dirty(self, user_ids):
+        rows = []
+        for user_id in user_ids:
+            self._dirty.discard(user_id)
+            state = self._sessions[user_id]
+            rows.append((user_id, state['history_id'], state['question_index'], state['score'], state['version']))
+        return rows
+
+    async def _save(self, rows):
+        # Пока запись не завершена, сессию нельзя вытеснять: иначе ее
+        # перечитают из базы в устаревшем виде
+        for user_id, *_ in rows:
+            self._saving[user_id] = self._saving.get(user_id, 0) + 1
+        try:
+            await self.db.save_quiz_states(rows)
+        except BaseException:
+            # Возвращаем несохраненные сессии в очередь на запись (в том
+            # числе при отмене вызывающей задачи)
+            for user_id, history_id, *_ in rows:
+                state = self._sessions.get(user_id)
+                if state is not None and state['history_id'] == history_id:
+                    self._dirty.add(user_id)
+            raise
+        finally:
+            for user_id, *_ in rows:
+                self._saving[user_id] -= 1
+                if not self._saving[user_id]:
+                    del self._saving[user_id]
+
+    async def flush_user(self, user_id: int):
+        """Немедленно сохранить состояние одного пользователя"""
+        if user_id in self._dirty:
+            await self._save(self._pop_dirty([user_id]))
+
+    async def flush(self):
+        """Сохранить все измененные сессии одной транзакцией"""
+        async with self._flush_lock:
+            if self._dirty:
+                await self._save(self._pop_dirty(list(self._dirty)))
@@ -0,0 +1,91 @@
+from abc import ABC, abstractmethod
+from config import STORAGE_BACKEND
+
+
+class Storage(ABC):
+    """Интерфейс хранилища бота.
+
+    Покрывает сессии квиза, статистику пользователей, историю квизов и
+    рейтинг. Реализации: Database (SQLite), MemoryStorage (в памяти,
+    для тестов и бенчмарков) и RedisStorage (протокол Redis).
+    """
+
+    @abstractmethod
+    async def create_tables(self):
+        """Подготовить хранилище к работе"""
+
+    @abstractmethod
+    async def close(self):
+        """Освободить ресурсы хранилища"""
+
+    # Сессии квиза
+
+    @abstractmethod
+    async def get_quiz_state(self, user_id: int):
+        """Получить состояние квиза для пользователя"""
+
+    @abstractmethod
+    async def init_user_quiz(self, user_id: int, question_sequence: list,
+                             username: str = "", first_name: str = "", last_name: str = ""):
+        """Инициализировать новый квиз для пользователя, вернуть id записи истории"""
+
+    @abstractmethod
+    async def update_quiz_state(self, user_id: int, question_index: int, score: int = None,
+                                expected_version: int = None) -> bool:
+        """Обновить состояние квиза; с expected_version - только если версия
+        не изменилась с момента чтения. Возвращает, применено ли обновление"""
+
+    @abstractmethod
+    async def save_quiz_states(self, states: list):
+        """Сохранить пачку состояний (user_id, history_id, question_index, score, version)"""
+
+    @abstractmethod
+    async def complete_quiz(self, user_id: int, score: int, total_questions: int):
+        """Завершить квиз, вернуть обновленную статистику или None"""
+
+    @abstractmethod
+    async def clear_quiz_state(self, user_id: int):
+        """Очистить состояние квиза"""
+
+    # Журнал ответов
+
+    @abstractmethod
+    async def save_answers(self, answers: list):
+        """Добавить пачку ответов в журнал: кортежи (user_id, history_id,
+        question_id, chosen_option, is_correct, response_ms, answered_at)"""
+
+    @abstractmethod
+    async def get_question_stats(self, limit: int = 5, hardest: bool = True):
+        """Получить самые сложные (или самые простые) вопросы по счетчикам ответов"""
+
+    # Статистика, история и рейтинг
+
+    @abstractmethod
+    async def get_user_stats(self, user_id: int):
+        """Получить статистику пользователя"""
+
+    @abstractmethod
+    async def get_last_quiz_result(self, user_id: int):
+        """Получить результат последнего квиза"""
+
+    @abstractmethod
+    async def get_top_players(self, limit: int = 10, period: str = None):
+        """Получить топ игроков за все время или за текущий период ('day' или 'week')"""
+
+    @abstractmethod
+    async def get_user_rank(self, user_id: int):
+        """Получить место игрока в рейтинге: (место, всего игроков) или None"""
+
+
+def create_storage(backend: str = STORAGE_BACKEND) -> Storage:
+    """Создать хранилище по имени: sqlite, memory или redis"""
+    if backend == 'sqlite':
+        from database import Database
+        return Database()
+    if backend == 'memory':
+        from memory_storage import MemoryStorage
+        return MemoryStorage()
+    if backend == 'redis':
+        from redis_storage import RedisStorage
+        return RedisStorage()
+    raise ValueError(f"Неизвестный тип хранилища: {backend}")
@@ -0,0 +1,64 @@
+import asyncio
+import os
+import socket
+import sys
+import threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BACKENDS = ['memory', 'sqlite', 'sqlite-queries', 'redis']
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope='session')
+def redis_url():
+    """Адрес локального поддельного сервера Redis (fakeredis)"""
+    fakeredis = pytest.importorskip('fakeredis')
+    port = _free_port()
+    server = fakeredis.TcpFakeServer(('127.0.0.1', port), server_type='redis')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'redis://127.0.0.1:{port}/0'
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=BACKENDS)
+def run_storage(request, tmp_path):
+    """Выполнить сценарий async (storage) на свежем хранилище выбранного типа"""
+    backend = request.param
+
+    async def make():
+        if backend == 'memory':
+            from memory_storage import MemoryStorage
+            return MemoryStorage()
+        if backend.startswith('sqlite'):
+            from database import Database
+            return Database(str(tmp_path / 'quiz.db'), shards=2,
+                            leaderboard_in_memory=backend == 'sqlite',
+                            background_jobs=False)
+        from redis_storage import RedisStorage
+        storage = RedisStorage(request.getfixturevalue('redis_url'))
+        await storage.redis.connect()
+        await storage.redis.execute('FLUSHALL')
+        await storage.redis.close()
+        return storage
+
+    def run(scenario):
+        async def main():
+            storage = await make()
+            await storage.create_tables()
+            try:
+                return await scenario(storage)
+            finally:
+                await storage.close()
+        return asyncio.run(main())
+
+    run.backend = backend
+    return run
@@ -0,0 +1,51 @@
+"""Буферизованный журнал ответов (answer_log.py)"""
+
+import asyncio
+from answer_log import AnswerLog
+
+
+class SlowStorage:
+    """Хранилище, запись в которое идет заметное время"""
+
+    def __init__(self):
+        self.saved = []
+        self.writing = asyncio.Event()
+
+    async def save_answers(self, rows):
+        self.writing.set()
+        await asyncio.sleep(0.05)
+        self.saved.extend(rows)
+
+
+def test_close_during_flush_keeps_answers():
+    async def scenario():
+        db = SlowStorage()
+        log = AnswerLog(db, flush_interval=0.01, max_batch=2)
+        await log.start()
+        log.question_sent(1)
+        for question_id in range(3):
+            log.record(1, 10, question_id, 0, True)
+        await db.writing.wait()
+        await log.close()
+        return db.saved
+
+    saved = asyncio.run(scenario())
+    assert [row[2] for row in saved] == [0, 1, 2]
+    assert saved[0][5] is not None and saved[1][5] is None
+
+
+def test_cancelled_flush_returns_rows_to_buffer():
+    async def scenario():
+        db = SlowStorage()
+        log = AnswerLog(db)
+        log.record(1, 10, 5, 2, False)
+        task = asyncio.create_task(log.flush())
+        await db.writing.wait()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert db.saved == []
+        await log.flush()
+        return db.saved
+
+    saved = asyncio.run(scenario())
+    assert [(row[2], row[3], row[4]) for row in saved] == [(5, 2, 0)]
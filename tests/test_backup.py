@@ -0,0 +1,76 @@
+"""Резервные копии и восстановление (backup.py)"""
+
+import asyncio
+import os
+import shutil
+from backup import BackupJob, _backup_path, list_backups, restore
+from database import Database
+
+
+def _make_database(path: str, shards: int):
+    async def main():
+        db = Database(path, shards=shards, background_jobs=False)
+        await db.create_tables()
+        try:
+            for user_id in range(1, 5):
+                await db.init_user_quiz(user_id, [0, 1], f'user{user_id}', 'Имя', '')
+                await db.complete_quiz(user_id, user_id, 10)
+        finally:
+            await db.close()
+        return db.shard_paths
+    return asyncio.run(main())
+
+
+def _best_scores(path: str, shards: int) -> dict:
+    async def main():
+        db = Database(path, shards=shards, background_jobs=False)
+        await db.create_tables()
+        try:
+            return {user_id: (await db.get_user_stats(user_id) or {}).get('best_score')
+                    for user_id in range(1, 5)}
+        finally:
+            await db.close()
+    return asyncio.run(main())
+
+
+def test_backup_and_restore(tmp_path):
+    path = str(tmp_path / 'quiz.db')
+    directory = str(tmp_path / 'backups')
+    paths = _make_database(path, shards=2)
+
+    stamp = asyncio.run(BackupJob(paths, directory, pages=1, pause=0).create())
+    assert list_backups(paths, directory) == [stamp]
+    assert not [name for name in os.listdir(directory) if name.endswith('.partial')]
+
+    for shard in paths:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(shard + suffix):
+                os.remove(shard + suffix)
+    assert _best_scores(path, 2) == {1: None, 2: None, 3: None, 4: None}
+
+    restore(paths, stamp, directory)
+    assert _best_scores(path, 2) == {1: 1, 2: 2, 3: 3, 4: 4}
+
+
+def test_old_backups_are_rotated(tmp_path):
+    path = str(tmp_path / 'quiz.db')
+    directory = str(tmp_path / 'backups')
+    paths = _make_database(path, shards=2)
+    job = BackupJob(paths, directory, keep=2, pages=100, pause=0)
+    stamp = asyncio.run(job.create())
+    # Копии, снятые раньше, и неполная копия (нет файла второго шарда)
+    for old in ('20200101-000000', '20200102-000000'):
+        for shard in paths:
+            shutil.copyfile(_backup_path(directory, shard, stamp), _backup_path(directory, shard, old))
+    shutil.copyfile(_backup_path(directory, paths[0], stamp), _backup_path(directory, paths[0], '20200103-000000'))
+    assert list_backups(paths, directory) == [stamp, '20200102-000000', '20200101-000000']
+
+    job._rotate()
+    assert list_backups(paths, directory) == [stamp, '20200102-000000']
+
+
+def test_restore_unknown_stamp_keeps_files(tmp_path):
+    path = str(tmp_path / 'quiz.db')
+    paths = _make_database(path, shards=1)
+    restore(paths, '20200101-000000', str(tmp_path / 'backups'))
+    assert os.path.exists(paths[0]) and not os.path.exists(paths[0] + '.bak')
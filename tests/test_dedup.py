@@ -0,0 +1,48 @@
+"""Отбрасывание повторных нажатий (dedup.py)"""
+
+import asyncio
+from dedup import CallbackDedup
+
+
+def test_repeated_callback_is_seen():
+    dedup = CallbackDedup(path='', capacity=10)
+    assert not dedup.seen('cb1', '7:1:3')
+    # Повторная доставка того же обновления и двойное нажатие той же кнопки
+    assert dedup.seen('cb1', '7:1:3')
+    assert dedup.seen('cb2', '7:1:3')
+    assert not dedup.seen('cb3', '7:1:4')
+
+
+def test_forget_allows_retry():
+    dedup = CallbackDedup(path='', capacity=10)
+    dedup.seen('cb1', '7:1:3')
+    dedup.forget('cb1', '7:1:3')
+    assert not dedup.seen('cb2', '7:1:3')
+
+
+def test_oldest_keys_are_evicted():
+    dedup = CallbackDedup(path='', capacity=3)
+    for key in ('a', 'b', 'c', 'd'):
+        dedup.seen(key)
+    assert not dedup.seen('a')
+    assert dedup.seen('d')
+
+
+def test_keys_survive_restart(tmp_path):
+    path = str(tmp_path / 'callbacks.dedup')
+
+    async def scenario():
+        first = CallbackDedup(path=path, capacity=3, save_interval=60)
+        await first.start()
+        for key in ('a', 'b', 'c', 'd'):
+            first.seen(key)
+        await first.close()
+
+        second = CallbackDedup(path=path, capacity=2, save_interval=60)
+        await second.start()
+        try:
+            return [second.seen(key) for key in ('c', 'd', 'b')]
+        finally:
+            await second.close()
+
+    assert asyncio.run(scenario()) == [True, True, False]
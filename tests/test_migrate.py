@@ -0,0 +1,77 @@
+"""Пересчет статистики по журналу ответов (migrate.py rebuild-stats)"""
+
+import asyncio
+from database import ConnectionPool, Database
+from migrate import rebuild_stats
+from retention import compact_history
+
+
+async def _quiz(db, user_id: int, answered: int, correct: int, total: int = 10):
+    """Начать квиз из total вопросов и записать answered ответов"""
+    history_id = await db.init_user_quiz(user_id, list(range(total)), f'user{user_id}', 'Имя', '')
+    await db.save_answers([
+        (user_id, history_id, question_id, 0, int(question_id < correct), 500, '2026-01-01 10:00:00')
+        for question_id in range(answered)
+    ])
+    return history_id
+
+
+def _rebuild(tmp_path, scenario):
+    path = str(tmp_path / 'quiz.db')
+
+    async def main():
+        db = Database(path, background_jobs=False)
+        await db.create_tables()
+        try:
+            await scenario(db)
+        finally:
+            await db.close()
+        pool = ConnectionPool(path, 1)
+        try:
+            async with pool.acquire() as conn:
+                await conn.execute("UPDATE user_stats SET total_quizzes = 0, total_questions = 0")
+                await conn.commit()
+            await compact_history(pool.acquire, pause=0)
+        finally:
+            await pool.close()
+        await rebuild_stats(path, 1, dry_run=False)
+        db = Database(path, background_jobs=False)
+        try:
+            return await db.get_user_stats(1)
+        finally:
+            await db.close()
+
+    return asyncio.run(main())
+
+
+def test_abandoned_quiz_is_not_counted(tmp_path):
+    async def scenario(db):
+        await _quiz(db, 1, 10, 7)
+        await db.complete_quiz(1, 7, 10)
+        abandoned = await _quiz(db, 1, 2, 2)
+        await db.clear_quiz_state(1)
+        # Заглушка старше HISTORY_PLACEHOLDER_HOURS удаляется обслуживанием
+        async with db.pools[0].acquire() as conn:
+            await conn.execute("UPDATE quiz_history SET quiz_date = datetime('now', '-2 days') WHERE id = ?",
+                               (abandoned,))
+            await conn.commit()
+
+    stats = _rebuild(tmp_path, scenario)
+    assert (stats['total_quizzes'], stats['total_correct'], stats['total_questions'], stats['best_score']) == \
+        (1, 7, 10, 7)
+
+
+def test_rolled_up_quizzes_are_counted(tmp_path):
+    async def scenario(db):
+        old = await _quiz(db, 1, 10, 6)
+        await db.complete_quiz(1, 6, 10)
+        await _quiz(db, 1, 10, 9)
+        await db.complete_quiz(1, 9, 10)
+        # Запись старше HISTORY_RETENTION_DAYS сворачивается в помесячные итоги
+        async with db.pools[0].acquire() as conn:
+            await conn.execute("UPDATE quiz_history SET quiz_date = '2020-01-10 12:00:00' WHERE id = ?", (old,))
+            await conn.commit()
+
+    stats = _rebuild(tmp_path, scenario)
+    assert (stats['total_quizzes'], stats['total_correct'], stats['total_questions'], stats['best_score']) == \
+        (2, 15, 20, 9)
@@ -0,0 +1,111 @@
+"""Ограничение частоты исходящих запросов (rate_limiter.py)"""
+
+import asyncio
+import time
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, SendMessage
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from rate_limiter import OutboundLimiter, TokenBucket
+
+
+def _question(chat_id: int) -> SendMessage:
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text='1', callback_data='answer_0_1')]])
+    return SendMessage(chat_id=chat_id, text='Вопрос', reply_markup=keyboard)
+
+
+def _info(chat_id: int) -> SendMessage:
+    return SendMessage(chat_id=chat_id, text='Итоги')
+
+
+def test_bucket_allows_burst_then_rate():
+    bucket = TokenBucket(rate=10, burst=3)
+    waits = [bucket.reserve() for _ in range(5)]
+    assert waits[:3] == [0, 0, 0]
+    assert 0.05 < waits[3] <= 0.1 and 0.15 < waits[4] <= 0.2
+
+
+def test_bucket_pause():
+    bucket = TokenBucket(rate=100, burst=5)
+    bucket.pause(0.5)
+    assert 0.45 < bucket.reserve() <= 0.5
+
+
+def test_priority():
+    assert OutboundLimiter.priority(_question(1)) == OutboundLimiter.QUESTION
+    assert OutboundLimiter.priority(_info(1)) == OutboundLimiter.INFO
+
+
+def test_chat_rate_is_limited():
+    async def scenario():
+        limiter = OutboundLimiter(global_rate=1000, chat_rate=10, chat_burst=2)
+        await limiter.start()
+        sent = []
+        started = time.monotonic()
+
+        async def make_request(bot, method):
+            sent.append((method.chat_id, time.monotonic() - started))
+
+        await asyncio.gather(*(limiter(make_request, None, _info(1)) for _ in range(4)),
+                             limiter(make_request, None, _info(2)))
+        await limiter.close()
+        return sent
+
+    sent = asyncio.run(scenario())
+    first_chat = [at for chat_id, at in sent if chat_id == 1]
+    (second_chat,) = [at for chat_id, at in sent if chat_id == 2]
+    assert first_chat[-1] >= 0.15
+    assert second_chat < 0.05
+
+
+def test_questions_go_first():
+    async def scenario():
+        limiter = OutboundLimiter(global_rate=20, chat_rate=1000, chat_burst=1000)
+        await limiter.start()
+        sent = []
+
+        async def make_request(bot, method):
+            sent.append(method.text)
+
+        # Общий запас токенов исчерпан, дальше запросы ждут в очереди
+        await asyncio.gather(*(limiter(make_request, None, _info(chat_id)) for chat_id in range(20)))
+        await asyncio.gather(*(limiter(make_request, None, _info(chat_id)) for chat_id in range(100, 103)),
+                             limiter(make_request, None, _question(200)))
+        await limiter.close()
+        return sent[20:]
+
+    assert asyncio.run(scenario())[0] == 'Вопрос'
+
+
+def test_retry_after_is_retried():
+    async def scenario():
+        limiter = OutboundLimiter(global_rate=1000, chat_rate=1000, chat_burst=1000, max_retries=1)
+        attempts = []
+
+        async def make_request(bot, method):
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise TelegramRetryAfter(method=method, message='Too Many Requests', retry_after=1)
+            return 'ok'
+
+        result = await limiter(make_request, None, _info(1))
+        return result, attempts
+
+    result, attempts = asyncio.run(scenario())
+    assert result == 'ok'
+    assert attempts[1] - attempts[0] >= 0.95
+
+
+def test_requests_without_chat_are_not_limited():
+    async def scenario():
+        limiter = OutboundLimiter(global_rate=1, chat_rate=1, chat_burst=1)
+        started = time.monotonic()
+
+        async def make_request(bot, method):
+            return method.callback_query_id
+
+        results = [await limiter(make_request, None, AnswerCallbackQuery(callback_query_id=str(i)))
+                   for i in range(5)]
+        return results, time.monotonic() - started
+
+    results, elapsed = asyncio.run(scenario())
+    assert results == ['0', '1', '2', '3', '4'] and elapsed < 0.5
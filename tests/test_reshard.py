@@ -0,0 +1,75 @@
+"""Перераспределение базы по шардам (reshard.py)"""
+
+import asyncio
+import os
+import sqlite3
+from database import Database, shard_index
+from reshard import reshard
+
+USERS = range(1, 7)
+
+
+def _fill(path: str, shards: int):
+    async def main():
+        db = Database(path, shards=shards, background_jobs=False)
+        await db.create_tables()
+        try:
+            for user_id in USERS:
+                history_id = await db.init_user_quiz(user_id, [0, 1], f'user{user_id}', 'Имя', '')
+                await db.save_answers([(user_id, history_id, 0, 1, 1, 300, '2026-01-01 10:00:00')])
+                await db.complete_quiz(user_id, user_id, 10)
+                # Незавершенный квиз: состояние ссылается на запись истории
+                await db.init_user_quiz(user_id, [1, 0], f'user{user_id}', 'Имя', '')
+                await db.update_quiz_state(user_id, 1, 1)
+        finally:
+            await db.close()
+    asyncio.run(main())
+
+
+def _read(path: str, shards: int):
+    async def main():
+        db = Database(path, shards=shards, background_jobs=False)
+        await db.create_tables()
+        try:
+            return {
+                user_id: (
+                    (await db.get_user_stats(user_id))['best_score'],
+                    (await db.get_quiz_state(user_id))['question_index'],
+                    [player['user_id'] for player in await db.get_top_players(3)],
+                    await db.get_question_stats(1),
+                )
+                for user_id in USERS
+            }
+        finally:
+            await db.close()
+    return asyncio.run(main())
+
+
+def test_reshard_keeps_data(tmp_path):
+    path = str(tmp_path / 'quiz.db')
+    _fill(path, 1)
+    before = _read(path, 1)
+
+    reshard(path, 1, 3)
+
+    assert os.path.exists(path + '.bak')
+    assert _read(path, 3) == before
+    for index in range(3):
+        shard = str(tmp_path / f'quiz.shard{index}.db')
+        conn = sqlite3.connect(shard)
+        try:
+            users = {row[0] for row in conn.execute('SELECT user_id FROM user_stats')}
+            assert users and all(shard_index(user_id, 3) == index for user_id in users)
+            # Состояние и ответы ссылаются на записи истории своего шарда
+            dangling = conn.execute('''
+                SELECT COUNT(*) FROM quiz_state s
+                LEFT JOIN quiz_history h ON h.id = s.history_id WHERE h.id IS NULL
+            ''').fetchone()[0]
+            dangling += conn.execute('''
+                SELECT COUNT(*) FROM answers a
+                LEFT JOIN quiz_history h ON h.id = a.history_id WHERE h.id IS NULL
+            ''').fetchone()[0]
+            assert dangling == 0
+            assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+        finally:
+            conn.close()
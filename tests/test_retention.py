@@ -0,0 +1,65 @@
+"""Свертка и очистка истории квизов (retention.py)"""
+
+import asyncio
+from database import ConnectionPool, Database
+from retention import compact_history
+
+
+def _run(path, scenario):
+    async def main():
+        db = Database(path, background_jobs=False)
+        await db.create_tables()
+        await db.close()
+        pool = ConnectionPool(path, 1)
+        try:
+            return await scenario(pool.acquire)
+        finally:
+            await pool.close()
+    return asyncio.run(main())
+
+
+async def _monthly(connect):
+    async with connect() as db:
+        async with db.execute(
+            "SELECT user_id, month, quizzes, correct, questions, best_score FROM quiz_history_monthly"
+        ) as cursor:
+            return await cursor.fetchall()
+
+
+async def _history(connect):
+    async with connect() as db:
+        async with db.execute("SELECT score, completed FROM quiz_history ORDER BY id") as cursor:
+            return await cursor.fetchall()
+
+
+def test_rollup_keeps_completed_quizzes(tmp_path):
+    async def scenario(connect):
+        async with connect() as db:
+            await db.execute("INSERT INTO user_stats (user_id, username) VALUES (1, 'user1')")
+            await db.executemany(
+                "INSERT INTO quiz_history (user_id, score, total_questions, quiz_date, completed) "
+                "VALUES (1, ?, 10, ?, ?)",
+                [
+                    (7, '2020-01-10 12:00:00', 1),     # завершенный квиз
+                    (5, '2020-01-11 12:00:00', None),  # завершен до появления completed
+                    (0, '2020-01-12 12:00:00', None),  # старая заглушка
+                    (3, '2020-01-13 12:00:00', 0),     # брошен после трех ответов
+                    (9, '2020-02-01 12:00:00', 1),
+                ]
+            )
+            await db.execute(
+                "INSERT INTO quiz_history (user_id, score, total_questions, completed) VALUES (1, 8, 10, 1)"
+            )
+            # Итоги месяца, уже свернутые раньше
+            await db.execute("INSERT INTO quiz_history_monthly VALUES (1, '2020-01', 1, 4, 10, 4)")
+            await db.commit()
+        before = await _monthly(connect)
+        totals = await compact_history(connect, retention_days=365, placeholder_hours=24,
+                                       batch_size=2, pause=0)
+        return before, totals, await _monthly(connect), await _history(connect)
+
+    before, totals, after, history = _run(str(tmp_path / 'quiz.db'), scenario)
+    assert before == [(1, '2020-01', 1, 4, 10, 4)]
+    assert totals == (2, 3)
+    assert sorted(after) == [(1, '2020-01', 3, 16, 30, 7), (1, '2020-02', 1, 9, 10, 9)]
+    assert history == [(8, 1)]
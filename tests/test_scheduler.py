@@ -0,0 +1,68 @@
+"""Отложенный запуск заданий (scheduler.py)"""
+
+import asyncio
+import time
+from scheduler import DelayedScheduler
+
+
+def test_jobs_run_in_time_order():
+    async def scenario():
+        scheduler = DelayedScheduler()
+        await scheduler.start()
+        started = time.monotonic()
+        done = []
+
+        async def job(name):
+            done.append((name, time.monotonic() - started))
+
+        scheduler.schedule(0.15, job, 'late')
+        scheduler.schedule(0.05, job, 'early')
+        scheduler.schedule(0, job, 'now')
+        await asyncio.sleep(0.3)
+        await scheduler.close()
+        return done
+
+    done = asyncio.run(scenario())
+    assert [name for name, _ in done] == ['now', 'early', 'late']
+    assert done[1][1] >= 0.05 and done[2][1] >= 0.15
+
+
+def test_failing_job_does_not_stop_others():
+    async def scenario():
+        scheduler = DelayedScheduler()
+        await scheduler.start()
+        done = []
+
+        async def fail():
+            raise RuntimeError('send failed')
+
+        async def job():
+            done.append(True)
+
+        scheduler.schedule(0, fail)
+        scheduler.schedule(0.01, job)
+        await asyncio.sleep(0.1)
+        await scheduler.close()
+        return done
+
+    assert asyncio.run(scenario()) == [True]
+
+
+def test_close_runs_pending_jobs():
+    async def scenario():
+        scheduler = DelayedScheduler()
+        await scheduler.start()
+        done = []
+
+        async def job(name):
+            done.append(name)
+
+        scheduler.schedule(60, job, 'second')
+        scheduler.schedule(30, job, 'first')
+        started = time.monotonic()
+        await scheduler.close()
+        return done, time.monotonic() - started, len(scheduler)
+
+    done, elapsed, pending = asyncio.run(scenario())
+    assert sorted(done) == ['first', 'second'] and pending == 0
+    assert elapsed < 1
@@ -0,0 +1,53 @@
+"""Отложенная запись состояний квиза (session_cache.py)"""
+
+import asyncio
+from memory_storage import MemoryStorage
+from session_cache import SessionCache
+
+
+class SlowStorage(MemoryStorage):
+    """Хранилище, запись в которое идет заметное время"""
+
+    def __init__(self):
+        super().__init__()
+        self.saved = []
+        self.writing = asyncio.Event()
+
+    async def save_quiz_states(self, states):
+        self.writing.set()
+        await asyncio.sleep(0.05)
+        await super().save_quiz_states(states)
+        self.saved.extend(states)
+
+
+def test_close_during_flush_keeps_changes():
+    async def scenario():
+        db = SlowStorage()
+        cache = SessionCache(db, flush_interval=0.01)
+        await cache.init_user_quiz(1, [0, 1, 2])
+        await cache.start()
+        assert await cache.update_quiz_state(1, 1, 1, expected_version=0)
+        await db.writing.wait()
+        await cache.close()
+        return db.saved, await db.get_quiz_state(1)
+
+    saved, state = asyncio.run(scenario())
+    assert [row[0] for row in saved] == [1]
+    assert (state['question_index'], state['score'], state['version']) == (1, 1, 1)
+
+
+def test_cancelled_save_stays_dirty():
+    async def scenario():
+        db = SlowStorage()
+        cache = SessionCache(db)
+        await cache.init_user_quiz(1, [0, 1, 2])
+        assert await cache.update_quiz_state(1, 2, 2)
+        task = asyncio.create_task(cache.flush())
+        await db.writing.wait()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await cache.flush()
+        return await db.get_quiz_state(1)
+
+    state = asyncio.run(scenario())
+    assert (state['question_index'], state['version']) == (2, 1)
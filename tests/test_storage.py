@@ -0,0 +1,209 @@
+"""Контракт Storage: одинаковое поведение хранилищ memory, sqlite и redis"""
+
+import asyncio
+
+
+async def _play(storage, user_id: int, score: int, total: int = 10):
+    """Пройти квиз из total вопросов, ответив верно на score"""
+    await storage.init_user_quiz(user_id, list(range(total)), f'user{user_id}', 'Имя', 'Фамилия')
+    for index in range(total):
+        state = await storage.get_quiz_state(user_id)
+        assert await storage.update_quiz_state(
+            user_id, index + 1, state['score'] + (1 if index < score else 0),
+            expected_version=state['version']
+        )
+    return await storage.complete_quiz(user_id, score, total)
+
+
+def test_new_quiz_state(run_storage):
+    async def scenario(storage):
+        history_id = await storage.init_user_quiz(1, [4, 2, 7], 'user1', 'Имя', '')
+        return history_id, await storage.get_quiz_state(1)
+
+    history_id, state = run_storage(scenario)
+    assert state['history_id'] == history_id
+    assert state['current_questions'] == [4, 2, 7]
+    assert (state['question_index'], state['score'], state['completed'], state['version']) == (0, 0, 0, 0)
+
+
+def test_stale_version_is_rejected(run_storage):
+    async def scenario(storage):
+        await storage.init_user_quiz(1, [0, 1, 2])
+        first = await storage.update_quiz_state(1, 1, 1, expected_version=0)
+        second = await storage.update_quiz_state(1, 1, 0, expected_version=0)
+        return first, second, await storage.get_quiz_state(1)
+
+    first, second, state = run_storage(scenario)
+    assert (first, second) == (True, False)
+    assert (state['question_index'], state['score'], state['version']) == (1, 1, 1)
+
+
+def test_update_without_version_bumps_version(run_storage):
+    async def scenario(storage):
+        await storage.init_user_quiz(1, [0, 1, 2])
+        assert await storage.update_quiz_state(1, 1, 1)
+        return await storage.update_quiz_state(1, 2, 1, expected_version=0), await storage.get_quiz_state(1)
+
+    applied, state = run_storage(scenario)
+    assert not applied
+    assert (state['question_index'], state['version']) == (1, 1)
+
+
+def test_save_quiz_states_ignores_stale_rows(run_storage):
+    async def scenario(storage):
+        old_history = await storage.init_user_quiz(1, [0, 1, 2])
+        new_history = await storage.init_user_quiz(1, [0, 1, 2])
+        await storage.save_quiz_states([(1, old_history, 2, 2, 5)])
+        after_old_history = await storage.get_quiz_state(1)
+
+        await storage.save_quiz_states([(1, new_history, 2, 1, 3)])
+        await storage.save_quiz_states([(1, new_history, 1, 0, 2)])
+        await storage.save_quiz_states([(1, new_history, 1, 0, 3)])
+        return after_old_history, await storage.get_quiz_state(1)
+
+    after_old_history, state = run_storage(scenario)
+    assert (after_old_history['question_index'], after_old_history['version']) == (0, 0)
+    assert (state['question_index'], state['score'], state['version']) == (2, 1, 3)
+
+
+def test_save_quiz_states_skips_cleared_state(run_storage):
+    async def scenario(storage):
+        history_id = await storage.init_user_quiz(1, [0, 1, 2])
+        await storage.clear_quiz_state(1)
+        await storage.save_quiz_states([(1, history_id, 1, 1, 1)])
+        return await storage.get_quiz_state(1)
+
+    assert run_storage(scenario) is None
+
+
+def test_complete_quiz_runs_once(run_storage):
+    async def scenario(storage):
+        first = await _play(storage, 1, 7)
+        second = await storage.complete_quiz(1, 7, 10)
+        return first, second, await storage.get_user_stats(1), await storage.get_quiz_state(1)
+
+    first, second, stats, state = run_storage(scenario)
+    assert first['total_quizzes'] == 1 and first['best_score'] == 7
+    assert second is None
+    assert (stats['total_quizzes'], stats['total_correct'], stats['total_questions']) == (1, 7, 10)
+    assert state['completed'] == 1
+
+
+def test_last_quiz_result(run_storage):
+    async def scenario(storage):
+        await _play(storage, 1, 4)
+        await _play(storage, 1, 9)
+        return await storage.get_last_quiz_result(1), await storage.get_user_stats(1)
+
+    result, stats = run_storage(scenario)
+    assert (result['score'], result['total_questions']) == (9, 10)
+    assert (stats['total_quizzes'], stats['best_score'], stats['total_correct']) == (2, 9, 13)
+    assert stats['username'] == 'user1'
+
+
+def test_top_players_and_rank(run_storage):
+    async def scenario(storage):
+        # Порядок: лучший результат, затем всего верных, затем число квизов
+        await _play(storage, 1, 6)
+        await _play(storage, 2, 9)
+        await _play(storage, 3, 6)
+        await _play(storage, 3, 5)
+        await _play(storage, 4, 3)
+        top = await storage.get_top_players(3)
+        ranks = [await storage.get_user_rank(user_id) for user_id in (1, 2, 3, 4, 5)]
+        return top, ranks, await storage.get_top_players(10, period='day')
+
+    top, ranks, today = run_storage(scenario)
+    assert [player['user_id'] for player in top] == [2, 3, 1]
+    assert top[1]['total_quizzes'] == 2 and top[1]['best_score'] == 6
+    assert top[0]['accuracy'] == 90.0
+    assert ranks == [(3, 4), (1, 4), (2, 4), (4, 4), None]
+    assert [player['user_id'] for player in today] == [2, 3, 1, 4]
+
+
+def test_question_stats(run_storage):
+    async def scenario(storage):
+        history_id = await storage.init_user_quiz(1, [10, 11, 12])
+        answers = [
+            # user_id, history_id, question_id, chosen_option, is_correct, response_ms, answered_at
+            (1, history_id, 10, 0, 1, 500, '2026-01-01 10:00:00'),
+            (2, history_id, 10, 0, 1, 700, '2026-01-01 10:00:01'),
+            (3, history_id, 10, 2, 0, 900, '2026-01-01 10:00:02'),
+            (1, history_id, 11, 1, 0, 400, '2026-01-01 10:00:03'),
+            (2, history_id, 11, 3, 0, 600, '2026-01-01 10:00:04'),
+            (1, history_id, 12, 1, 1, 300, '2026-01-01 10:00:05'),
+        ]
+        await storage.save_answers(answers[:3])
+        await storage.save_answers(answers[3:])
+        return (await storage.get_question_stats(2, hardest=True),
+                await storage.get_question_stats(1, hardest=False))
+
+    hardest, easiest = run_storage(scenario)
+    assert [question['question_id'] for question in hardest] == [11, 10]
+    assert hardest[0] == {'question_id': 11, 'answered': 2, 'correct': 0, 'accuracy': 0.0, 'picks': {1: 1, 3: 1}}
+    assert hardest[1]['picks'] == {0: 2, 2: 1} and hardest[1]['accuracy'] == 66.7
+    assert [question['question_id'] for question in easiest] == [12]
+
+
+def test_profile_is_rewritten(run_storage):
+    async def scenario(storage):
+        await storage.init_user_quiz(1, [0], 'old', 'Имя', '')
+        await storage.init_user_quiz(1, [0], 'new', 'Имя', 'Фамилия')
+        return await storage.get_user_stats(1)
+
+    stats = run_storage(scenario)
+    assert (stats['username'], stats['first_name'], stats['last_name']) == ('new', 'Имя', 'Фамилия')
+
+
+def test_profile_cache_skips_unchanged_names(tmp_path):
+    """Неизменившийся профиль из кэша не записывается в базу повторно"""
+    from database import Database
+
+    async def scenario():
+        db = Database(str(tmp_path / 'quiz.db'), background_jobs=False)
+        await db.create_tables()
+        try:
+            await db.init_user_quiz(1, [0], 'user1', 'Имя', '')
+            async with db.pools[0].acquire() as conn:
+                await conn.execute("UPDATE user_stats SET username = 'marker'")
+                await conn.commit()
+            await db.init_user_quiz(1, [0], 'user1', 'Имя', '')
+            unchanged = await db.get_user_stats(1)
+            await db.init_user_quiz(1, [0], 'user2', 'Имя', '')
+            return unchanged, await db.get_user_stats(1)
+        finally:
+            await db.close()
+
+    unchanged, renamed = asyncio.run(scenario())
+    assert unchanged['username'] == 'marker'
+    assert renamed['username'] == 'user2'
+
+
+
+def test_redis_connection_survives_cancelled_request(redis_url):
+    from redis_storage import RedisConnection
+
+    class Connection(RedisConnection):
+        async def _read_reply(self):
+            self.reading.set()
+            return await super()._read_reply()
+
+    async def scenario():
+        redis = Connection(redis_url)
+        redis.reading = asyncio.Event()
+        try:
+            await redis.execute('SET', 'a', '1')
+            await redis.execute('SET', 'b', '2')
+            redis.reading.clear()
+            # Отменяем запрос, когда команды отправлены, а ответы еще не прочитаны
+            task = asyncio.create_task(redis.pipeline([('GET', 'a')] * 100))
+            await redis.reading.wait()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return await redis.execute('GET', 'b')
+        finally:
+            await redis.close()
+
+    # fakeredis отвечает на GET простой строкой, Redis - bulk string
+    reply = asyncio.run(scenario())
+    assert (reply.decode() if isinstance(reply, bytes) else reply) == '2'
@@ -0,0 +1,88 @@
+"""Прием обновлений по webhook (webhook.py)"""
+
+import asyncio
+import json
+from aiohttp import ClientSession
+from webhook import SECRET_HEADER, WebhookServer, replay
+
+
+def _message(update_id: int, user_id: int = 1) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': 0, 'text': str(update_id),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Имя'},
+        },
+    }
+
+
+class RecordingDispatcher:
+    """Диспетчер, запоминающий обновления; обработку можно придержать"""
+
+    def __init__(self):
+        self.updates = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def feed_update(self, bot, update):
+        await self.release.wait()
+        self.updates.append(update.update_id)
+
+
+def _serve(scenario, **kwargs):
+    async def main():
+        dp = RecordingDispatcher()
+        server = WebhookServer(dp, None, host='127.0.0.1', port=0, path='/webhook', secret='s3cret', **kwargs)
+        await server.start()
+        try:
+            result = await scenario(dp, f'http://127.0.0.1:{server.port}/webhook')
+        finally:
+            await server.close()
+        return result, dp.updates
+    return asyncio.run(main())
+
+
+async def _post(url: str, data: dict, secret: str = 's3cret') -> int:
+    async with ClientSession() as session:
+        async with session.post(url, json=data, headers={SECRET_HEADER: secret}) as response:
+            return response.status
+
+
+def test_secret_is_checked():
+    async def scenario(dp, url):
+        return [await _post(url, _message(1)),
+                await _post(url, _message(2), secret='wrong'),
+                await _post(url, _message(3), secret='')]
+
+    statuses, updates = _serve(scenario)
+    assert statuses[0] == 200
+    assert statuses[1] in (401, 403) and statuses[2] in (401, 403)
+    assert updates == [1]
+
+
+def test_full_queue_is_rejected():
+    async def scenario(dp, url):
+        dp.release.clear()
+        statuses = [await _post(url, _message(1))]
+        # Первое обновление взял обработчик, второе ждет в очереди
+        await asyncio.sleep(0.05)
+        statuses += [await _post(url, _message(2)), await _post(url, _message(3))]
+        dp.release.set()
+        return statuses
+
+    statuses, updates = _serve(scenario, workers=1, queue_size=1)
+    assert statuses == [200, 200, 503]
+    assert updates == [1, 2]
+
+
+def test_replay_recorded_updates(tmp_path):
+    recorded = tmp_path / 'updates.jsonl'
+    recorded.write_text(''.join(json.dumps(_message(i, i % 3)) + '\n' for i in range(1, 21)), encoding='utf-8')
+
+    async def scenario(dp, url):
+        return await replay(str(recorded), url, 's3cret')
+
+    statuses, updates = _serve(scenario)
+    assert statuses == {200: 20}
+    assert sorted(updates) == list(range(1, 21))
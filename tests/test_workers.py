@@ -0,0 +1,63 @@
+"""Обработка обновлений в процессе-обработчике (workers.py)"""
+
+import asyncio
+import queue
+import time
+from workers import UpdateConsumer, update_user_id
+
+
+def _message(update_id: int, user_id: int) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': 0, 'text': str(update_id),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Имя'},
+        },
+    }
+
+
+class RecordingDispatcher:
+    """Диспетчер, запоминающий порядок и время обработки обновлений"""
+
+    def __init__(self, delays: dict):
+        self.delays = delays
+        self.handled = []
+        self.started = time.monotonic()
+
+    async def feed_update(self, bot, update):
+        user_id = update.message.from_user.id
+        await asyncio.sleep(self.delays.get(user_id, 0))
+        self.handled.append((user_id, update.update_id, time.monotonic() - self.started))
+
+
+def _consume(updates: list, dp, concurrency: int):
+    source = queue.Queue()
+    for data in updates + [None]:
+        source.put(data)
+    asyncio.run(UpdateConsumer(dp, None, source, concurrency=concurrency).run())
+    return dp.handled
+
+
+def test_user_id_of_update():
+    assert update_user_id(_message(1, 42)) == 42
+    callback = {'update_id': 2, 'callback_query': {'id': '1', 'from': {'id': 7}, 'chat_instance': '1'}}
+    assert update_user_id(callback) == 7
+
+
+def test_updates_of_one_user_keep_order():
+    updates = [_message(i, i % 3 + 1) for i in range(30)]
+    handled = _consume(updates, RecordingDispatcher({1: 0.01, 2: 0.002}), concurrency=4)
+    assert len(handled) == 30
+    for user_id in (1, 2, 3):
+        ids = [update_id for user, update_id, _ in handled if user == user_id]
+        assert ids == sorted(ids)
+
+
+def test_busy_user_does_not_block_others():
+    # Первый пользователь присылает больше обновлений, чем мест у обработчика
+    updates = [_message(i, 1) for i in range(5)] + [_message(100, 2)]
+    handled = _consume(updates, RecordingDispatcher({1: 0.1}), concurrency=2)
+    (other,) = [item for item in handled if item[0] == 2]
+    assert other[2] < 0.1
+    assert [update_id for user, update_id, _ in handled if user == 1] == [0, 1, 2, 3, 4]
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Режим webhook для Python Quiz Bot.
+
+Обновления принимает встроенный сервер aiohttp по адресу WEBHOOK_PATH.
+Запрос проверяется по секрету (заголовок X-Telegram-Bot-Api-Secret-Token),
+обновление кладется в очередь, и Telegram сразу получает ответ 200.
+Очередь разбирают WEBHOOK_WORKERS обработчиков, поэтому одновременно
+обрабатывается не больше WEBHOOK_WORKERS обновлений. Если очередь
+заполнена, сервер отвечает 503, и Telegram повторит доставку позже.
+
+Бот запускается в этом режиме при BOT_MODE=webhook. С заданным
+WEBHOOK_URL обязателен WEBHOOK_SECRET, иначе webhook не регистрируется.
+Для локальной проверки можно не задавать WEBHOOK_URL и отправить на
+сервер записанные обновления (по одному JSON на строку):
+  python webhook.py replay updates.jsonl [--url http://127.0.0.1:8080/webhook]
+"""
+import argparse
+import asyncio
+import secrets
+import time
+from aiohttp import web
+from aiogram.types import Update
+from config import (
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE
+)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """Прием обновлений по webhook с ограниченным пулом обработчиков"""
+
+    def __init__(self, dp, bot, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT,
+                 path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET,
+                 workers: int = WEBHOOK_WORKERS, queue_size: int = WEBHOOK_QUEUE_SIZE):
+        self.dp = dp
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.workers = max(1, workers)
+        self._queue = asyncio.Queue(max(1, queue_size))
+        self._worker_tasks = []
+        self._runner = None
+
+    async def start(self):
+        """Запустить обработчиков и HTTP-сервер"""
+        if self._runner is not None:
+            return
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        # При port=0 система выбирает свободный порт
+        self.port = self._runner.addresses[0][1]
+        print(f"🌐 Webhook слушает http://{self.host}:{self.port}{self.path}, обработчиков: {self.workers}")
+
+    async def close(self):
+        """Перестать принимать обновления и дообработать принятые"""
+        if self._runner is None:
+            return
+        await self._runner.cleanup()
+        self._runner = None
+        await self._queue.join()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and not secrets.compare_digest(request.headers.get(SECRET_HEADER, ''), self.secret):
+            return web.Response(status=401)
+        try:
+            data = await request.json()
+        except ValueError as e:
+            print(f"⚠️ Некорректное обновление: {e}")
+            return web.Response(status=400)
+        if not isinstance(data, dict):
+            return web.Response(status=400)
+        try:
+            self._queue.put_nowait(data)
+        except asyncio.QueueFull:
+            # Telegram повторит доставку позже, а память сервера не растет
+            return web.Response(status=503)
+        return web.Response()
+
+    async def process(self, data: dict):
+        """Разобрать обновление и передать его диспетчеру"""
+        update = Update.model_validate(data, context={'bot': self.bot})
+        await self.dp.feed_update(self.bot, update)
+
+    async def _worker(self):
+        while True:
+            data = await self._queue.get()
+            try:
+                await self.process(data)
+            except Exception as e:
+                print(f"Ошибка при обработке обновления {data.get('update_id')}: {e}")
+            finally:
+                self._queue.task_done()
+
+
+async def replay(path: str, url: str, secret: str):
+    """Отправить записанные обновления на локальный webhook, вернуть число ответов по кодам"""
+    from aiohttp import ClientSession
+    with open(path, encoding='utf-8') as file:
+        updates = [line for line in file if line.strip()]
+    headers = {'Content-Type': 'application/json'}
+    if secret:
+        headers[SECRET_HEADER] = secret
+    started = time.monotonic()
+    statuses = {}
+    async with ClientSession() as session:
+        for line in updates:
+            async with session.post(url, data=line.encode('utf-8'), headers=headers) as response:
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+    elapsed = time.monotonic() - started
+    print(f" Отправлено обновлений: {len(updates)} за {elapsed:.2f} с, ответы: {statuses}")
+    return statuses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Webhook Python Quiz Bot")
+    commands = parser.add_subparsers(dest='command', required=True)
+    replay_parser = commands.add_parser('replay', help="отправить записанные обновления на webhook")
+    replay_parser.add_argument('file', help="файл с обновлениями, по одному JSON на строку")
+    replay_parser.add_argument('--url', default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}",
+                               help="адрес webhook (по умолчанию локальный сервер из config.py)")
+    replay_parser.add_argument('--secret', default=WEBHOOK_SECRET, help="секрет (по умолчанию из config.py)")
+    args = parser.parse_args()
+
+    if args.command == 'replay':
+        asyncio.run(replay(args.file, args.url, args.secret))
@@ -0,0 +1,253 @@
+"""Многопроцессный режим Python Quiz Bot.
+
+Процесс-диспетчер получает обновления (long polling или webhook) и, не
+разбирая их в объекты aiogram, раскладывает по BOT_WORKERS
+процессам-обработчикам по user_id. Все обновления одного пользователя
+попадают в один процесс и обрабатываются по порядку, поэтому кэш сессий,
+защита от повторных нажатий и журнал ответов остаются корректными,
+а разбор обновлений, обработчики и форматирование текста
+распределяются по ядрам. У каждого обработчика свои соединения с базой.
+"""
+import asyncio
+import multiprocessing
+import os
+from collections import deque
+from contextlib import contextmanager
+from aiohttp import ClientError, ClientSession, ClientTimeout
+from aiogram.types import Update
+from config import OUTBOUND_GLOBAL_RATE, DEDUP_FILE, WORKER_CONCURRENCY
+from webhook import WebhookServer
+
+
+def update_user_id(data: dict) -> int:
+    """Пользователь (или чат), от которого пришло обновление; 0, если его нет"""
+    for key, event in data.items():
+        if key == 'update_id' or not isinstance(event, dict):
+            continue
+        sender = event.get('from') or event.get('user') or event.get('chat')
+        if isinstance(sender, dict) and 'id' in sender:
+            return sender['id']
+    return 0
+
+
+def worker_environment(index: int, count: int) -> dict:
+    """Переменные окружения процесса-обработчика, отличающиеся от общих.
+
+    Рейтинг и счетчики вопросов в памяти видели бы только своих
+    пользователей, поэтому отключаются. Общий лимит исходящих сообщений
+    делится между процессами. Фоновые задачи базы и резервные копии
+    выполняет только первый обработчик.
+    """
+    environment = {
+        'LEADERBOARD_IN_MEMORY': '0',
+        'OUTBOUND_GLOBAL_RATE': str(OUTBOUND_GLOBAL_RATE / count),
+        'DEDUP_FILE': f"{DEDUP_FILE}.{index}" if DEDUP_FILE else '',
+    }
+    if index:
+        environment['DB_BACKGROUND_JOBS'] = '0'
+        environment['BACKUP_INTERVAL'] = '0'
+    return environment
+
+
+@contextmanager
+def _environment(overrides: dict):
+    saved = {name: os.environ.get(name) for name in overrides}
+    os.environ.update(overrides)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+class Supervisor:
+    """Процессы-обработчики и распределение обновлений между ними.
+
+    target(index, updates) - функция процесса-обработчика, updates -
+    его очередь обновлений (None в очереди означает остановку).
+    Процессы запускаются методом spawn: настройки читаются из окружения
+    заново, с поправками из worker_environment. Упавший обработчик
+    перезапускается, необработанные обновления остаются в его очереди.
+    """
+
+    # Период проверки процессов (сек) и сколько ждать их остановки
+    CHECK_INTERVAL = 1.0
+    STOP_TIMEOUT = 30
+
+    def __init__(self, count: int, target):
+        self.count = max(1, count)
+        self.target = target
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = [self._context.Queue() for _ in range(self.count)]
+        self._processes = [None] * self.count
+        self._monitor_task = None
+        self._stopping = False
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=self.target, args=(index, self._queues[index]), name=f"quiz-worker-{index}"
+        )
+        with _environment(worker_environment(index, self.count)):
+            process.start()
+        self._processes[index] = process
+        print(f"👷 Запущен обработчик {index} (pid {process.pid})")
+
+    async def start(self):
+        """Запустить процессы-обработчики"""
+        for index in range(self.count):
+            self._spawn(index)
+        self._monitor_task = asyncio.create_task(self._monitor())
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(self.CHECK_INTERVAL)
+            for index, process in enumerate(self._processes):
+                # После запроса остановки завершившиеся процессы не перезапускаем
+                if self._stopping:
+                    return
+                if not process.is_alive():
+                    print(f"⚠️ Обработчик {index} завершился с кодом {process.exitcode}, перезапуск")
+                    self._spawn(index)
+
+    def route(self, data: dict):
+        """Передать обновление процессу его пользователя"""
+        self._queues[update_user_id(data) % self.count].put(data)
+
+    async def close(self):
+        """Дать обработчикам разобрать очереди и остановить их"""
+        self._stopping = True
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            try:
+                await self._monitor_task
+            except asyncio.CancelledError:
+                pass
+            self._monitor_task = None
+        for queue in self._queues:
+            queue.put(None)
+        for index, process in enumerate(self._processes):
+            if process is None:
+                continue
+            await asyncio.to_thread(process.join, self.STOP_TIMEOUT)
+            if process.is_alive():
+                print(f"⚠️ Обработчик {index} не остановился, завершаем принудительно")
+                # SIGTERM обработчики игнорируют
+                process.kill()
+                await asyncio.to_thread(process.join)
+
+
+class UpdateConsumer:
+    """Обработка обновлений из очереди процесса-обработчика.
+
+    Обновления разных пользователей обрабатываются параллельно (не больше
+    concurrency пользователей одновременно), обновления одного пользователя -
+    строго в порядке поступления. Место занимает только задача пользователя,
+    разбирающая его очередь, поэтому пользователь, присылающий обновления
+    слишком часто, не задерживает остальных.
+    """
+
+    def __init__(self, dp, bot, updates, concurrency: int = WORKER_CONCURRENCY):
+        self.dp = dp
+        self.bot = bot
+        self.updates = updates
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._pending = {}  # user_id -> необработанные обновления пользователя
+        self._tasks = set()
+
+    async def run(self):
+        """Обрабатывать обновления до получения None"""
+        while True:
+            data = await asyncio.to_thread(self.updates.get)
+            if data is None:
+                break
+            user_id = update_user_id(data)
+            pending = self._pending.get(user_id)
+            if pending is not None:
+                # Задача пользователя уже работает и обработает обновление следом
+                pending.append(data)
+                continue
+            await self._semaphore.acquire()
+            self._pending[user_id] = deque([data])
+            task = asyncio.create_task(self._drain(user_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _drain(self, user_id: int):
+        pending = self._pending[user_id]
+        try:
+            while pending:
+                await self._handle(pending.popleft())
+        finally:
+            del self._pending[user_id]
+            self._semaphore.release()
+
+    async def _handle(self, data: dict):
+        try:
+            update = Update.model_validate(data, context={'bot': self.bot})
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            print(f"Ошибка при обработке обновления {data.get('update_id')}: {e}")
+
+
+class UpdatePoller:
+    """Получение обновлений long polling без разбора в объекты aiogram"""
+
+    # Пауза после ошибки запроса (сек)
+    ERROR_PAUSE = 5
+
+    def __init__(self, bot, route, allowed_updates: list, timeout: int = 30):
+        self.url = bot.session.api.api_url(token=bot.token, method='getUpdates')
+        self.route = route
+        self.allowed_updates = allowed_updates
+        self.timeout = timeout
+        self.offset = None
+
+    async def _request(self, session: ClientSession, timeout: int) -> list:
+        payload = {'timeout': timeout, 'allowed_updates': self.allowed_updates}
+        if self.offset is not None:
+            payload['offset'] = self.offset
+        async with session.post(self.url, json=payload,
+                                timeout=ClientTimeout(total=timeout + 10)) as response:
+            data = await response.json()
+        if not data.get('ok'):
+            raise ClientError(data.get('description', f"HTTP {response.status}"))
+        return data['result']
+
+    async def run(self):
+        """Получать обновления и передавать их route, пока задачу не отменят"""
+        async with ClientSession() as session:
+            try:
+                while True:
+                    try:
+                        updates = await self._request(session, self.timeout)
+                    except (ClientError, asyncio.TimeoutError, ValueError) as e:
+                        print(f"⚠️ Ошибка получения обновлений: {e}")
+                        await asyncio.sleep(self.ERROR_PAUSE)
+                        continue
+                    for data in updates:
+                        self.route(data)
+                        self.offset = data['update_id'] + 1
+            finally:
+                # Подтверждаем переданные обработчикам обновления, чтобы
+                # после перезапуска Telegram не прислал их снова
+                if self.offset is not None:
+                    try:
+                        await self._request(session, 0)
+                    except Exception:
+                        pass
+
+
+class RoutingWebhookServer(WebhookServer):
+    """Webhook диспетчера: обновления не разбираются, а передаются обработчикам"""
+
+    def __init__(self, route, **kwargs):
+        super().__init__(None, None, workers=1, **kwargs)
+        self.route = route
+
+    async def process(self, data: dict):
+        self.route(data)